@@ -0,0 +1,417 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import text
+from schema_snapshot import get_schema_snapshot
+from table_selection import normalize_question
+from instrumentation import increment, record_cache
+from runtime import add_event_handler
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("answer_cache_enabled", "true").lower() in ("1", "true", "yes")
+# SQLite file with the request log and the stored answers, shared by every worker on the host
+ANSWER_CACHE_PATH = os.getenv(
+    "answer_cache_path", os.path.join(tempfile.gettempdir(), "nl_to_sql_answers.sqlite")
+)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("answer_cache_max_entries", "500"))
+# Upper bound on an answer's lifetime, for changes the table signatures don't catch
+ANSWER_CACHE_TTL = float(os.getenv("answer_cache_ttl", "86400"))
+# Questions precomputed per pass, and how often a question must have been asked first
+ANSWER_CACHE_TOP_QUESTIONS = int(os.getenv("answer_cache_top_questions", "50"))
+ANSWER_CACHE_MIN_REQUESTS = int(os.getenv("answer_cache_min_requests", "3"))
+# Local hours in which answers are (re)computed, e.g. "1-6" or "22-5"; empty for any time
+ANSWER_CACHE_OFF_PEAK_HOURS = os.getenv("answer_cache_off_peak_hours", "1-6")
+# Seconds between background passes started from the request path (0 disables them)
+ANSWER_CACHE_INTERVAL = float(os.getenv("answer_cache_interval", "300"))
+# Requests not seen again for this long drop out of the log
+ANSWER_CACHE_LOG_WINDOW = float(os.getenv("answer_cache_log_window", "604800"))
+# Logged requests buffered in memory before they are written
+ANSWER_CACHE_LOG_BATCH = int(os.getenv("answer_cache_log_batch", "100"))
+
+_cache: Optional["AnswerCache"] = None
+_cache_lock = threading.Lock()
+
+# Answer function of each database the chain was built for, used by the background passes
+_computers: Dict[str, Callable[[str], Optional[Dict[str, Any]]]] = {}
+
+
+def in_off_peak(hours: str = ANSWER_CACHE_OFF_PEAK_HOURS, now: Optional[datetime.datetime] = None) -> bool:
+    """Whether the local hour is within "start-end" (end exclusive, may wrap past midnight)."""
+    if not hours.strip():
+        return True
+    start, end = (int(hour) for hour in hours.split("-", 1))
+    hour = (now or datetime.datetime.now()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+# Column type -> aggregate summarizing its values; columns of other types (bool, uuid, json,
+# arrays, geometry...) only count through COUNT(*), since the aggregate fails on them somewhere
+SIGNATURE_AGGREGATES = (
+    (re.compile(r"^(tiny|small|medium|big)?int(eger)?\b|^(decimal|numeric|float|double|real)\b"), "SUM({})"),
+    (re.compile(r"^(date|datetime|time|timestamp)\b"), "MAX({})"),
+    (re.compile(r"^(n?var)?char|^character|^(tiny|medium|long)?text\b|^clob\b"), "SUM(LENGTH({}))"),
+)
+
+
+def _signature_aggregate(column: str, column_type: Any) -> Optional[str]:
+    type_name = str(column_type).lower()
+    if "[]" in type_name:
+        return None
+    return next((aggregate.format(column) for pattern, aggregate in SIGNATURE_AGGREGATES
+                 if pattern.search(type_name)), None)
+
+
+def table_signatures(db, table_names: List[str]) -> Dict[str, str]:
+    """
+    Cheap per-table change signature: row count, and per column the sum of numbers, the
+    latest date or the total text length. An edit that keeps all of them is only noticed
+    once the answer expires. Tables whose signature can't be read are left out.
+    """
+    engine = db._engine
+    quote = engine.dialect.identifier_preparer.quote
+    snapshot = get_schema_snapshot(db)
+    signatures = {}
+    with engine.connect() as conn:
+        for table_name in table_names:
+            try:
+                parts = ["COUNT(*)"] + [aggregate for aggregate in (
+                    _signature_aggregate(quote(col["name"]), col["type"]) for col in snapshot.get_columns(table_name)
+                ) if aggregate]
+                row = conn.execute(text(f"SELECT {', '.join(parts)} FROM {quote(table_name)}")).one()
+                signatures[table_name] = json.dumps([str(value) for value in row])
+            except Exception as e:
+                logger.error(f"Error reading the signature of table {table_name}: {e}")
+            # Each table is read in its own transaction, so one failure (which aborts the
+            # transaction on PostgreSQL) doesn't fail the tables after it
+            conn.rollback()
+    return signatures
+
+
+def table_update_times(db, table_names: List[str]) -> Dict[str, str]:
+    """
+    information_schema.tables.update_time of each table, read without touching the tables.
+    Only MySQL reports it (and not for every engine); other databases return {}.
+    """
+    engine = db._engine
+    if engine.dialect.name != "mysql" or not table_names:
+        return {}
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT table_name, update_time FROM information_schema.tables WHERE table_schema = DATABASE()"
+            )).fetchall()
+    except Exception as e:
+        logger.error(f"Error reading table update times: {e}")
+        return {}
+    wanted = set(table_names)
+    return {name: str(update_time) for name, update_time in rows if name in wanted and update_time is not None}
+
+
+def _private_file(path: str) -> None:
+    """Create the file readable by its owner only (logged questions may be sensitive), or restrict an existing one."""
+    os.close(os.open(path, os.O_CREAT | os.O_RDWR | getattr(os, "O_NOFOLLOW", 0), 0o600))
+    os.chmod(path, 0o600)
+
+
+class AnswerCache:
+    """
+    Materialized final answers of the most frequent questions. Questions are logged under
+    their normalized form; a background pass precomputes the top ones through the full
+    chain during off-peak hours and stores each answer with the tables it read and their
+    signatures. An answer is served until one of its tables changes (a signature differs,
+    or a table_changed event names it) or the schema changes, and is only recomputed then.
+    Beyond max_entries, the answers with the lowest requests x regeneration cost are evicted.
+    The signatures scan whole tables, so they are only compared off-peak; passes at peak
+    compare MySQL's table update times instead.
+    """
+
+    def __init__(self, path: str, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: float = ANSWER_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._pending: Counter = Counter()
+        self._examples: Dict[tuple, str] = {}
+        self._pending_lock = threading.Lock()
+        self._running: Dict[str, threading.Lock] = {}
+        self._last_pass: Dict[str, float] = {}
+        self._local = threading.local()
+        self._flushing = threading.Lock()
+        _private_file(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS requests ("
+                "source TEXT, question TEXT, example TEXT, count INTEGER, last_seen REAL, "
+                "PRIMARY KEY (source, question))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "source TEXT, question TEXT, fingerprint TEXT, answer TEXT, query TEXT, tables TEXT, "
+                "signatures TEXT, cost REAL, computed_at REAL, stale INTEGER DEFAULT 0, "
+                "PRIMARY KEY (source, question))"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per thread, kept open: lookups run on every chat request
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        with conn:
+            yield conn
+
+    @staticmethod
+    def _source(db) -> str:
+        return getattr(db, "_engine", db).url.render_as_string(hide_password=True)
+
+    # Chat path
+
+    def lookup(self, db, question: str) -> Optional[Dict[str, Any]]:
+        """Log the question and return its stored {"answer", "query"} while still fresh, else None."""
+        source, key = self._source(db), normalize_question(question)
+        self.log_request(source, key, question)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT answer, query FROM answers WHERE source = ? AND question = ? AND fingerprint = ? "
+                "AND stale = 0 AND computed_at > ?",
+                (source, key, get_schema_snapshot(db).fingerprint, time.time() - self.ttl)
+            ).fetchone()
+        record_cache("answer", row is not None)
+        return {"answer": row[0], "query": row[1]} if row else None
+
+    def log_request(self, source: str, key: str, question: str) -> None:
+        """
+        Count a request. Counts are buffered and written by the background pass, or by
+        a thread of their own once a batch is full, never on the request path.
+        """
+        with self._pending_lock:
+            self._pending[(source, key)] += 1
+            self._examples[(source, key)] = question
+            full = sum(self._pending.values()) >= ANSWER_CACHE_LOG_BATCH
+        if full and not self._flushing.locked():
+            threading.Thread(target=self.flush_log, name="answer-cache-log", daemon=True).start()
+
+    def flush_log(self) -> None:
+        if not self._flushing.acquire(blocking=False):
+            return
+        try:
+            self._write_log()
+        finally:
+            self._flushing.release()
+
+    def _write_log(self) -> None:
+        with self._pending_lock:
+            pending, examples = self._pending, self._examples
+            self._pending, self._examples = Counter(), {}
+        if not pending:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO requests (source, question, example, count, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (source, question) DO UPDATE SET count = count + excluded.count, "
+                "example = excluded.example, last_seen = excluded.last_seen",
+                [(source, key, examples[(source, key)], count, now) for (source, key), count in pending.items()]
+            )
+
+    def invalidate_table(self, db, table_name: str) -> int:
+        """Mark every answer that read a table stale. Returns the number of answers marked."""
+        source = self._source(db)
+        with self._connect() as conn:
+            rows = conn.execute("SELECT question, tables FROM answers WHERE source = ? AND stale = 0", (source,)).fetchall()
+            stale = [(source, question) for question, tables in rows
+                     if table_name.lower() in (name.lower() for name in json.loads(tables))]
+            conn.executemany("UPDATE answers SET stale = 1 WHERE source = ? AND question = ?", stale)
+        return len(stale)
+
+    # Background passes
+
+    def schedule_precompute(self, db) -> None:
+        """Start a background pass if the interval has passed and none is running for this database."""
+        source = self._source(db)
+        if ANSWER_CACHE_INTERVAL <= 0 or source not in _computers:
+            return
+        running = self._running.setdefault(source, threading.Lock())
+        if running.locked() or time.time() - self._last_pass.get(source, 0) < ANSWER_CACHE_INTERVAL:
+            return
+        self._last_pass[source] = time.time()
+        threading.Thread(target=self.precompute, args=(db,), name="answer-cache-precompute", daemon=True).start()
+
+    def check_freshness(self, db, full: bool = True) -> int:
+        """
+        Mark answers stale whose schema or tables changed. With full, the table signatures
+        are recomputed (a scan of every cached table); otherwise only the update times are
+        compared. Returns the number marked.
+        """
+        source = self._source(db)
+        fingerprint = get_schema_snapshot(db).fingerprint
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT question, fingerprint, tables, signatures FROM answers WHERE source = ? AND stale = 0", (source,)
+            ).fetchall()
+        tables = sorted({name for row in rows if row[1] == fingerprint for name in json.loads(row[2])})
+        kind = "checksums" if full else "update_times"
+        current = table_signatures(db, tables) if full else table_update_times(db, tables)
+        stale = []
+        for question, entry_fingerprint, entry_tables, signatures in rows:
+            stored = json.loads(signatures)
+            if entry_fingerprint != fingerprint or kind not in stored:
+                stale.append((source, question))
+            elif full and any(name not in stored[kind] or current.get(name) != stored[kind][name]
+                              for name in json.loads(entry_tables)):
+                # A signature that couldn't be read, then or now, can't show the table is unchanged
+                stale.append((source, question))
+            elif not full and any(current.get(name) != value for name, value in stored[kind].items()):
+                stale.append((source, question))
+        with self._connect() as conn:
+            conn.executemany("UPDATE answers SET stale = 1 WHERE source = ? AND question = ?", stale)
+        return len(stale)
+
+    def precompute(self, db, force: bool = False) -> Dict[str, int]:
+        """
+        One pass: write the request log, mark changed answers stale and, during off-peak
+        hours (or when forced), compute the most requested questions that have no fresh
+        answer. At peak only the cheap update-time check runs. Returns counts of the
+        answers marked stale, computed and evicted.
+        """
+        source = self._source(db)
+        compute = _computers.get(source)
+        running = self._running.setdefault(source, threading.Lock())
+        if compute is None or not running.acquire(blocking=False):
+            return {}
+        try:
+            self.flush_log()
+            off_peak = force or in_off_peak()
+            stats = {"stale": self.check_freshness(db, full=off_peak), "computed": 0, "evicted": 0}
+            if not off_peak:
+                return stats
+
+            fingerprint = get_schema_snapshot(db).fingerprint
+            table_names = get_schema_snapshot(db).get_table_names()
+            with self._connect() as conn:
+                conn.execute("DELETE FROM requests WHERE last_seen <= ?", (time.time() - ANSWER_CACHE_LOG_WINDOW,))
+                candidates = conn.execute(
+                    "SELECT r.question, r.example FROM requests r LEFT JOIN answers a "
+                    "ON a.source = r.source AND a.question = r.question AND a.fingerprint = ? AND a.stale = 0 "
+                    "AND a.computed_at > ? "
+                    "WHERE r.source = ? AND r.count >= ? AND a.question IS NULL ORDER BY r.count DESC LIMIT ?",
+                    (fingerprint, time.time() - self.ttl, source, ANSWER_CACHE_MIN_REQUESTS, ANSWER_CACHE_TOP_QUESTIONS)
+                ).fetchall()
+
+            for key, question in candidates:
+                try:
+                    started = time.perf_counter()
+                    output = compute(question)
+                    cost = time.perf_counter() - started
+                    if not output:
+                        continue
+                    tables = sorted(name for name in set(output["tables"]) if name in table_names)
+                    # Signatures are read after the answer, so a change during the computation marks it stale
+                    signatures = {"checksums": table_signatures(db, tables),
+                                  "update_times": table_update_times(db, tables)}
+                    with self._connect() as conn:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO answers (source, question, fingerprint, answer, query, tables, "
+                            "signatures, cost, computed_at, stale) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                            (source, key, fingerprint, output["answer"], output.get("query"), json.dumps(tables),
+                             json.dumps(signatures), cost, time.time())
+                        )
+                    stats["computed"] += 1
+                except Exception as e:
+                    logger.error(f"Error precomputing the answer to '{question}': {e}")
+
+            stats["evicted"] = self.evict()
+            increment("answer_cache_computed", stats["computed"])
+            logger.info(f"Answer cache pass: {stats}")
+            return stats
+        finally:
+            running.release()
+
+    def evict(self) -> int:
+        """Keep the max_entries answers worth the most: requests x regeneration cost. Stale ones go first."""
+        with self._connect() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            conn.execute(
+                "DELETE FROM answers WHERE rowid IN ("
+                "SELECT a.rowid FROM answers a LEFT JOIN requests r ON r.source = a.source AND r.question = a.question "
+                "ORDER BY a.stale DESC, COALESCE(r.count, 0) * a.cost ASC LIMIT ?)",
+                (excess,)
+            )
+            return excess
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            answers, stale = conn.execute("SELECT COUNT(*), COALESCE(SUM(stale), 0) FROM answers").fetchone()
+            requests = conn.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM requests").fetchone()
+        return {"answers": answers, "stale": stale, "questions": requests[0], "requests": requests[1]}
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers")
+            conn.execute("DELETE FROM requests")
+
+
+def _on_event(event: str, payload: Dict[str, Any]) -> None:
+    if event == "tenant_evicted":
+        _computers.pop(payload["db"]._engine.url.render_as_string(hide_password=True), None)
+    elif event == "table_changed" and _cache is not None:
+        _cache.invalidate_table(payload["db"], payload["table"])
+
+
+add_event_handler(_on_event)
+
+
+def register_answer_computer(db, compute: Callable[[str], Optional[Dict[str, Any]]]) -> None:
+    """
+    Set how a database's answers are precomputed: compute(question) runs the full chain
+    and returns {"answer", "query", "tables"}, or None when the answer shouldn't be stored.
+    """
+    _computers[db._engine.url.render_as_string(hide_password=True)] = compute
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Return the process-wide answer cache, or None when it is disabled or unusable."""
+    global _cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = AnswerCache(ANSWER_CACHE_PATH)
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"Error opening answer cache {ANSWER_CACHE_PATH}: {e}")
+                return None
+        return _cache
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Precompute answers to the most frequent questions now, e.g. from cron.")
+    parser.add_argument("--tenant", help="Tenant whose database to use (defaults to the configured database)")
+    args = parser.parse_args()
+
+    from langchain_utils import get_chain_stages
+    from tenants import activate_tenant, get_tenant_database
+
+    activate_tenant(args.tenant)
+    cache = get_answer_cache()
+    if cache is None or not get_chain_stages(args.tenant):
+        raise SystemExit("The answer cache is disabled or the chain could not be set up")
+    print(cache.precompute(get_tenant_database(args.tenant), force=True))
+    print(cache.stats())
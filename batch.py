@@ -0,0 +1,237 @@
+from typing import Dict, List, Any, Optional, Tuple
+from langchain_core.runnables import RunnableLambda
+from langchain_utils import get_chain
+from table_selection import normalize_question
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of questions processed at once
+BATCH_CONCURRENCY = int(os.getenv("batch_concurrency", "4"))
+# Maximum questions started per second (0 means unlimited)
+BATCH_RATE_LIMIT = float(os.getenv("batch_rate_limit", "0"))
+
+
+class RateLimiter:
+    """Token bucket limiting how many requests start per second, usable from threads and coroutines."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        if self.rate > 0:
+            delay = self._reserve()
+            if delay:
+                time.sleep(delay)
+
+    async def aacquire(self) -> None:
+        if self.rate > 0:
+            delay = self._reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+
+def load_questions(path: str, question_fields: List[str], id_field: str = "id") -> List[Dict[str, Any]]:
+    """
+    Read questions from a JSONL file. The question text is the given fields joined
+    together (e.g. "title,body"); records without an id are numbered by line.
+    """
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            question = ". ".join(str(record[field]).strip() for field in question_fields if record.get(field))
+            if question:
+                records.append({"id": str(record.get(id_field, line_number)), "question": question})
+    return records
+
+
+def load_completed_ids(path: str) -> set:
+    """Ids already answered in an existing output file, so an interrupted run can resume."""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if "answer" in record:
+                completed.add(record["id"])
+    return completed
+
+
+def group_questions(records: List[Dict[str, Any]], completed: set) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """Group pending records by normalized question so each distinct question is answered once."""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        if record["id"] not in completed:
+            groups.setdefault(normalize_question(record["question"]), []).append(record)
+    return list(groups.items())
+
+
+class BatchWriter:
+    """Appends one JSON line per question as soon as its answer is available."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.answered = 0
+        self.errors = 0
+
+    def write(self, normalized: str, records: List[Dict[str, Any]], output: Any, elapsed: float) -> None:
+        with self._lock:
+            for record in records:
+                line = {"id": record["id"], "question": record["question"], "normalized": normalized,
+                        "elapsed": round(elapsed, 3)}
+                if isinstance(output, Exception):
+                    line["error"] = str(output)
+                    self.errors += 1
+                else:
+                    line["answer"] = output
+                    self.answered += 1
+                self._file.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _report(total: int, groups: int, skipped: int, writer: BatchWriter, started: float) -> Dict[str, Any]:
+    elapsed = time.monotonic() - started
+    stats = {
+        "questions": total,
+        "skipped": skipped,
+        "unique_questions": groups,
+        "answered": writer.answered,
+        "errors": writer.errors,
+        "elapsed": round(elapsed, 3),
+        "questions_per_second": round((writer.answered + writer.errors) / elapsed, 3) if elapsed else 0.0,
+        "unique_per_second": round(groups / elapsed, 3) if elapsed else 0.0,
+    }
+    logger.info(f"Batch finished: {stats}")
+    return stats
+
+
+def run_batch(input_path: str, output_path: str, question_fields: Optional[List[str]] = None, id_field: str = "id",
+              concurrency: int = BATCH_CONCURRENCY, rate_limit: float = BATCH_RATE_LIMIT) -> Dict[str, Any]:
+    """
+    Answer every question of a JSONL file and append the results to output_path as they finish.
+    Questions already answered in output_path are skipped. Returns throughput statistics.
+    """
+    records = load_questions(input_path, question_fields or ["question"], id_field)
+    completed = load_completed_ids(output_path)
+    groups = group_questions(records, completed)
+    skipped = sum(1 for record in records if record["id"] in completed)
+
+    started = time.monotonic()
+    writer = BatchWriter(output_path)
+    try:
+        if groups:
+            chain = get_chain()
+            if not chain:
+                raise RuntimeError("System initialization failed")
+
+            limiter = RateLimiter(rate_limit)
+            start_times: Dict[int, float] = {}
+
+            def throttle(inputs: dict) -> dict:
+                limiter.acquire()
+                start_times[inputs["index"]] = time.monotonic()
+                return {"question": inputs["question"]}
+
+            limited_chain = RunnableLambda(throttle) | chain
+            inputs = [{"index": i, "question": group[0]["question"]} for i, (_, group) in enumerate(groups)]
+            for i, output in limited_chain.batch_as_completed(
+                inputs, config={"max_concurrency": concurrency}, return_exceptions=True
+            ):
+                normalized, group_records = groups[i]
+                writer.write(normalized, group_records, output, time.monotonic() - start_times.get(i, started))
+    finally:
+        writer.close()
+
+    return _report(len(records), len(groups), skipped, writer, started)
+
+
+async def arun_batch(input_path: str, output_path: str, question_fields: Optional[List[str]] = None, id_field: str = "id",
+                     concurrency: int = BATCH_CONCURRENCY, rate_limit: float = BATCH_RATE_LIMIT) -> Dict[str, Any]:
+    """Async variant of run_batch using the chain's async stages."""
+    records = load_questions(input_path, question_fields or ["question"], id_field)
+    completed = load_completed_ids(output_path)
+    groups = group_questions(records, completed)
+    skipped = sum(1 for record in records if record["id"] in completed)
+
+    started = time.monotonic()
+    writer = BatchWriter(output_path)
+    try:
+        if groups:
+            chain = await asyncio.to_thread(get_chain)
+            if not chain:
+                raise RuntimeError("System initialization failed")
+
+            limiter = RateLimiter(rate_limit)
+            start_times: Dict[int, float] = {}
+
+            async def athrottle(inputs: dict) -> dict:
+                await limiter.aacquire()
+                start_times[inputs["index"]] = time.monotonic()
+                return {"question": inputs["question"]}
+
+            limited_chain = RunnableLambda(lambda inputs: inputs, afunc=athrottle) | chain
+            inputs = [{"index": i, "question": group[0]["question"]} for i, (_, group) in enumerate(groups)]
+            async for i, output in limited_chain.abatch_as_completed(
+                inputs, config={"max_concurrency": concurrency}, return_exceptions=True
+            ):
+                normalized, group_records = groups[i]
+                writer.write(normalized, group_records, output, time.monotonic() - start_times.get(i, started))
+    finally:
+        writer.close()
+
+    return _report(len(records), len(groups), skipped, writer, started)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions in bulk.")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("output", help="JSONL file results are appended to; existing answers are skipped")
+    parser.add_argument("--question-field", default="question",
+                        help="Field(s) holding the question text, comma-separated (e.g. title,body)")
+    parser.add_argument("--id-field", default="id", help="Field identifying each question")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--rate-limit", type=float, default=BATCH_RATE_LIMIT, help="Questions started per second (0 = unlimited)")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the async chain")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, force=True)
+    options = dict(question_fields=args.question_field.split(","), id_field=args.id_field,
+                   concurrency=args.concurrency, rate_limit=args.rate_limit)
+    if args.use_async:
+        stats = asyncio.run(arun_batch(args.input, args.output, **options))
+    else:
+        stats = run_batch(args.input, args.output, **options)
+    print(json.dumps(stats, indent=2))
@@ -0,0 +1 @@
+"""Offline benchmark harness: synthetic SQLite schema, fake LLM and question mixes."""
@@ -0,0 +1,112 @@
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from token_counter import count_tokens
+import asyncio
+import re
+import threading
+import time
+import uuid
+
+ANSWER_TEXT = (
+    "Here is what I found:\n\n"
+    "• **Paneer Tikka**: Smoky cottage cheese from the tandoor.\n"
+    "• **Masala Dosa**: Crisp crepe with spiced potato.\n"
+    "• **Mango Lassi**: Chilled yoghurt drink.\n"
+    "• **Saffron Halwa**: Slow-cooked semolina dessert.\n"
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model for benchmarks. Answers SQL prompts from a question -> SQL
+    map, table selection with tool calls for the tables a question mentions, and answer
+    prompts with a fixed bullet list. Latency is simulated per call and per streamed chunk,
+    and token usage is reported like the OpenAI model does.
+    """
+
+    sql_by_question: Dict[str, str] = {}
+    default_sql: str = "SELECT 1"
+    table_names: List[str] = []
+    latency: float = 0.05
+    chunk_latency: float = 0.0
+
+    _prompts: Dict[str, List[int]] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake"
+
+    def _record(self, kind: str, tokens: int) -> None:
+        with self._lock:
+            self._prompts.setdefault(kind, []).append(tokens)
+
+    def prompt_sizes(self) -> Dict[str, List[int]]:
+        """Prompt token counts seen so far, by prompt kind."""
+        with self._lock:
+            return {kind: list(sizes) for kind, sizes in self._prompts.items()}
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        prompt = "\n".join(str(message.content) for message in messages)
+        prompt_tokens = count_tokens(prompt)
+
+        if tools:
+            kind = "table_selection"
+            question = str(messages[-1].content).lower()
+            mentioned = [name for name in self.table_names if name.split("_")[0] in question] or self.table_names[:1]
+            message = AIMessage(content="", tool_calls=[
+                {"name": "Table", "args": {"name": name, "confidence": 0.9}, "id": uuid.uuid4().hex}
+                for name in mentioned
+            ])
+        elif "User Question:" in prompt:
+            kind = "sql"
+            question = re.search(r"User Question:\s*(.*)", prompt).group(1).strip()
+            message = AIMessage(content=f"```sql\n{self.sql_by_question.get(question, self.default_sql)}\n```")
+        else:
+            kind = "answer"
+            message = AIMessage(content=ANSWER_TEXT)
+
+        self._record(kind, prompt_tokens)
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": count_tokens(str(message.content)) or 1,
+            "total_tokens": prompt_tokens + (count_tokens(str(message.content)) or 1),
+        }
+        return message
+
+    @staticmethod
+    def _chunks(message: AIMessage) -> List[AIMessageChunk]:
+        words = re.findall(r"\S+\s*|\s+", str(message.content))
+        chunks = [AIMessageChunk(content=word) for word in words]
+        # Usage arrives with the last chunk, as with stream_usage=True
+        chunks.append(AIMessageChunk(content="", usage_metadata=message.usage_metadata))
+        return chunks
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for chunk in self._chunks(self._respond(messages, kwargs.get("tools"))):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._respond(messages, kwargs.get("tools"))):
+            if self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            yield ChatGenerationChunk(message=chunk)
@@ -0,0 +1,105 @@
+from typing import Dict, List, Any
+import os
+import random
+import sqlite3
+
+# Table names are drawn from a restaurant/hotel domain; larger schemas get numbered copies
+TABLE_NAMES = [
+    "menu_items", "faqs", "hours", "locations", "orders", "reservations", "rooms", "guests",
+    "bookings", "reviews", "staff", "suppliers", "events", "promotions", "amenities", "invoices",
+]
+WORDS = [
+    "paneer", "biryani", "masala", "tikka", "dosa", "curry", "naan", "lassi", "samosa", "korma",
+    "kebab", "pulao", "halwa", "chai", "suite", "deluxe", "garden", "spa", "pool", "breakfast",
+    "brunch", "terrace", "lounge", "buffet", "tandoori", "mango", "saffron", "coconut",
+]
+CATEGORIES = ["vegetarian", "non-vegetarian", "dessert", "beverage", "starter", "main course", "room", "event"]
+FAQ_TOPICS = ["popular dish", "signature dish", "best dessert", "parking", "delivery", "private dining", "check in time"]
+
+
+def table_names(count: int) -> List[str]:
+    return [TABLE_NAMES[i % len(TABLE_NAMES)] + (f"_{i // len(TABLE_NAMES)}" if i >= len(TABLE_NAMES) else "")
+            for i in range(count)]
+
+
+def build_schema(tables: int, columns: int) -> List[Dict[str, Any]]:
+    """
+    Describe a synthetic schema: every table has an id primary key, text columns worth
+    searching, a price, extra filler columns up to `columns`, and a foreign key to the
+    previous table. The faqs tables use question/answer columns instead.
+    """
+    schema = []
+    for i, name in enumerate(table_names(tables)):
+        if name.startswith("faqs"):
+            cols = [("id", "INTEGER PRIMARY KEY"), ("question", "TEXT NOT NULL"), ("answer", "TEXT NOT NULL")]
+        else:
+            cols = [("id", "INTEGER PRIMARY KEY"), ("name", "TEXT NOT NULL"), ("description", "TEXT"),
+                    ("category", "TEXT"), ("price", "REAL")]
+        foreign_key = None
+        if i > 0 and not name.startswith("faqs"):
+            foreign_key = schema[i - 1]["name"]
+            cols.append((f"{foreign_key}_id", "INTEGER"))
+        extra = 0
+        while len(cols) < columns:
+            cols.append((f"attribute_{extra}", "TEXT" if extra % 2 == 0 else "INTEGER"))
+            extra += 1
+        schema.append({"name": name, "columns": cols, "foreign_key": foreign_key})
+    return schema
+
+
+def _row(rng: random.Random, table: Dict[str, Any], row_id: int, parent_rows: int) -> tuple:
+    values = []
+    for column, _ in table["columns"]:
+        if column == "id":
+            values.append(row_id)
+        elif column == "question":
+            values.append(f"What is your {rng.choice(FAQ_TOPICS)}?")
+        elif column == "answer":
+            values.append(f"Our {rng.choice(WORDS)} {rng.choice(WORDS)} is a guest favourite.")
+        elif column == "name":
+            values.append(f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}")
+        elif column == "description":
+            values.append(" ".join(rng.choice(WORDS) for _ in range(8)))
+        elif column == "category":
+            values.append(rng.choice(CATEGORIES))
+        elif column == "price":
+            values.append(round(rng.uniform(2, 500), 2))
+        elif column.endswith("_id"):
+            values.append(rng.randint(1, parent_rows) if parent_rows else None)
+        elif column.startswith("attribute_"):
+            values.append(rng.choice(WORDS) if int(column.rsplit("_", 1)[1]) % 2 == 0 else rng.randint(0, 1000))
+        else:
+            values.append(None)
+    return tuple(values)
+
+
+def build_database(path: str, tables: int = 8, columns: int = 6, rows: int = 1000, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    (Re)create a SQLite database with the synthetic schema and deterministic rows.
+    Returns the schema description used to generate matching questions.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    schema = build_schema(tables, columns)
+    conn = sqlite3.connect(path)
+    try:
+        row_counts: Dict[str, int] = {}
+        for table in schema:
+            column_defs = [f"{column} {column_type}" for column, column_type in table["columns"]]
+            if table["foreign_key"]:
+                column_defs.append(f"FOREIGN KEY ({table['foreign_key']}_id) REFERENCES {table['foreign_key']}(id)")
+            conn.execute(f"CREATE TABLE {table['name']} ({', '.join(column_defs)})")
+
+            count = min(rows, 50) if table["name"].startswith("faqs") else rows
+            parent_rows = row_counts.get(table["foreign_key"], 0)
+            placeholders = ", ".join("?" for _ in table["columns"])
+            conn.executemany(
+                f"INSERT INTO {table['name']} VALUES ({placeholders})",
+                (_row(rng, table, row_id, parent_rows) for row_id in range(1, count + 1)),
+            )
+            row_counts[table["name"]] = count
+        conn.commit()
+    finally:
+        conn.close()
+    return schema
@@ -0,0 +1,182 @@
+"""
+Offline benchmark: builds a synthetic SQLite database, swaps the OpenAI model for a
+deterministic fake, and drives the chain, the fallback search, schema rendering and
+table selection through a question mix.
+
+    python -m bench.run --tables 12 --rows 5000 --questions 200 --concurrency 4
+"""
+from typing import Callable, Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+SCENARIOS = ["chain", "fallback", "table_info", "table_selection"]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(name: str, traces: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+    durations = [trace["duration"] for trace in traces]
+    count = len(traces) or 1
+
+    def mean(counter: str) -> float:
+        return round(sum(trace["counters"].get(counter, 0) for trace in traces) / count, 2)
+
+    stages: Dict[str, List[float]] = {}
+    kinds: Dict[str, List[float]] = {}
+    for trace in traces:
+        for item in trace["stages"]:
+            stages.setdefault(item["name"], []).append(item["duration"])
+        kinds.setdefault(trace.get("kind", ""), []).append(trace["duration"])
+
+    return {
+        "scenario": name,
+        "calls": len(traces),
+        "throughput_per_s": round(len(traces) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(durations, 50) * 1000, 2),
+        "p95_ms": round(percentile(durations, 95) * 1000, 2),
+        "p99_ms": round(percentile(durations, 99) * 1000, 2),
+        "db_queries_per_call": mean("db_queries"),
+        "db_rows_per_call": mean("db_rows"),
+        "llm_calls_per_call": mean("llm_calls"),
+        "prompt_tokens_per_call": mean("llm_prompt_tokens"),
+        "cached_prompt_tokens_per_call": mean("prompt_cached_tokens"),
+        "stage_p50_ms": {stage: round(percentile(values, 50) * 1000, 3) for stage, values in sorted(stages.items())},
+        "kind_p50_ms": {kind: round(percentile(values, 50) * 1000, 2) for kind, values in sorted(kinds.items())},
+    }
+
+
+def run_scenario(name: str, call: Callable[[Dict[str, str]], Any], questions: List[Dict[str, str]],
+                 concurrency: int) -> Dict[str, Any]:
+    """Run one call per question, each in its own request trace, and summarize the traces."""
+    from instrumentation import finish_trace, start_trace
+
+    def one(question: Dict[str, str]) -> Dict[str, Any]:
+        trace = start_trace(question["question"])
+        try:
+            call(question)
+        finally:
+            data = finish_trace(trace)
+        data["kind"] = question["kind"]
+        return data
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            traces = list(executor.map(one, questions))
+    else:
+        traces = [one(question) for question in questions]
+    return summarize(name, traces, time.perf_counter() - started)
+
+
+def print_report(results: List[Dict[str, Any]], prompt_sizes: Dict[str, List[int]]) -> None:
+    header = f"{'scenario':<16}{'calls':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'db q':>7}{'rows':>8}{'llm':>6}{'prompt tok':>12}{'cached tok':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<16}{r['calls']:>7}{r['throughput_per_s']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+              f"{r['p99_ms']:>10}{r['db_queries_per_call']:>7}{r['db_rows_per_call']:>8}"
+              f"{r['llm_calls_per_call']:>6}{r['prompt_tokens_per_call']:>12}{r['cached_prompt_tokens_per_call']:>12}")
+    print()
+    for r in results:
+        if r["stage_p50_ms"]:
+            stages = ", ".join(f"{stage} {ms}" for stage, ms in r["stage_p50_ms"].items())
+            print(f"{r['scenario']} stage p50 (ms): {stages}")
+        kinds = ", ".join(f"{kind} {ms}" for kind, ms in r["kind_p50_ms"].items())
+        print(f"{r['scenario']} p50 by question kind (ms): {kinds}")
+    for kind, sizes in sorted(prompt_sizes.items()):
+        print(f"{kind} prompts: {len(sizes)} calls, mean {sum(sizes) / len(sizes):.0f} tokens, max {max(sizes)} tokens")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmark with a fake LLM and a SQLite fixture.")
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--columns", type=int, default=6, help="Minimum columns per table")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per table")
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--repeat", type=float, default=0.2, help="Share of questions repeating an earlier one")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency per call in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.0, help="Fake LLM latency per streamed chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--db", help="SQLite file to build (a temporary file by default)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the semantic, result and answer caches")
+    parser.add_argument("--no-speculation", action="store_true", help="Run the fallback search only after an empty result")
+    parser.add_argument("--cold-schema", action="store_true", help="Rebuild the schema snapshot before every table_info call")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    from bench.fixtures import build_database
+    from bench.workload import canned_sql, generate_questions
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="nl_to_sql_bench_"), "bench.db")
+    schema = build_database(db_path, args.tables, args.columns, args.rows, args.seed)
+    questions = generate_questions(schema, args.questions, args.seed, args.repeat)
+
+    # Configuration is read at import time, so set it before importing the application
+    os.environ["database_url"] = f"sqlite:///{db_path}"
+    if args.no_cache:
+        os.environ["semantic_cache_enabled"] = "false"
+        os.environ["result_cache_enabled"] = "false"
+        os.environ["answer_cache_enabled"] = "false"
+    if args.no_speculation:
+        os.environ["speculative_enabled"] = "false"
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    from bench.fake_llm import FakeChatModel
+    from db_utils import get_database, get_table_info
+    from instrumentation import llm_usage_handler
+    from langchain_utils import get_chain, perform_fallback_query
+    from llm_utils import set_llm_factory
+    from schema_snapshot import invalidate_schema_snapshot
+    from table_selection import select_relevant_tables
+
+    fake_llm = FakeChatModel(
+        sql_by_question=canned_sql(questions),
+        table_names=[table["name"] for table in schema],
+        latency=args.latency,
+        chunk_latency=args.chunk_latency,
+        callbacks=[llm_usage_handler],
+    )
+    set_llm_factory(lambda: fake_llm)
+    db = get_database()
+
+    def table_info(question: Dict[str, str]) -> str:
+        if args.cold_schema:
+            invalidate_schema_snapshot(db)
+        return get_table_info(db)
+
+    # The chain is invoked directly rather than through invoke_chain so errors aren't swallowed
+    chain = get_chain()
+    scenarios = {
+        "chain": lambda question: chain.invoke({"question": question["question"]}),
+        "fallback": lambda question: perform_fallback_query(db, question["question"]),
+        "table_info": table_info,
+        "table_selection": lambda question: select_relevant_tables(question["question"]),
+    }
+    results = []
+    for name in args.scenarios.split(","):
+        results.append(run_scenario(name.strip(), scenarios[name.strip()], questions, args.concurrency))
+
+    print(f"Database: {db_path} ({args.tables} tables, {args.rows} rows each), {len(questions)} questions, "
+          f"concurrency {args.concurrency}, LLM latency {args.latency}s")
+    print_report(results, fake_llm.prompt_sizes())
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results, "prompt_sizes": fake_llm.prompt_sizes()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
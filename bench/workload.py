@@ -0,0 +1,65 @@
+from typing import Dict, List, Any
+from bench.fixtures import CATEGORIES, WORDS
+import random
+
+# Relative frequency of each kind of question in a generated mix
+QUESTION_MIX = {
+    "list": 0.3,       # category listing, a few rows
+    "lookup": 0.3,     # item search by keyword
+    "aggregate": 0.15, # COUNT over a filter
+    "miss": 0.15,      # no matching rows, exercises the fallback search
+    "faq": 0.1,        # answered from the FAQ table
+}
+NONSENSE_WORDS = ["unicorn", "quasar", "zeppelin", "glacier", "nebula"]
+
+
+def _question(rng: random.Random, kind: str, schema: List[Dict[str, Any]]) -> Dict[str, str]:
+    item_tables = [table for table in schema if not table["name"].startswith("faqs")]
+    faq_tables = [table for table in schema if table["name"].startswith("faqs")]
+    if kind == "faq" and not faq_tables:
+        kind = "lookup"
+    table = rng.choice(item_tables)["name"]
+    label = table.split("_")[0]
+    word = rng.choice(WORDS)
+
+    if kind == "list":
+        category = rng.choice(CATEGORIES)
+        return {"kind": kind, "question": f"Show me {category} {label}",
+                "sql": f"SELECT name, description FROM {table} WHERE category LIKE '%{category}%' LIMIT 10"}
+    if kind == "lookup":
+        return {"kind": kind, "question": f"Do you have {word} {label}?",
+                "sql": f"SELECT name, description, price FROM {table} "
+                       f"WHERE name LIKE '%{word}%' OR description LIKE '%{word}%' LIMIT 10"}
+    if kind == "aggregate":
+        price = rng.choice([50, 100, 200, 400])
+        return {"kind": kind, "question": f"How many {label} cost more than {price}?",
+                "sql": f"SELECT COUNT(*) FROM {table} WHERE price > {price}"}
+    if kind == "miss":
+        nonsense = rng.choice(NONSENSE_WORDS)
+        return {"kind": kind, "question": f"Do you have {nonsense} {word}?",
+                "sql": f"SELECT name, description FROM {table} WHERE name LIKE '%{nonsense}%'"}
+    faq_table = faq_tables[0]["name"]
+    return {"kind": "faq", "question": f"What is your most popular {word} dish?",
+            "sql": f"SELECT answer FROM {faq_table} WHERE question LIKE '%popular%'"}
+
+
+def generate_questions(schema: List[Dict[str, Any]], count: int, seed: int = 0,
+                       repeat_ratio: float = 0.2) -> List[Dict[str, str]]:
+    """
+    Build a deterministic question mix for a synthetic schema. Each question carries the
+    SQL the fake LLM answers with. A share of questions repeats earlier ones so the
+    caches see realistic reuse.
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*QUESTION_MIX.items())
+    questions: List[Dict[str, str]] = []
+    for _ in range(count):
+        if questions and rng.random() < repeat_ratio:
+            questions.append(rng.choice(questions))
+        else:
+            questions.append(_question(rng, rng.choices(kinds, weights)[0], schema))
+    return questions
+
+
+def canned_sql(questions: List[Dict[str, str]]) -> Dict[str, str]:
+    return {question["question"]: question["sql"] for question in questions}
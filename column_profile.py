@@ -0,0 +1,410 @@
+from typing import Dict, List, Any, Optional
+from sqlalchemy import text
+from schema_snapshot import get_schema_snapshot
+from fallback_search import STOP_WORDS
+from table_selection import tokenize
+from instrumentation import record_rows, stage
+from runtime import add_event_handler
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+COLUMN_PROFILE_ENABLED = os.getenv("column_profile_enabled", "true").lower() in ("1", "true", "yes")
+# JSON file the profile is persisted to, shared by workers and restarts
+COLUMN_PROFILE_PATH = os.getenv(
+    "column_profile_path", os.path.join(tempfile.gettempdir(), "nl_to_sql_column_profile.json")
+)
+# Columns with at most this many distinct values keep the full value list
+COLUMN_PROFILE_MAX_DISTINCT = int(os.getenv("column_profile_max_distinct", "50"))
+# Values longer than this mark a column as free text, which gets no value list
+COLUMN_PROFILE_MAX_VALUE_CHARS = int(os.getenv("column_profile_max_value_chars", "60"))
+# Rows read per table in one run; the next run continues after the last row read
+COLUMN_PROFILE_MAX_ROWS = int(os.getenv("column_profile_max_rows", "100000"))
+COLUMN_PROFILE_BATCH_SIZE = int(os.getenv("column_profile_batch_size", "5000"))
+# Seconds between incremental refreshes in the background (0 disables)
+COLUMN_PROFILE_REFRESH_INTERVAL = float(os.getenv("column_profile_refresh_interval", "600"))
+# Values listed in one SQL prompt
+COLUMN_PROFILE_PROMPT_VALUES = int(os.getenv("column_profile_prompt_values", "20"))
+
+COLUMN_PROFILE_VERSION = 1
+NUMERIC_TYPES = ("int", "dec", "num", "float", "double", "real")
+TEMPORAL_TYPES = ("date", "time")
+
+_profiles: Dict[str, "ColumnProfile"] = {}
+_profiles_lock = threading.Lock()
+_building: Dict[str, threading.Lock] = {}
+
+
+class HyperLogLog:
+    """Fixed-memory distinct count estimate (2^p one-byte registers, about 1.04/sqrt(2^p) error)."""
+
+    def __init__(self, p: int = 10, registers: Optional[bytearray] = None):
+        self.p = p
+        self.registers = registers if registers is not None else bytearray(1 << p)
+
+    def add(self, value: Any) -> None:
+        digest = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+        index = digest >> (64 - self.p)
+        rest = digest & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def to_json(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def from_json(cls, value: str) -> "HyperLogLog":
+        registers = bytearray(base64.b64decode(value))
+        return cls(p=len(registers).bit_length() - 1, registers=registers)
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+class ColumnStats:
+    """Running statistics of one column: distinct count estimate, small value list, min/max."""
+
+    def __init__(self, kind: str, values: Optional[Dict[str, int]] = None, hll: Optional[HyperLogLog] = None,
+                 minimum: Any = None, maximum: Any = None, nulls: int = 0):
+        self.kind = kind
+        # None once the column has too many, or too long, distinct values to list
+        self.values = values if values is not None or kind != "text" else {}
+        self.hll = hll or HyperLogLog()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.nulls = nulls
+
+    def add(self, value: Any) -> None:
+        if value is None:
+            self.nulls += 1
+            return
+        self.hll.add(value)
+        if self.values is not None:
+            value = str(value)
+            if len(value) > COLUMN_PROFILE_MAX_VALUE_CHARS:
+                self.values = None
+            else:
+                self.values[value] = self.values.get(value, 0) + 1
+                if len(self.values) > COLUMN_PROFILE_MAX_DISTINCT:
+                    self.values = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "values": self.values, "hll": self.hll.to_json(),
+                "min": self.minimum, "max": self.maximum, "nulls": self.nulls}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ColumnStats":
+        stats = cls(data["kind"], None, HyperLogLog.from_json(data["hll"]),
+                    data.get("min"), data.get("max"), data.get("nulls", 0))
+        stats.values = data.get("values")
+        return stats
+
+
+def column_kind(column_type: Any) -> str:
+    type_name = str(column_type).lower()
+    if any(name in type_name for name in ("char", "text", "enum", "bool")):
+        return "text"
+    if any(name in type_name for name in NUMERIC_TYPES):
+        return "numeric"
+    if any(name in type_name for name in TEMPORAL_TYPES):
+        return "temporal"
+    return "other"
+
+
+class ColumnProfile:
+    """
+    Per-column value dictionary of a database: the distinct values of low-cardinality
+    text columns, min/max of numeric and date columns, and a HyperLogLog distinct count
+    for every column. Rows are read once with keyset pagination on the primary key; a
+    refresh only reads rows added since, and min/max come from one aggregate query per table.
+    """
+
+    def __init__(self, source: str, fingerprint: str, tables: Optional[Dict[str, Dict[str, Any]]] = None,
+                 built_at: Optional[float] = None):
+        self.source = source
+        self.fingerprint = fingerprint
+        # {table_name: {"pk_column", "last_pk", "rows", "columns": {column_name: ColumnStats}}}
+        self.tables = tables or {}
+        self.built_at = built_at or time.time()
+        self.refreshed_at = self.built_at
+        self._value_terms: Optional[set] = None
+
+    def profile_table(self, db, table_name: str) -> int:
+        """Read rows added to a table since the last run into its column statistics. Returns rows read."""
+        engine = db._engine
+        quote = engine.dialect.identifier_preparer.quote
+        snapshot = get_schema_snapshot(db)
+        columns = snapshot.get_columns(table_name)
+        pk_columns = snapshot.get_pk_constraint(table_name).get("constrained_columns", [])
+        pk_column = pk_columns[0] if len(pk_columns) == 1 else None
+
+        state = self.tables.get(table_name)
+        if state is None or state["pk_column"] != pk_column or set(state["columns"]) != {col["name"] for col in columns}:
+            state = {"pk_column": pk_column, "last_pk": None, "rows": 0,
+                     "columns": {col["name"]: ColumnStats(column_kind(col["type"])) for col in columns}}
+        elif pk_column is None:
+            # Without a key there is no way to tell new rows apart, the table was profiled once
+            return 0
+
+        names = [col["name"] for col in columns]
+        selected = ", ".join(quote(name) for name in names)
+        read = 0
+        with engine.connect() as conn:
+            while read < COLUMN_PROFILE_MAX_ROWS:
+                batch = min(COLUMN_PROFILE_BATCH_SIZE, COLUMN_PROFILE_MAX_ROWS - read)
+                query, params = f"SELECT {selected} FROM {quote(table_name)}", {}
+                if pk_column:
+                    if state["last_pk"] is not None:
+                        query += f" WHERE {quote(pk_column)} > :last_pk"
+                        params["last_pk"] = state["last_pk"]
+                    query += f" ORDER BY {quote(pk_column)}"
+                query += f" LIMIT {int(batch)}"
+                rows = conn.execute(text(query), params).fetchall()
+                for row in rows:
+                    for name, value in zip(names, row):
+                        state["columns"][name].add(value)
+                read += len(rows)
+                if pk_column and rows:
+                    state["last_pk"] = _json_value(rows[-1][names.index(pk_column)])
+                if not pk_column or len(rows) < batch:
+                    break
+
+            # Exact ranges from the database, so rows beyond the read cap still count
+            ranged = [name for name in names if state["columns"][name].kind in ("numeric", "temporal")]
+            if ranged and (read or state["rows"] == 0):
+                bounds = ", ".join(f"MIN({quote(name)}), MAX({quote(name)})" for name in ranged)
+                row = conn.execute(text(f"SELECT {bounds} FROM {quote(table_name)}")).one()
+                for i, name in enumerate(ranged):
+                    state["columns"][name].minimum = _json_value(row[2 * i])
+                    state["columns"][name].maximum = _json_value(row[2 * i + 1])
+        record_rows(read)
+        state["rows"] += read
+        self.tables[table_name] = state
+        return read
+
+    def refresh(self, db) -> Dict[str, int]:
+        """Profile every table incrementally and drop tables that no longer exist."""
+        snapshot = get_schema_snapshot(db)
+        counts = {}
+        with stage("column_profile") as attributes:
+            for table_name in snapshot.get_table_names():
+                try:
+                    counts[table_name] = self.profile_table(db, table_name)
+                except Exception as e:
+                    logger.error(f"Error profiling {table_name}: {e}")
+            for table_name in set(self.tables) - set(snapshot.get_table_names()):
+                del self.tables[table_name]
+            attributes["rows"] = sum(counts.values())
+        self.refreshed_at = time.time()
+        self._value_terms = None
+        return counts
+
+    def value_terms(self) -> set:
+        """Terms of every listed column value, computed once per refresh."""
+        if self._value_terms is None:
+            self._value_terms = {term for state in list(self.tables.values())
+                                 for stats in list(state["columns"].values())
+                                 for value in list(stats.values or ()) for term in tokenize(value)}
+        return self._value_terms
+
+    def relevant_values(self, question: str, table_names: Optional[List[str]] = None,
+                        max_values: int = COLUMN_PROFILE_PROMPT_VALUES) -> List[str]:
+        """
+        Lines describing the column values a question refers to: listed values sharing a
+        term with the question, every value of a column the question names, and the range
+        of a numeric or date column the question names.
+        """
+        question_terms = {term for term in tokenize(question) if term not in STOP_WORDS and len(term) > 2}
+        if not question_terms:
+            return []
+        lines, remaining = [], max_values
+        for table_name, state in self.tables.items():
+            if table_names is not None and table_name not in table_names:
+                continue
+            for column_name, stats in state["columns"].items():
+                if remaining <= 0:
+                    return lines
+                column_named = bool(question_terms & set(tokenize(column_name)))
+                if stats.values:
+                    ranked = sorted(stats.values, key=stats.values.get, reverse=True)
+                    matching = [value for value in ranked
+                                if column_named or question_terms & set(tokenize(value))][:remaining]
+                    if matching:
+                        remaining -= len(matching)
+                        listed = ", ".join(repr(value) for value in matching)
+                        lines.append(f"- {table_name}.{column_name}: {listed}")
+                elif column_named and stats.minimum is not None:
+                    remaining -= 1
+                    lines.append(f"- {table_name}.{column_name}: {stats.minimum} to {stats.maximum}")
+        return lines
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "version": COLUMN_PROFILE_VERSION,
+            "source": self.source,
+            "fingerprint": self.fingerprint,
+            "built_at": self.built_at,
+            "tables": {
+                table_name: {**state, "columns": {name: stats.as_dict() for name, stats in state["columns"].items()}}
+                for table_name, state in self.tables.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ColumnProfile":
+        tables = {
+            table_name: {**state, "columns": {name: ColumnStats.from_dict(stats)
+                                              for name, stats in state["columns"].items()}}
+            for table_name, state in data["tables"].items()
+        }
+        return cls(data["source"], data["fingerprint"], tables, data.get("built_at"))
+
+
+def save_column_profiles(path: str = COLUMN_PROFILE_PATH) -> None:
+    """Write every loaded profile to a JSON file, atomically."""
+    with _profiles_lock:
+        profiles = [profile.as_dict() for profile in _profiles.values()]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": COLUMN_PROFILE_VERSION, "profiles": profiles}, f, default=str)
+    os.replace(tmp_path, path)
+
+
+def load_column_profile(path: str, source: str, fingerprint: str) -> Optional[ColumnProfile]:
+    """Load the saved profile of a database, or None when missing or built for another schema."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading column profile {path}: {e}")
+        return None
+    if data.get("version") != COLUMN_PROFILE_VERSION:
+        return None
+    for profile in data.get("profiles", []):
+        if profile["source"] == source and profile["fingerprint"] == fingerprint:
+            return ColumnProfile.from_dict(profile)
+    return None
+
+
+def refresh_column_profile(db) -> Optional[ColumnProfile]:
+    """Build or incrementally refresh the profile of a database and persist it. Runs one build per database at a time."""
+    source = db._engine.url.render_as_string(hide_password=True)
+    fingerprint = get_schema_snapshot(db).fingerprint
+    with _profiles_lock:
+        lock = _building.setdefault(source, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        with _profiles_lock:
+            profile = _profiles.get(source)
+        if profile is None or profile.fingerprint != fingerprint:
+            profile = load_column_profile(COLUMN_PROFILE_PATH, source, fingerprint) or ColumnProfile(source, fingerprint)
+        profile.refresh(db)
+        with _profiles_lock:
+            _profiles[source] = profile
+        try:
+            save_column_profiles()
+        except OSError as e:
+            logger.error(f"Error saving column profile: {e}")
+        return profile
+    finally:
+        lock.release()
+
+
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    # The saved file keeps the profile for when the tenant comes back
+    if event == "tenant_evicted":
+        with _profiles_lock:
+            _profiles.pop(payload["db"]._engine.url.render_as_string(hide_password=True), None)
+
+
+add_event_handler(_forget_tenant)
+
+
+def get_column_profile(db) -> Optional[ColumnProfile]:
+    """
+    Return the column profile of a database without blocking on the database: the saved
+    profile when it matches the schema, otherwise None while a background job builds it.
+    A background refresh is started when the profile is older than the refresh interval.
+    """
+    if not COLUMN_PROFILE_ENABLED:
+        return None
+    source = db._engine.url.render_as_string(hide_password=True)
+    fingerprint = get_schema_snapshot(db).fingerprint
+    with _profiles_lock:
+        profile = _profiles.get(source)
+    if profile is None or profile.fingerprint != fingerprint:
+        profile = load_column_profile(COLUMN_PROFILE_PATH, source, fingerprint)
+        if profile is not None:
+            with _profiles_lock:
+                _profiles[source] = profile
+
+    stale = profile is None or (
+        COLUMN_PROFILE_REFRESH_INTERVAL > 0 and time.time() - profile.refreshed_at > COLUMN_PROFILE_REFRESH_INTERVAL
+    )
+    if stale and not _building.get(source, threading.Lock()).locked():
+        if profile is not None:
+            # Don't start another refresh on every request while this one runs
+            profile.refreshed_at = time.time()
+        threading.Thread(target=refresh_column_profile, args=(db,), name="column-profile-refresh", daemon=True).start()
+    return profile
+
+
+def entity_terms(db) -> set:
+    """Terms of a database's listed column values (item names, categories...); empty without a profile."""
+    profile = get_column_profile(db)
+    return profile.value_terms() if profile is not None else set()
+
+
+def render_column_values(db, question: str, table_names: Optional[List[str]] = None) -> str:
+    """Prompt block of known column values relevant to a question; "" when there are none."""
+    profile = get_column_profile(db)
+    lines = profile.relevant_values(question, table_names) if profile is not None else []
+    if not lines:
+        return ""
+    return "Known column values relevant to the question (use these exact literals):\n" + "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from db_utils import get_database
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build or incrementally refresh the column value profile.")
+    parser.add_argument("--uri", help="SQLAlchemy URL (defaults to the configured database)")
+    args = parser.parse_args()
+
+    profile = refresh_column_profile(get_database(args.uri))
+    for table_name, state in profile.tables.items():
+        listed = sum(1 for stats in state["columns"].values() if stats.values)
+        print(f"{table_name}: {state['rows']} rows profiled, {listed} columns with value lists")
+    print(f"Saved to {COLUMN_PROFILE_PATH}")
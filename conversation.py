@@ -0,0 +1,226 @@
+from typing import Any, Dict, List, NamedTuple, Optional
+from collections import OrderedDict
+from fallback_search import STOP_WORDS
+from result_cache import extract_tables
+from table_selection import tokenize
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_ENABLED = os.getenv("conversation_enabled", "true").lower() in ("1", "true", "yes")
+# Sessions kept per worker, least recently active dropped first
+CONVERSATION_MAX_SESSIONS = int(os.getenv("conversation_max_sessions", "10000"))
+# Seconds without a turn after which a session's state is dropped
+CONVERSATION_TTL = float(os.getenv("conversation_ttl", "3600"))
+# Earlier turns kept as one-line summaries; older ones are dropped
+CONVERSATION_SUMMARY_TURNS = int(os.getenv("conversation_summary_turns", "5"))
+CONVERSATION_MAX_ENTITIES = int(os.getenv("conversation_max_entities", "10"))
+CONVERSATION_MAX_TABLES = int(os.getenv("conversation_max_tables", "5"))
+# Questions with at most this many content terms that name no table, and share a term or
+# filtered value with the previous turn, are treated as follow-ups
+CONVERSATION_FOLLOW_UP_TERMS = int(os.getenv("conversation_follow_up_terms", "3"))
+
+MAX_QUESTION_CHARS = 200
+MAX_SQL_CHARS = 1000
+MAX_ENTITY_CHARS = 60
+
+# Openers and references that only make sense after an earlier question
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(what|how) about\b|^(and|also|only|just|but|or|then)\b|^(which|what|how many) of\b"
+    r"|\b(those|these|them|they|ones|that one|the same|instead|as well)\b"
+)
+
+_store: Optional["ConversationStore"] = None
+_store_lock = threading.Lock()
+
+
+def content_terms(text: str) -> set:
+    return {term for term in tokenize(text.lower().replace("-", " ")) if term not in STOP_WORDS and len(term) > 2}
+
+
+def sql_literals(query: str) -> List[str]:
+    """String literals of a statement, without LIKE wildcards: the values a turn filtered on."""
+    values = []
+    for literal in re.findall(r"'((?:[^']|'')*)'", query):
+        value = re.sub(r"\s+", " ", literal.replace("''", "'").replace("%", " ")).strip()
+        if value and value not in values:
+            values.append(value[:MAX_ENTITY_CHARS])
+    return values
+
+
+class FollowUp(NamedTuple):
+    # Tables of the previous turns, plus any the question names; empty when unknown
+    tables: List[str]
+    previous_question: str
+    # Compact conversation block for the SQL prompt
+    context: str
+
+
+class ConversationState:
+    """
+    Rolling state of one chat session: the last question, its SQL and tables, the values
+    filtered on so far, and one-line summaries of the turns before. Each turn folds the
+    previous one into the summaries, so the state stays the same size however long the
+    conversation gets and earlier messages are never resent.
+    """
+
+    def __init__(self):
+        self.summary: List[str] = []
+        self.last_question: Optional[str] = None
+        self.last_sql: Optional[str] = None
+        self.tables: List[str] = []
+        self.entities: List[str] = []
+        self.turns = 0
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_questions(cls, questions: List[str]) -> "ConversationState":
+        """State of a conversation known only from its earlier questions, e.g. after a restart."""
+        state = cls()
+        for question in questions[-(CONVERSATION_SUMMARY_TURNS + 1):]:
+            state.record_turn(question)
+        return state
+
+    def record_turn(self, question: str, query: Optional[str] = None,
+                    table_names: Optional[List[str]] = None) -> None:
+        """Fold the previous turn into the summaries and make this one the last turn."""
+        with self._lock:
+            if self.last_question:
+                line = self.last_question
+                if self.tables:
+                    line += f" (tables: {', '.join(self.tables)})"
+                self.summary.append(line)
+                del self.summary[:max(0, len(self.summary) - CONVERSATION_SUMMARY_TURNS)]
+
+            self.last_question = question[:MAX_QUESTION_CHARS]
+            self.last_sql = None
+            if query:
+                self.last_sql = query if len(query) <= MAX_SQL_CHARS else query[:MAX_SQL_CHARS] + " ..."
+                tables = extract_tables(query, table_names or [])
+                if tables:
+                    self.tables = tables[:CONVERSATION_MAX_TABLES]
+                for value in sql_literals(query):
+                    if value in self.entities:
+                        self.entities.remove(value)
+                    self.entities.append(value)
+                del self.entities[:max(0, len(self.entities) - CONVERSATION_MAX_ENTITIES)]
+            self.turns += 1
+            self.updated_at = time.time()
+
+    def follow_up(self, question: str, snapshot) -> Optional[FollowUp]:
+        """Return the context to answer question with when it follows up on the last turn, else None."""
+        with self._lock:
+            if not self.last_question:
+                return None
+            lowered = question.lower().replace("-", " ")
+            terms = content_terms(question)
+            known_tables = snapshot.get_table_names()
+            mentioned = [name for name in known_tables if terms & set(tokenize(name))]
+            if not FOLLOW_UP_PATTERN.search(lowered):
+                # A short question alone is not a follow-up ("what are your opening hours?"
+                # after a menu question): it must also share a term or value with the last turn
+                previous = content_terms(self.last_question)
+                for value in self.entities:
+                    previous |= content_terms(value)
+                if len(terms) > CONVERSATION_FOLLOW_UP_TERMS or mentioned or not terms & previous:
+                    return None
+            tables = [name for name in self.tables if name in known_tables]
+            tables += [name for name in mentioned if name not in tables]
+            return FollowUp(tables, self.last_question, self._render())
+
+    def _render(self) -> str:
+        lines = ["Conversation so far (the user question may refer to it):"]
+        if self.summary:
+            lines.append("Earlier questions:")
+            lines.extend(f"- {line}" for line in self.summary)
+        lines.append(f"Previous question: {self.last_question}")
+        if self.last_sql:
+            lines.append(f"Previous SQL: {self.last_sql}")
+        if self.entities:
+            lines.append(f"Values used so far: {', '.join(self.entities)}")
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "summary": list(self.summary),
+                "last_question": self.last_question,
+                "last_sql": self.last_sql,
+                "tables": list(self.tables),
+                "entities": list(self.entities),
+            }
+
+
+class ConversationStore:
+    """Bounded LRU map of session key -> ConversationState, with idle sessions expiring."""
+
+    def __init__(self, max_sessions: int = CONVERSATION_MAX_SESSIONS, ttl: float = CONVERSATION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, previous_questions: Optional[List[str]] = None) -> ConversationState:
+        """Return a session's state, starting it from the earlier questions when it is new or expired."""
+        now = time.time()
+        with self._lock:
+            state = self._sessions.get(key)
+            if state is None or now - state.updated_at > self.ttl:
+                state = ConversationState.from_questions(previous_questions or [])
+                self._sessions[key] = state
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return state
+
+    def drop(self, key: str) -> None:
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the process-wide conversation store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore()
+        return _store
+
+
+def previous_questions(messages: Optional[List[Any]], question: str) -> List[str]:
+    """Earlier user questions from a chat history of {"role", "content"} dicts or LangChain messages."""
+    questions = []
+    for message in messages or []:
+        if isinstance(message, dict):
+            role, content = message.get("role"), message.get("content")
+        else:
+            role, content = getattr(message, "type", None), getattr(message, "content", None)
+        if role in ("user", "human") and content:
+            questions.append(str(content))
+    # The history may already end with the question being asked
+    if questions and questions[-1] == question:
+        questions.pop()
+    return questions
+
+
+def get_conversation(question: str, messages: Optional[List[Any]] = None, session_id: Optional[str] = None,
+                     tenant: Optional[str] = None) -> Optional[ConversationState]:
+    """
+    Return the state the question is asked in. A session id keeps the state across requests;
+    without one it is rebuilt from the messages. None when there is no conversation to follow.
+    """
+    if not CONVERSATION_ENABLED:
+        return None
+    earlier = previous_questions(messages, question)
+    if session_id is None:
+        return ConversationState.from_questions(earlier) if earlier else None
+    return get_conversation_store().get(f"{tenant or ''}:{session_id}", earlier)
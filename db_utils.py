@@ -1,53 +1,343 @@
-from typing import Dict, List, Any, Optional
-from sqlalchemy import create_engine, inspect, text
-import streamlit as st
-from langchain_community.utilities.sql_database import SQLDatabase
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Tuple
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 import os
 from dotenv import load_dotenv
+from schema_snapshot import get_schema_snapshot, invalidate_schema_snapshot
+from instrumentation import record_rows, stage
+from query_result import RESULT_FETCH_CHUNK_ROWS, QueryResult
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
 import logging
+import threading
+import time
+import weakref
+
+if TYPE_CHECKING:
+    # langchain_community is only imported when the first database is opened
+    from langchain_community.utilities.sql_database import SQLDatabase
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-def get_all_table_names(engine) -> List[str]:
-    """Get all table names from the database."""
-    inspector = inspect(engine)
-    return inspector.get_table_names()
+# Connection pool configuration shared by every engine in the registry
+DB_POOL_SIZE = int(os.getenv("db_pool_size", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("db_max_overflow", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("db_pool_timeout", "30"))
+DB_POOL_RECYCLE = int(os.getenv("db_pool_recycle", "1800"))
+DB_POOL_PRE_PING = os.getenv("db_pool_pre_ping", "true").lower() in ("1", "true", "yes")
+
+# Async drivers used in place of the sync driver of each backend
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+_engines: Dict[str, Any] = {}
+# Pool sizes each sync engine was created with, by URL, so its async engines get the same bound
+_pool_sizes: Dict[str, Tuple[int, int]] = {}
+_databases: Dict[str, "SQLDatabase"] = {}
+_registry_lock = threading.Lock()
+# Async engines are bound to the event loop that created their connections
+_async_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+class PoolMetrics:
+    """Counters describing how long callers wait to check out pooled connections."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record(self, wait_time: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_avg": round(self.wait_time_total / attempts, 6) if attempts else 0.0,
+                "wait_time_max": round(self.wait_time_max, 6),
+            }
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records checkout counts and wait times."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
 
-def get_database() -> SQLDatabase:
-    """Create and return a SQLDatabase instance using environment variables."""
+def get_database_uri() -> str:
+    """Build the database URI from environment variables."""
+    # A full SQLAlchemy URL (e.g. sqlite:///bench.db) takes precedence over the MySQL settings
+    database_url = os.getenv("database_url")
+    if database_url:
+        return database_url
+    
     db_user = os.getenv("db_user")
     db_password = os.getenv("db_password")
     db_host = os.getenv("db_host")
     db_name = os.getenv("db_name")
     
-    uri = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
+    return f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
+
+def get_engine(uri: Optional[str] = None, pool_size: Optional[int] = None, max_overflow: Optional[int] = None):
+    """
+    Return the process-wide engine for a URI, creating it on first use. Pool sizes
+    default to db_pool_size/db_max_overflow and only apply when the engine is created.
+    """
+    uri = uri or get_database_uri()
     
-    # First create engine to get table names
-    engine = create_engine(uri)
-    tables = get_all_table_names(engine)
+    with _registry_lock:
+        engine = _engines.get(uri)
+        if engine is None:
+            url = make_url(uri)
+            options = {
+                "pool_pre_ping": DB_POOL_PRE_PING,
+                "pool_recycle": DB_POOL_RECYCLE,
+            }
+            # Only dialects that use a queue pool by default get the sized, metered pool
+            if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+                options.update(
+                    poolclass=MeteredQueuePool,
+                    pool_size=DB_POOL_SIZE if pool_size is None else pool_size,
+                    max_overflow=DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                )
+            engine = create_engine(url, **options)
+            _engines[uri] = engine
+            _pool_sizes[url.render_as_string(hide_password=False)] = (
+                DB_POOL_SIZE if pool_size is None else pool_size,
+                DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+            )
+        return engine
+
+def get_async_engine(uri=None):
+    """
+    Return the async engine for a URI (or the sync engine URL of a SQLDatabase) on the
+    running event loop, swapping the sync driver for its async counterpart. It gets the
+    pool sizes of the sync engine for the same URL (e.g. tenant_pool_size for tenants).
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    
+    loop = asyncio.get_running_loop()
+    url = make_url(uri or get_database_uri())
+    pool_size, max_overflow = _pool_sizes.get(url.render_as_string(hide_password=False), (DB_POOL_SIZE, DB_MAX_OVERFLOW))
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    key = url.render_as_string(hide_password=False)
+    
+    with _registry_lock:
+        engines = _async_engines.setdefault(loop, {})
+        engine = engines.get(key)
+        if engine is None:
+            options = {
+                "pool_pre_ping": DB_POOL_PRE_PING,
+                "pool_recycle": DB_POOL_RECYCLE,
+            }
+            if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+                options.update(
+                    pool_size=pool_size,
+                    max_overflow=max_overflow,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                )
+            engine = create_async_engine(url, **options)
+            engines[key] = engine
+        return engine
+
+@contextmanager
+def _statement_timeout(conn, timeout_ms: int):
+    """Abort statements on this connection after timeout_ms where the driver allows it."""
+    dialect = conn.engine.dialect.name
+    if timeout_ms <= 0 or dialect not in ("sqlite", "postgresql"):
+        # MySQL gets a MAX_EXECUTION_TIME hint in the statement itself (sql_guard.add_timeout_hint)
+        yield
+        return
+    if dialect == "postgresql":
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+        yield
+        return
     
-    # Create SQLDatabase with all tables included
-    return SQLDatabase.from_uri(uri, include_tables=tables)
+    # SQLite: the progress handler interrupts the running statement once the deadline passes
+    driver_connection = conn.connection.driver_connection
+    deadline = time.monotonic() + timeout_ms / 1000
+    driver_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+    try:
+        yield
+    finally:
+        driver_connection.set_progress_handler(None, 0)
 
-def analyze_schema(db: SQLDatabase) -> dict:
+def fetch_query(db: "SQLDatabase", query: str, timeout_ms: int = 0, **budget) -> QueryResult:
+    """
+    Run a query through a server-side cursor, fetching in chunks and keeping typed rows
+    only up to the result budget (see query_result). Memory stays flat for any result size.
+    """
+    with db._engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=RESULT_FETCH_CHUNK_ROWS)
+        with _statement_timeout(conn, timeout_ms):
+            result = conn.execute(text(query))
+            try:
+                query_result = QueryResult(list(result.keys()) if result.returns_rows else [], **budget)
+                if result.returns_rows:
+                    for partition in result.partitions(RESULT_FETCH_CHUNK_ROWS):
+                        if not all(query_result.add(row) for row in partition):
+                            break
+            finally:
+                result.close()
+    record_rows(query_result.total_rows)
+    return query_result
+
+@asynccontextmanager
+async def _astatement_timeout(conn, timeout_ms: int):
+    """Async variant of _statement_timeout."""
+    dialect = conn.engine.dialect.name
+    if timeout_ms <= 0 or dialect not in ("sqlite", "postgresql"):
+        yield
+        return
+    if dialect == "postgresql":
+        await conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+        yield
+        return
+    
+    # aiosqlite runs the progress handler on its worker thread
+    driver_connection = (await conn.get_raw_connection()).driver_connection
+    deadline = time.monotonic() + timeout_ms / 1000
+    await driver_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+    try:
+        yield
+    finally:
+        await driver_connection.set_progress_handler(None, 0)
+
+async def afetch_query(db: "SQLDatabase", query: str, timeout_ms: int = 0, **budget) -> QueryResult:
+    """Async variant of fetch_query on the async engine."""
+    engine = get_async_engine(db._engine.url)
+    async with engine.connect() as conn:
+        async with _astatement_timeout(conn, timeout_ms):
+            result = await conn.stream(text(query))
+            try:
+                query_result = QueryResult(list(result.keys()), **budget)
+                async for partition in result.partitions(RESULT_FETCH_CHUNK_ROWS):
+                    if not all(query_result.add(row) for row in partition):
+                        break
+            finally:
+                await result.close()
+    record_rows(query_result.total_rows)
+    return query_result
+
+def get_all_table_names(engine) -> List[str]:
+    """Get all table names from the database."""
+    return get_schema_snapshot(engine).get_table_names()
+
+def get_database(uri: Optional[str] = None, pool_size: Optional[int] = None,
+                 max_overflow: Optional[int] = None) -> "SQLDatabase":
+    """Return the shared SQLDatabase instance for a URI (defaults to the environment database)."""
+    uri = uri or get_database_uri()
+    
+    with _registry_lock:
+        db = _databases.get(uri)
+    if db is not None:
+        return db
+    
+    from langchain_community.utilities.sql_database import SQLDatabase
+    
+    # Table metadata comes from the schema snapshot, so skip SQLDatabase's own reflection
+    db = SQLDatabase(get_engine(uri, pool_size, max_overflow), lazy_table_reflection=True)
+    with _registry_lock:
+        return _databases.setdefault(uri, db)
+
+def get_pool_metrics(uri: Optional[str] = None) -> Dict[str, Any]:
+    """Return pool usage and checkout wait metrics for one engine, or all of them keyed by URL."""
+    with _registry_lock:
+        engines = dict(_engines)
+    if uri is not None:
+        engines = {uri: engines[uri]} if uri in engines else {}
+    
+    metrics = {}
+    for engine_uri, engine in engines.items():
+        pool = engine.pool
+        stats = {"status": pool.status()}
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        if isinstance(pool, MeteredQueuePool):
+            stats.update(pool.metrics.as_dict())
+        metrics[engine.url.render_as_string(hide_password=True)] = stats
+    
+    return metrics[next(iter(metrics))] if uri is not None and metrics else metrics
+
+def dispose_database(uri: str) -> None:
+    """Close the pools of one database (sync and async engines) and forget its schema snapshot."""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    async_key = (url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+                 if backend in ASYNC_DRIVERS else None)
+    with _registry_lock:
+        engine = _engines.pop(uri, None)
+        _databases.pop(uri, None)
+        _pool_sizes.pop(url.render_as_string(hide_password=False), None)
+        async_engines = [(loop, engines.pop(async_key)) for loop, engines in list(_async_engines.items())
+                         if async_key in engines]
+    if engine is not None:
+        engine.dispose()
+        invalidate_schema_snapshot(engine)
+    for loop, async_engine in async_engines:
+        # Async pools can only be closed on the loop that owns their connections
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(async_engine.dispose(), loop)
+
+def dispose_engines() -> None:
+    """Close every pooled connection, sync and async, and empty the registry."""
+    with _registry_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _databases.clear()
+        _pool_sizes.clear()
+        async_engines = [(loop, engine) for loop, engines in list(_async_engines.items()) for engine in engines.values()]
+        _async_engines.clear()
+    for loop, async_engine in async_engines:
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(async_engine.dispose(), loop)
+
+def analyze_schema(db: "SQLDatabase") -> dict:
     """Analyze database schema and extract metadata about tables and their purposes."""
-    engine = db._engine
-    inspector = inspect(engine)
+    snapshot = get_schema_snapshot(db)
     schema_info = {}
     
-    for table_name in inspector.get_table_names():
-        # Get table structure
-        columns = inspector.get_columns(table_name)
-        sample_data = []
-        
-        # Get sample data to understand content
-        try:
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SELECT * FROM {table_name} LIMIT 5"))
-                sample_data = [dict(row) for row in result]
-        except Exception as e:
-            logger.error(f"Error getting sample data for {table_name}: {e}")
+    for table_name in snapshot.get_table_names():
+        # Get table structure and sample data to understand content
+        columns = snapshot.get_columns(table_name)
+        sample_data = snapshot.get_sample_rows(table_name, limit=5)
         
         # Determine table purpose based on column analysis
         purpose = infer_table_purpose(table_name, columns, sample_data)
@@ -55,7 +345,7 @@ def analyze_schema(db: SQLDatabase) -> dict:
         schema_info[table_name] = {
             "columns": [{"name": col["name"], "type": str(col["type"])} for col in columns],
             "sample_data": sample_data,
-            "relationships": inspector.get_foreign_keys(table_name),
+            "relationships": snapshot.get_foreign_keys(table_name),
             "purpose": purpose
         }
     
@@ -101,34 +391,38 @@ def infer_table_purpose(table_name: str, columns: List[Dict], sample_data: List[
         # Generic fallback that uses the table name
         return f"Contains information related to {table_name.replace('_', ' ')}"
 
-def get_table_info(db: SQLDatabase) -> str:
-    """Get detailed information about all tables in the database."""
-    engine = db._engine
-    inspector = inspect(engine)
+def get_table_info(db: "SQLDatabase", table_names: Optional[List[str]] = None, sample_values: bool = True) -> str:
+    """
+    Get detailed information about all tables in the database, or only the given tables.
+    Without sample_values the column examples are left out, for a shorter block.
+    """
+    if table_names is None:
+        # The full block only changes with the schema, so it is rendered once per snapshot
+        snapshot = get_schema_snapshot(db)
+        attribute = "table_info" if sample_values else "compact_table_info"
+        if getattr(snapshot, attribute) is None:
+            with stage("schema_render", tables=None):
+                setattr(snapshot, attribute, _render_table_info(db, None, sample_values))
+        return getattr(snapshot, attribute)
+    with stage("schema_render", tables=len(table_names)):
+        return _render_table_info(db, table_names, sample_values)
+
+def _render_table_info(db: "SQLDatabase", table_names: Optional[List[str]], show_samples: bool = True) -> str:
+    snapshot = get_schema_snapshot(db)
     table_info = []
     
-    for table_name in inspector.get_table_names():
-        columns = inspector.get_columns(table_name)
-        fks = inspector.get_foreign_keys(table_name)
-        pks = inspector.get_pk_constraint(table_name)
+    # Canonical order, independent of reflection order, so the block is byte-stable across
+    # reloads and workers and can be reused from the LLM provider's prompt cache
+    for table_name in sorted(snapshot.get_table_names()):
+        if table_names is not None and table_name not in table_names:
+            continue
+
+        columns = snapshot.get_columns(table_name)
+        fks = snapshot.get_foreign_keys(table_name)
+        pks = snapshot.get_pk_constraint(table_name)
         
         # Analyze sample data to improve table description
-        sample_data = []
-        try:
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SELECT * FROM {table_name} LIMIT 3"))
-                sample_data = []
-                for row in result:
-                    try:
-                        sample_data.append({key: value for key, value in row._mapping.items()})
-                    except Exception:
-                        # Fallback to a safer approach if _mapping doesn't work
-                        try:
-                            sample_data.append(dict(row))
-                        except Exception:
-                            pass  # Skip this row if we can't convert it
-        except Exception as e:
-            logger.error(f"Error getting sample data for {table_name}: {e}")
+        sample_data = snapshot.get_sample_rows(table_name, limit=3)
         
         # Infer table purpose
         purpose = infer_table_purpose(table_name, columns, sample_data)
@@ -149,7 +443,7 @@ def get_table_info(db: SQLDatabase) -> str:
                         sample_values.append(str(row[col['name']]))
             
             sample_str = ""
-            if sample_values:
+            if sample_values and show_samples:
                 sample_str = f" (examples: {', '.join(sample_values[:3])})"
             
             column_desc.append(
@@ -158,50 +452,51 @@ def get_table_info(db: SQLDatabase) -> str:
             
         # Build foreign key descriptions
         fk_desc = []
-        for fk in fks:
+        for fk in sorted(fks, key=lambda fk: (fk['constrained_columns'], fk['referred_table'])):
             fk_desc.append(
                 f"- {', '.join(fk['constrained_columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}"
             )
             
         # Add table description
+        columns_block = ''.join(f"{col}\n" for col in column_desc)
+        fk_block = ''.join(f"{fk}\n" for fk in fk_desc) if fk_desc else "- None\n"
         table_info.append(
             f"Table: {table_name}\n"
             f"Purpose: {purpose}\n"
-            f"Columns:\n{''.join(f'{col}\n' for col in column_desc)}"
-            f"Foreign Keys:\n{''.join(f'{fk}\n' for fk in fk_desc) if fk_desc else '- None\n'}"
+            f"Columns:\n{columns_block}"
+            f"Foreign Keys:\n{fk_block}"
             f"\n"
         )
     
     return '\n'.join(table_info)
 
-def get_column_mappings(db: SQLDatabase) -> Dict[str, List[str]]:
+# Common information categories and the column name fragments that indicate them
+COLUMN_CATEGORIES = {
+    "menu_items": ["product", "item", "dish", "food", "menu"],
+    "contact_info": ["phone", "email", "contact", "address"],
+    "hours": ["hour", "time", "schedule", "open", "close"],
+    "location": ["location", "address", "place", "where"],
+    "pricing": ["price", "cost", "rate", "fee"],
+    "dietary": ["vegetarian", "vegan", "allergy", "gluten", "dairy"]
+}
+
+def get_column_mappings(db: "SQLDatabase") -> Dict[str, List[str]]:
     """
     Create mappings of common question topics to relevant columns across tables.
     This helps with query generation by identifying which columns contain certain types of information.
     """
-    engine = db._engine
-    inspector = inspect(engine)
+    snapshot = get_schema_snapshot(db)
     mappings = {}
     
-    # Define common information categories
-    categories = {
-        "menu_items": ["product", "item", "dish", "food", "menu"],
-        "contact_info": ["phone", "email", "contact", "address"],
-        "hours": ["hour", "time", "schedule", "open", "close"],
-        "location": ["location", "address", "place", "where"],
-        "pricing": ["price", "cost", "rate", "fee"],
-        "dietary": ["vegetarian", "vegan", "allergy", "gluten", "dairy"]
-    }
-    
     # For each table, analyze columns
-    for table_name in inspector.get_table_names():
-        columns = inspector.get_columns(table_name)
+    for table_name in snapshot.get_table_names():
+        columns = snapshot.get_columns(table_name)
         
         for col in columns:
             col_name = col["name"].lower()
             
             # Map column to appropriate categories
-            for category, keywords in categories.items():
+            for category, keywords in COLUMN_CATEGORIES.items():
                 if any(keyword in col_name for keyword in keywords):
                     if category not in mappings:
                         mappings[category] = []
@@ -0,0 +1,228 @@
+from typing import Dict, List, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from sqlalchemy import text
+from schema_snapshot import get_schema_snapshot
+from db_utils import get_async_engine
+from instrumentation import record_rows
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Total wall-clock time the fallback search may take across all tables
+FALLBACK_TIME_BUDGET = float(os.getenv("fallback_time_budget", "5"))
+# Maximum rows returned across all tables
+FALLBACK_MAX_ROWS = int(os.getenv("fallback_max_rows", "50"))
+# Maximum rows fetched per table and search term
+FALLBACK_ROWS_PER_TERM = int(os.getenv("fallback_rows_per_term", "5"))
+# Number of tables searched concurrently (each worker holds one pooled connection)
+FALLBACK_MAX_WORKERS = int(os.getenv("fallback_max_workers", "4"))
+
+# Common words that never make useful search terms
+STOP_WORDS = {'what', 'where', 'when', 'how', 'who', 'list', 'show', 'tell', 'give', 'are', 'is', 'the', 'a', 'an', 'can', 'you', 'your', 'me', 'i', 'my', 'available'}
+
+def extract_search_terms(question: str) -> List[str]:
+    """Split a question into meaningful, de-duplicated search terms."""
+    normalized_question = question.lower().replace('-', ' ').strip()
+    terms = []
+    for term in normalized_question.split():
+        term = term.strip('?.,!;:"\'()')
+        if term not in STOP_WORDS and len(term) > 2 and term not in terms:
+            terms.append(term)
+    return terms
+
+def get_text_columns(columns: List[Dict[str, Any]]) -> List[str]:
+    """Return the names of varchar/text columns."""
+    return [col['name'] for col in columns
+            if 'varchar' in str(col['type']).lower() or 'text' in str(col['type']).lower()]
+
+def build_table_search_query(engine, table_name: str, text_columns: List[str], search_terms: List[str],
+                             limit_per_term: int, timeout_ms: Optional[int] = None) -> Tuple[str, Dict[str, str]]:
+    """
+    Build one statement that searches every text column of a table for every term.
+    Each term gets its own LIMITed branch so a very common term cannot crowd out the others.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    table = quote(table_name)
+    params = {}
+    branches = []
+    for i, term in enumerate(search_terms):
+        params[f"term_{i}"] = f"%{term}%"
+        conditions = " OR ".join(f"LOWER({quote(col)}) LIKE :term_{i}" for col in text_columns)
+        branches.append(
+            f"SELECT * FROM (SELECT * FROM {table} WHERE {conditions} LIMIT {int(limit_per_term)}) AS term_{i}"
+        )
+
+    query = " UNION ALL ".join(branches)
+    if timeout_ms and engine.dialect.name == "mysql":
+        # Let the server abort the statement once the remaining budget is spent
+        query = f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */" + query[len("SELECT"):]
+    return query, params
+
+def _row_key(row: Dict[str, Any], pk_columns: List[str]) -> tuple:
+    """Identity of a row used to drop duplicates matched by several terms."""
+    if pk_columns and all(col in row for col in pk_columns):
+        return tuple(row[col] for col in pk_columns)
+    return tuple(str(value) for value in row.values())
+
+def _collect_rows(results: Dict[str, List[Dict[str, Any]]], seen: Dict[str, set], table_name: str,
+                  rows: List[Dict[str, Any]], pk_columns: List[str], limit: int) -> int:
+    """Append rows not collected before for this table, up to limit. Returns the number added."""
+    table_seen = seen.setdefault(table_name, set())
+    added = 0
+    for row in rows:
+        if added >= limit:
+            break
+        key = _row_key(row, pk_columns)
+        if key in table_seen:
+            continue
+        table_seen.add(key)
+        results.setdefault(table_name, []).append(row)
+        added += 1
+    return added
+
+def _searchable_tables(snapshot, table_names: Optional[List[str]]) -> List[Tuple[str, List[str]]]:
+    """Return (table, text columns) for every table that has text columns."""
+    tables = []
+    for table_name in (table_names or snapshot.get_table_names()):
+        text_columns = get_text_columns(snapshot.get_columns(table_name))
+        if text_columns:
+            tables.append((table_name, text_columns))
+    return tables
+
+def search_tables(db, search_terms: List[str], time_budget: Optional[float] = None,
+                  max_rows: Optional[int] = None, table_names: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Search the text columns of every table for the given terms.
+    Tables are searched concurrently with one statement each; the search stops when the
+    time budget is spent or max_rows distinct rows have been collected.
+    """
+    time_budget = FALLBACK_TIME_BUDGET if time_budget is None else time_budget
+    max_rows = FALLBACK_MAX_ROWS if max_rows is None else max_rows
+    if not search_terms or max_rows <= 0:
+        return {}
+
+    engine = db._engine
+    snapshot = get_schema_snapshot(db)
+    deadline = time.monotonic() + time_budget
+
+    pending = queue.Queue()
+    for table in _searchable_tables(snapshot, table_names):
+        pending.put(table)
+    if pending.empty():
+        return {}
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    seen: Dict[str, set] = {}
+    total_rows = [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker():
+        # Each worker checks out a single pooled connection and reuses it for its tables
+        with engine.connect() as conn:
+            while not stop.is_set():
+                try:
+                    table_name, text_columns = pending.get_nowait()
+                except queue.Empty:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    stop.set()
+                    return
+
+                query, params = build_table_search_query(
+                    engine, table_name, text_columns, search_terms,
+                    FALLBACK_ROWS_PER_TERM, timeout_ms=int(remaining * 1000)
+                )
+                try:
+                    rows = [{str(k): v for k, v in row._mapping.items()} for row in conn.execute(text(query), params)]
+                except Exception as e:
+                    logger.error(f"Error in fallback query for {table_name}: {e}")
+                    continue
+
+                pk_columns = snapshot.get_pk_constraint(table_name).get('constrained_columns', [])
+                with lock:
+                    if stop.is_set():
+                        return
+                    total_rows[0] += _collect_rows(results, seen, table_name, rows, pk_columns, max_rows - total_rows[0])
+                    if total_rows[0] >= max_rows:
+                        stop.set()
+
+    workers = min(FALLBACK_MAX_WORKERS, pending.qsize())
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fallback-search")
+    # Run each worker in a copy of the caller's context so its queries count towards the current request
+    futures = [executor.submit(contextvars.copy_context().run, worker) for _ in range(workers)]
+    done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    if not_done:
+        logger.warning(f"Fallback search stopped after {time_budget}s time budget")
+    stop.set()
+    # Don't block on statements that are still running past the budget
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    with lock:
+        record_rows(total_rows[0])
+        return {table_name: list(results[table_name]) for table_name in snapshot.get_table_names() if table_name in results}
+
+async def asearch_tables(db, search_terms: List[str], time_budget: Optional[float] = None,
+                         max_rows: Optional[int] = None, table_names: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Async variant of search_tables on the async engine. At most FALLBACK_MAX_WORKERS
+    tables are searched at once, and statements still running when the time budget
+    is spent are cancelled.
+    """
+    time_budget = FALLBACK_TIME_BUDGET if time_budget is None else time_budget
+    max_rows = FALLBACK_MAX_ROWS if max_rows is None else max_rows
+    if not search_terms or max_rows <= 0:
+        return {}
+
+    snapshot = await asyncio.to_thread(get_schema_snapshot, db)
+    tables = _searchable_tables(snapshot, table_names)
+    if not tables:
+        return {}
+
+    engine = get_async_engine(db._engine.url)
+    semaphore = asyncio.Semaphore(FALLBACK_MAX_WORKERS)
+    deadline = time.monotonic() + time_budget
+
+    async def search_table(table_name: str, text_columns: List[str]) -> List[Dict[str, Any]]:
+        async with semaphore:
+            remaining = deadline - time.monotonic()
+            query, params = build_table_search_query(
+                db._engine, table_name, text_columns, search_terms,
+                FALLBACK_ROWS_PER_TERM, timeout_ms=int(max(remaining, 0) * 1000)
+            )
+            async with engine.connect() as conn:
+                result = await conn.execute(text(query), params)
+                return [{str(k): v for k, v in row._mapping.items()} for row in result.fetchall()]
+
+    tasks = {asyncio.create_task(search_table(name, columns)): name for name, columns in tables}
+    done, not_done = await asyncio.wait(tasks, timeout=time_budget)
+    if not_done:
+        logger.warning(f"Fallback search stopped after {time_budget}s time budget")
+        for task in not_done:
+            task.cancel()
+        await asyncio.gather(*not_done, return_exceptions=True)
+
+    rows_by_table = {}
+    for task in done:
+        table_name = tasks[task]
+        if task.exception() is not None:
+            logger.error(f"Error in fallback query for {table_name}: {task.exception()}")
+            continue
+        rows_by_table[table_name] = task.result()
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    seen: Dict[str, set] = {}
+    total_rows = 0
+    for table_name in snapshot.get_table_names():
+        if table_name in rows_by_table and total_rows < max_rows:
+            pk_columns = snapshot.get_pk_constraint(table_name).get('constrained_columns', [])
+            total_rows += _collect_rows(results, seen, table_name, rows_by_table[table_name], pk_columns, max_rows - total_rows)
+    record_rows(total_rows)
+    return results
@@ -0,0 +1,286 @@
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+from sqlalchemy import bindparam, text
+from schema_snapshot import get_schema_snapshot
+from table_selection import tokenize
+from fallback_search import STOP_WORDS
+from instrumentation import record_rows
+from runtime import KeyLocks, add_event_handler
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FAQ_INDEX_ENABLED = os.getenv("faq_index_enabled", "true").lower() in ("1", "true", "yes")
+# Confidence from which the stored answer is returned as is, without SQL or LLM calls
+FAQ_INDEX_ANSWER_CONFIDENCE = float(os.getenv("faq_index_answer_confidence", "0.75"))
+# Confidence from which matching FAQ rows are passed to the answer prompt instead
+FAQ_INDEX_MIN_CONFIDENCE = float(os.getenv("faq_index_min_confidence", "0.15"))
+FAQ_INDEX_TOP_K = int(os.getenv("faq_index_top_k", "3"))
+# Seconds between checks of the FAQ tables for changes (0 disables)
+FAQ_INDEX_REFRESH_INTERVAL = float(os.getenv("faq_index_refresh_interval", "60"))
+# Rows loaded per FAQ table
+FAQ_INDEX_MAX_ROWS = int(os.getenv("faq_index_max_rows", "10000"))
+
+# Question words that carry no meaning for matching, on top of the fallback search stop words
+FAQ_STOP_WORDS = STOP_WORDS | {"do", "does", "have", "which", "there", "any", "for", "and", "about", "with", "of"}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_indexes: Dict[str, "FAQIndex"] = {}
+_indexes_lock = threading.Lock()
+_build_locks = KeyLocks()
+
+
+def faq_terms(value: str) -> List[str]:
+    return [term for term in tokenize(value) if term not in FAQ_STOP_WORDS and len(term) > 2]
+
+
+def find_faq_tables(snapshot) -> Dict[str, Tuple[str, str, Optional[str]]]:
+    """Return {table_name: (question_column, answer_column, pk_column)} for tables with FAQ-like column pairs."""
+    tables = {}
+    for table_name in snapshot.get_table_names():
+        columns = [col["name"] for col in snapshot.get_columns(table_name)]
+        question_col = next((col for col in columns if "question" in col.lower()), None)
+        answer_col = next((col for col in columns if "answer" in col.lower()), None)
+        if question_col and answer_col:
+            pk_columns = snapshot.get_pk_constraint(table_name).get("constrained_columns", [])
+            tables[table_name] = (question_col, answer_col, pk_columns[0] if len(pk_columns) == 1 else None)
+    return tables
+
+
+class FAQEntry(NamedTuple):
+    table_name: str
+    pk: Any
+    question: str
+    answer: str
+
+
+class FAQMatch(NamedTuple):
+    entry: FAQEntry
+    score: float
+    confidence: float
+
+
+class FAQIndex:
+    """
+    In-memory BM25 index over the question column of every FAQ-like table, built once
+    per schema and kept in sync by comparing a cheap per-table signature (row count,
+    highest primary key, total text length). Rows appended after the last load are
+    read by primary key; any other change reloads that table.
+    """
+
+    def __init__(self):
+        self.fingerprint: Optional[str] = None
+        self.tables: Dict[str, Tuple[str, str, Optional[str]]] = {}
+        self.entries: List[FAQEntry] = []
+        self._signatures: Dict[str, tuple] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: List[int] = []
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+        self._last_refresh = 0.0
+
+    # Loading
+
+    def _signature(self, conn, quote, table_name: str) -> tuple:
+        question_col, answer_col, pk_col = self.tables[table_name]
+        max_pk = f"MAX({quote(pk_col)})" if pk_col else "NULL"
+        return tuple(conn.execute(text(
+            f"SELECT COUNT(*), {max_pk}, SUM(LENGTH({quote(question_col)})), SUM(LENGTH({quote(answer_col)})) "
+            f"FROM {quote(table_name)}"
+        )).one())
+
+    def _read_rows(self, conn, quote, table_name: str, after_pk: Any = None) -> List[FAQEntry]:
+        question_col, answer_col, pk_col = self.tables[table_name]
+        key = quote(pk_col) if pk_col else "NULL"
+        query = f"SELECT {key}, {quote(question_col)}, {quote(answer_col)} FROM {quote(table_name)}"
+        params = {}
+        if after_pk is not None:
+            query += f" WHERE {quote(pk_col)} > :after_pk"
+            params["after_pk"] = after_pk
+        if pk_col:
+            query += f" ORDER BY {quote(pk_col)}"
+        query += f" LIMIT {int(FAQ_INDEX_MAX_ROWS)}"
+        rows = conn.execute(text(query), params).fetchall()
+        record_rows(len(rows))
+        return [FAQEntry(table_name, row[0], str(row[1]), str(row[2])) for row in rows if row[1] and row[2]]
+
+    def _add_entries(self, entries: List[FAQEntry]) -> None:
+        for entry in entries:
+            doc = len(self.entries)
+            terms = faq_terms(entry.question)
+            self.entries.append(entry)
+            self._lengths.append(len(terms))
+            for term in terms:
+                postings = self._postings.setdefault(term, {})
+                postings[doc] = postings.get(doc, 0) + 1
+
+    def _reindex(self, entries: List[FAQEntry]) -> None:
+        self.entries, self._postings, self._lengths = [], {}, []
+        self._add_entries(entries)
+
+    def build(self, db) -> int:
+        """Discover the FAQ tables of the current schema and load all their rows. Returns the row count."""
+        engine = db._engine
+        quote = engine.dialect.identifier_preparer.quote
+        snapshot = get_schema_snapshot(db)
+        tables = find_faq_tables(snapshot)
+
+        entries, signatures = [], {}
+        with self._lock:
+            self.tables = tables
+            with engine.connect() as conn:
+                for table_name in tables:
+                    try:
+                        signatures[table_name] = self._signature(conn, quote, table_name)
+                        entries.extend(self._read_rows(conn, quote, table_name))
+                    except Exception as e:
+                        logger.error(f"Error loading FAQ table {table_name}: {e}")
+            self._reindex(entries)
+            self._signatures = signatures
+            self.fingerprint = snapshot.fingerprint
+            self._last_refresh = time.time()
+        logger.info(f"FAQ index built with {len(entries)} entries from {len(tables)} tables")
+        return len(entries)
+
+    def refresh(self, db) -> Dict[str, int]:
+        """Pick up changes to the FAQ tables. Returns {table_name: rows read} for tables that changed."""
+        with self._refreshing:
+            if get_schema_snapshot(db).fingerprint != self.fingerprint:
+                return {"*": self.build(db)}
+
+            engine = db._engine
+            quote = engine.dialect.identifier_preparer.quote
+            changed = {}
+            with engine.connect() as conn:
+                for table_name, (_, _, pk_col) in self.tables.items():
+                    try:
+                        signature = self._signature(conn, quote, table_name)
+                        previous = self._signatures.get(table_name)
+                        if signature == previous:
+                            continue
+
+                        # Only inserts: the new rows account for the whole change in count and text length
+                        new_rows = []
+                        if pk_col and previous and previous[1] is not None:
+                            new_rows = self._read_rows(conn, quote, table_name, after_pk=previous[1])
+                        appended = (
+                            new_rows
+                            and previous[0] + len(new_rows) == signature[0]
+                            and (previous[2] or 0) + sum(len(row.question) for row in new_rows) == (signature[2] or 0)
+                            and (previous[3] or 0) + sum(len(row.answer) for row in new_rows) == (signature[3] or 0)
+                        )
+                        with self._lock:
+                            if appended:
+                                self._add_entries(new_rows)
+                            else:
+                                new_rows = self._read_rows(conn, quote, table_name)
+                                kept = [entry for entry in self.entries if entry.table_name != table_name]
+                                self._reindex(kept + new_rows)
+                            self._signatures[table_name] = signature
+                        changed[table_name] = len(new_rows)
+                    except Exception as e:
+                        logger.error(f"Error refreshing FAQ table {table_name}: {e}")
+            self._last_refresh = time.time()
+            if changed:
+                logger.info(f"FAQ index refreshed: {changed}")
+            return changed
+
+    def schedule_refresh(self, db) -> None:
+        """Start a background refresh if the refresh interval has passed and none is running."""
+        if FAQ_INDEX_REFRESH_INTERVAL <= 0 or self._refreshing.locked():
+            return
+        if time.time() - self._last_refresh < FAQ_INDEX_REFRESH_INTERVAL:
+            return
+        self._last_refresh = time.time()
+        threading.Thread(target=self.refresh, args=(db,), name="faq-index-refresh", daemon=True).start()
+
+    # Matching
+
+    def search(self, question: str, top_k: int = FAQ_INDEX_TOP_K) -> List[FAQMatch]:
+        """
+        Rank FAQ entries by BM25. The confidence of a match is the IDF-weighted overlap
+        between the question's terms and the FAQ question's terms (1.0 for the same terms).
+        """
+        query_terms = set(faq_terms(question))
+        with self._lock:
+            count = len(self.entries)
+            if not query_terms or not count:
+                return []
+            avg_length = sum(self._lengths) / count or 1.0
+
+            def idf(term: str) -> float:
+                df = len(self._postings.get(term, ()))
+                return math.log(1 + (count - df + 0.5) / (df + 0.5))
+
+            scores: Dict[int, float] = {}
+            for term in query_terms:
+                weight = idf(term)
+                for doc, tf in self._postings.get(term, {}).items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + weight * tf * (BM25_K1 + 1) / (tf + norm)
+
+            matches = []
+            for doc, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]:
+                entry = self.entries[doc]
+                entry_terms = set(faq_terms(entry.question))
+                union = sum(idf(term) for term in query_terms | entry_terms)
+                overlap = sum(idf(term) for term in query_terms & entry_terms)
+                matches.append(FAQMatch(entry, round(score, 4), round(overlap / union, 4) if union else 0.0))
+            return matches
+
+    def build_query(self, db, matches: List[FAQMatch]) -> Optional[str]:
+        """Render a self-contained SELECT of the matched answers, with the primary keys inlined as literals."""
+        if not matches:
+            return None
+        table_name = matches[0].entry.table_name
+        question_col, answer_col, pk_col = self.tables[table_name]
+        if not pk_col:
+            return None
+        pks = [match.entry.pk for match in matches if match.entry.table_name == table_name]
+        quote = db._engine.dialect.identifier_preparer.quote
+        query = text(
+            f"SELECT {quote(answer_col)} FROM {quote(table_name)} WHERE {quote(pk_col)} IN :pks"
+        ).bindparams(bindparam("pks", value=pks, expanding=True))
+        return str(query.compile(dialect=db._engine.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    if event == "tenant_evicted":
+        source = payload["db"]._engine.url.render_as_string(hide_password=True)
+        with _indexes_lock:
+            _indexes.pop(source, None)
+        _build_locks.forget(source)
+
+
+add_event_handler(_forget_tenant)
+
+
+def get_faq_index(db) -> Optional[FAQIndex]:
+    """Return the FAQ index of a database, building it on first use; None when disabled or unavailable."""
+    if not FAQ_INDEX_ENABLED:
+        return None
+    source = db._engine.url.render_as_string(hide_password=True)
+    with _indexes_lock:
+        index = _indexes.get(source)
+    if index is not None:
+        return index
+    # The build scans the FAQ tables, so it holds this database's lock only
+    with _build_locks(source):
+        with _indexes_lock:
+            index = _indexes.get(source)
+        if index is None:
+            index = FAQIndex()
+            try:
+                index.build(db)
+            except Exception as e:
+                logger.error(f"Error building FAQ index: {e}")
+                return None
+            with _indexes_lock:
+                _indexes[source] = index
+    return index
@@ -0,0 +1,254 @@
+from typing import Dict, List, Any, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+metrics_logger = logging.getLogger("nl_to_sql.metrics")
+
+# Emit one structured JSON log line per request
+METRICS_LOG_ENABLED = os.getenv("metrics_log", "false").lower() in ("1", "true", "yes")
+# File rewritten with Prometheus text-format metrics after every request
+METRICS_FILE = os.getenv("metrics_file")
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+if METRICS_LOG_ENABLED and not metrics_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    metrics_logger.addHandler(_handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+
+
+class RequestTrace:
+    """Timings and counters collected while answering one question."""
+
+    def __init__(self, question: str):
+        self.request_id = uuid.uuid4().hex
+        self.question = question
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.stages: List[Dict[str, Any]] = []
+        self.counters: Dict[str, float] = {
+            "llm_calls": 0,
+            "llm_prompt_tokens": 0,
+            "llm_completion_tokens": 0,
+            "db_queries": 0,
+            "db_rows": 0,
+        }
+        self.caches: Dict[str, Dict[str, int]] = {}
+        self.token = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, start: float, duration: float, attributes: Dict[str, Any]) -> None:
+        with self._lock:
+            self.stages.append({"name": name, "start": round(start - self._start, 6),
+                                "duration": round(duration, 6), **attributes})
+
+    def increment(self, counter: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_cache(self, name: str, hit: bool) -> None:
+        with self._lock:
+            stats = self.caches.setdefault(name, {"hits": 0, "misses": 0})
+            stats["hits" if hit else "misses"] += 1
+
+    def finish(self) -> None:
+        self.duration = round(time.perf_counter() - self._start, 6)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "request_id": self.request_id,
+                "question": self.question,
+                "started_at": self.started_at,
+                "duration": self.duration,
+                "stages": sorted(self.stages, key=lambda stage: stage["start"]),
+                "counters": dict(self.counters),
+                "caches": {name: dict(stats) for name, stats in self.caches.items()},
+            }
+
+
+class MetricsRegistry:
+    """Process-wide aggregates exported in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.stage_count: Dict[str, int] = {}
+        self.stage_sum: Dict[str, float] = {}
+        self.stage_buckets: Dict[str, List[int]] = {}
+        self.counters: Dict[str, float] = {}
+        self.cache_events: Dict[tuple, int] = {}
+
+    def observe_stage(self, name: str, duration: float) -> None:
+        with self._lock:
+            self.stage_count[name] = self.stage_count.get(name, 0) + 1
+            self.stage_sum[name] = self.stage_sum.get(name, 0.0) + duration
+            buckets = self.stage_buckets.setdefault(name, [0] * len(LATENCY_BUCKETS))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+
+    def increment(self, counter: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_cache(self, name: str, hit: bool) -> None:
+        with self._lock:
+            key = (name, "hit" if hit else "miss")
+            self.cache_events[key] = self.cache_events.get(key, 0) + 1
+
+    def observe_request(self, duration: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += duration
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# TYPE nl_to_sql_requests_total counter",
+                f"nl_to_sql_requests_total {self.requests}",
+                "# TYPE nl_to_sql_request_seconds_total counter",
+                f"nl_to_sql_request_seconds_total {self.request_seconds:.6f}",
+                "# TYPE nl_to_sql_stage_seconds histogram",
+            ]
+            for name in sorted(self.stage_count):
+                for bound, count in zip(LATENCY_BUCKETS, self.stage_buckets[name]):
+                    lines.append(f'nl_to_sql_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'nl_to_sql_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {self.stage_count[name]}')
+                lines.append(f'nl_to_sql_stage_seconds_sum{{stage="{name}"}} {self.stage_sum[name]:.6f}')
+                lines.append(f'nl_to_sql_stage_seconds_count{{stage="{name}"}} {self.stage_count[name]}')
+            for counter in sorted(self.counters):
+                lines.append(f"# TYPE nl_to_sql_{counter}_total counter")
+                lines.append(f"nl_to_sql_{counter}_total {self.counters[counter]:g}")
+            lines.append("# TYPE nl_to_sql_cache_requests_total counter")
+            for (name, outcome), count in sorted(self.cache_events.items()):
+                lines.append(f'nl_to_sql_cache_requests_total{{cache="{name}",outcome="{outcome}"}} {count}')
+            return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("nl_to_sql_trace", default=None)
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def start_trace(question: str) -> RequestTrace:
+    """Start collecting metrics for a request in the current context."""
+    trace = RequestTrace(question)
+    trace.token = _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: RequestTrace) -> Dict[str, Any]:
+    """Finish a request: log it, update the aggregates and the metrics file."""
+    try:
+        _current_trace.reset(trace.token)
+    except ValueError:
+        # A generator finished in a different context than it started in
+        pass
+
+    trace.finish()
+    registry.observe_request(trace.duration)
+    data = trace.as_dict()
+    metrics_logger.info(json.dumps(data, default=str))
+    if METRICS_FILE:
+        write_metrics_file(METRICS_FILE)
+    return data
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a block of work as a named stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe_stage(name, duration)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, start, duration, attributes)
+
+
+def increment(counter: str, amount: float = 1) -> None:
+    """Add to a per-request and process-wide counter."""
+    registry.increment(counter, amount)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.increment(counter, amount)
+
+
+def record_rows(count: int) -> None:
+    increment("db_rows", count)
+
+
+def record_cache(name: str, hit: bool) -> None:
+    """Record a cache lookup outcome."""
+    registry.record_cache(name, hit)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record_cache(name, hit)
+
+
+def render_prometheus() -> str:
+    return registry.render()
+
+
+def write_metrics_file(path: str) -> None:
+    """Atomically replace a file with the current Prometheus metrics."""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Error writing metrics file {path}: {e}")
+
+
+class LLMUsageHandler(BaseCallbackHandler):
+    """LangChain callback that counts LLM calls and prompt/completion tokens."""
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        prompt_tokens = completion_tokens = cached_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                    cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        if not prompt_tokens and not completion_tokens and response.llm_output:
+            usage = response.llm_output.get("token_usage") or {}
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+        increment("llm_calls")
+        increment("llm_prompt_tokens", prompt_tokens)
+        increment("llm_completion_tokens", completion_tokens)
+        # Prompt tokens the provider served from its prompt cache, when it reports them
+        increment("llm_cached_prompt_tokens", cached_tokens)
+
+
+llm_usage_handler = LLMUsageHandler()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_db_query(conn, cursor, statement, parameters, context, executemany):
+    # Counts every statement sent on any engine, including the async engines' sync core
+    increment("db_queries")
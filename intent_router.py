@@ -0,0 +1,368 @@
+from typing import Any, Dict, List, NamedTuple, Optional
+from sqlalchemy import text
+from db_utils import COLUMN_CATEGORIES, get_column_mappings
+from schema_snapshot import get_schema_snapshot
+from fallback_search import STOP_WORDS
+from table_selection import tokenize
+from instrumentation import increment, record_cache, record_rows
+from runtime import KeyLocks, add_event_handler
+import logging
+import math
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+INTENT_ROUTER_ENABLED = os.getenv("intent_router_enabled", "true").lower() in ("1", "true", "yes")
+# Classifier probability from which a rule match is answered from its template
+INTENT_ROUTER_MIN_CONFIDENCE = float(os.getenv("intent_router_min_confidence", "0.6"))
+# Rows read and listed in a templated answer
+INTENT_ROUTER_MAX_ROWS = int(os.getenv("intent_router_max_rows", "10"))
+
+# Rules: a question is only routed to an intent whose pattern it matches
+INTENT_PATTERNS = {
+    "hours": re.compile(r"\b(hours|opening|closing|open|close|closed|timings?|what time)\b"),
+    "location": re.compile(r"\b(where|located|location|address|directions)\b"),
+    "contact_info": re.compile(r"\b(phone|call|email|contact|reach)\b"),
+    "pricing": re.compile(r"\b(prices?|cost|costs|how much|charge)\b"),
+    "dietary": re.compile(r"\b(vegetarian|vegan|gluten|dairy|allerg\w*|halal)\b"),
+}
+# The diet asked about, with "-free" kept since it reverses the meaning ("gluten free")
+DIET_PHRASE_PATTERN = re.compile(r"\b(vegetarian|vegan|gluten|dairy|allerg\w*|halal)(?:[\s-](free))?\b")
+# Phrasing cues learned by the classifier on top of the column categories' keywords
+INTENT_CUES = {
+    "hours": "open opening close closing closed hour timing time today tomorrow weekend sunday monday "
+             "tuesday wednesday thursday friday saturday holiday late early schedule",
+    "location": "where located location address direction find near place street city map parking",
+    "contact_info": "phone number call email contact reach whatsapp mail",
+    "pricing": "price cost much charge expensive rate fee pay",
+    "dietary": "vegetarian vegan gluten dairy allergy allergen halal free option diet",
+}
+# Questions the templates can't express: counts, comparisons, superlatives
+COMPLEX_PATTERN = re.compile(
+    r"\b(how many|count|average|avg|total|sum|most|least|cheapest|highest|lowest|between|"
+    r"more than|less than|under|over|compare|than|per|each|every|non|not|without)\b"
+)
+# Words that don't narrow down which rows are meant, in tokenized (singularised) form
+GENERIC_TERMS = set(tokenize(
+    "dish dishes item items food foods menu option options thing things anything something have has serve "
+    "offer offers does please there any some all the for and with much restaurant place today now get find "
+    "know want like would could about this that your our you us"
+))
+# Columns matching a category name by accident (created_time, updated_at, ...)
+AUDIT_COLUMN_PATTERN = re.compile(r"created|updated|modified|deleted|_at$|_id$")
+# Intents that answer for given rows (need a name column), the others list an information table
+ROW_INTENTS = {"pricing", "dietary"}
+# Additive smoothing of the classifier; small, so one cue word is decisive against unrelated classes
+SMOOTHING = 0.05
+
+INTENT_LABELS = {
+    "hours": "Here are our opening hours:",
+    "location": "Here is where you can find us:",
+    "contact_info": "Here is how you can reach us:",
+    "pricing": "Here are the prices:",
+    "dietary": "Here are some {term} options:",
+}
+
+_routers: Dict[str, "IntentRouter"] = {}
+_routers_lock = threading.Lock()
+_build_locks = KeyLocks()
+
+
+def content_terms(question: str) -> List[str]:
+    return [term for term in tokenize(question.replace("-", " ")) if term not in STOP_WORDS and len(term) > 2]
+
+
+def _name_column(columns: List[Dict[str, Any]]) -> Optional[str]:
+    names = [col["name"] for col in columns]
+    return next((name for name in names if name.lower() in ("name", "title", "item_name", "dish_name")),
+                next((name for name in names if "name" in name.lower()), None))
+
+
+class IntentTemplate(NamedTuple):
+    intent: str
+    table_name: str
+    # Columns of the intent's category
+    columns: List[str]
+    name_column: Optional[str]
+    # Columns listed in the answer next to the name
+    shown_columns: List[str]
+
+
+class RoutedQuestion(NamedTuple):
+    intent: str
+    confidence: float
+    template: IntentTemplate
+    # Question terms used to filter rows
+    terms: List[str]
+    # Diet phrase of a dietary question as asked, e.g. "vegan" or "gluten-free"
+    phrase: str = ""
+
+
+class IntentRouter:
+    """
+    Answers high-frequency questions (opening hours, location, contact details, prices,
+    dietary options) from parameterized SQL templates and a templated answer, without
+    LLM calls. A question is routed when it matches an intent's rule, the classifier
+    agrees with enough confidence, and the template returns rows; anything else goes
+    to the LLM. The classifier is a naive Bayes model over question terms, trained on
+    the column categories of db_utils.get_column_mappings, the columns they map to in
+    this schema and a few phrasing cues, against the schema's other column names.
+    """
+
+    def __init__(self, snapshot, mappings: Dict[str, List[str]]):
+        self.fingerprint = snapshot.fingerprint
+        self.table_terms = {name: set(tokenize(name)) for name in snapshot.get_table_names()}
+        # intent -> table -> columns of the intent's category
+        self.candidates: Dict[str, Dict[str, List[str]]] = {}
+        self.name_columns: Dict[str, Optional[str]] = {}
+        self.description_columns: Dict[str, Optional[str]] = {}
+        self.flag_columns = set()
+        for table_name in snapshot.get_table_names():
+            columns = snapshot.get_columns(table_name)
+            self.name_columns[table_name] = _name_column(columns)
+            self.description_columns[table_name] = next(
+                (col["name"] for col in columns if "description" in col["name"].lower()), None)
+            self.flag_columns.update((table_name, col["name"]) for col in columns
+                                     if re.search(r"BOOL|INT|BIT", str(col["type"]).upper()))
+        for intent in INTENT_PATTERNS:
+            for mapped in mappings.get(intent, []):
+                table_name, column = mapped.split(".", 1)
+                if not AUDIT_COLUMN_PATTERN.search(column.lower()):
+                    self.candidates.setdefault(intent, {}).setdefault(table_name, []).append(column)
+        self._train(snapshot)
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.routed: Dict[str, int] = {}
+
+    def _train(self, snapshot) -> None:
+        documents = {intent: tokenize(" ".join(COLUMN_CATEGORIES.get(intent, [])) + " " + INTENT_CUES[intent])
+                     for intent in INTENT_PATTERNS}
+        mapped_columns = set()
+        for intent, tables in self.candidates.items():
+            for table_name, columns in tables.items():
+                documents[intent].extend(term for column in columns for term in tokenize(column))
+                mapped_columns.update((table_name, column) for column in columns)
+        documents["other"] = [term for table_name in snapshot.get_table_names()
+                              for col in snapshot.get_columns(table_name) if (table_name, col["name"]) not in mapped_columns
+                              for term in tokenize(col["name"])]
+
+        self.vocabulary = {term for terms in documents.values() for term in terms}
+        self.log_likelihoods: Dict[str, Dict[str, float]] = {}
+        self.log_unseen: Dict[str, float] = {}
+        for label, terms in documents.items():
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            total = sum(counts.values()) + SMOOTHING * len(self.vocabulary)
+            self.log_likelihoods[label] = {term: math.log((count + SMOOTHING) / total) for term, count in counts.items()}
+            self.log_unseen[label] = math.log(SMOOTHING / total)
+
+    def classify(self, terms: List[str]) -> Dict[str, float]:
+        """Posterior probability of each intent (and "other") given the question terms, uniform prior."""
+        known = [term for term in terms if term in self.vocabulary]
+        scores = {
+            label: sum(likelihoods.get(term, self.log_unseen[label]) for term in known)
+            for label, likelihoods in self.log_likelihoods.items()
+        }
+        top = max(scores.values())
+        weights = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(weights.values())
+        return {label: weight / total for label, weight in weights.items()}
+
+    def _template(self, intent: str, mentioned: List[str]) -> Optional[IntentTemplate]:
+        """The table to answer an intent from: the one the question names, or the only/best candidate."""
+        tables = self.candidates.get(intent, {})
+        if intent in ROW_INTENTS:
+            tables = {name: columns for name, columns in tables.items() if self.name_columns.get(name)}
+        if mentioned:
+            named = [name for name in mentioned if name in tables]
+            if len(named) != 1:
+                # The question is about another table, or several
+                return None
+            table_name = named[0]
+        else:
+            ranked = sorted(tables, key=lambda name: (-len(tables[name]), name))
+            if not ranked or (len(ranked) > 1 and len(tables[ranked[0]]) == len(tables[ranked[1]])):
+                return None
+            table_name = ranked[0]
+        name_column = self.name_columns.get(table_name)
+        columns = [col for col in tables[table_name] if col != name_column]
+        # Diet columns only filter; the answer describes the matching items instead
+        shown = columns
+        if intent == "dietary":
+            description = self.description_columns.get(table_name)
+            shown = [description] if description else []
+        return IntentTemplate(intent, table_name, columns, name_column, shown)
+
+    def route(self, question: str) -> Optional[RoutedQuestion]:
+        """Classify a question; None when it should go to the LLM."""
+        lowered = question.lower()
+        matched = [intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(lowered)]
+        if not matched or COMPLEX_PATTERN.search(lowered):
+            return None
+
+        terms = content_terms(lowered)
+        mentioned = [name for name, name_terms in self.table_terms.items() if name_terms & set(terms)]
+        table_terms = {term for name in mentioned for term in self.table_terms[name]}
+        features = [term for term in terms if term not in table_terms]
+        posterior = self.classify(features)
+        intent = max(posterior, key=posterior.get)
+        if intent not in matched or posterior[intent] < INTENT_ROUTER_MIN_CONFIDENCE:
+            return None
+
+        template = self._template(intent, mentioned)
+        if template is None:
+            return None
+        # Whatever isn't an intent cue, a table name or filler names the rows asked about
+        cues = set(self.log_likelihoods[intent])
+        filters = [term for term in features if term not in cues and term not in GENERIC_TERMS]
+        phrase = ""
+        if intent == "dietary":
+            match = DIET_PHRASE_PATTERN.search(lowered)
+            if match is None:
+                return None
+            phrase = "-".join(part for part in match.groups() if part)
+            filters = tokenize(match.group(1))[:1] + [term for term in filters if term != "free"]
+        return RoutedQuestion(intent, round(posterior[intent], 4), template, filters, phrase)
+
+    def build_query(self, db, routed: RoutedQuestion):
+        """Parameterized SELECT for a routed question, or None when its filters can't be expressed."""
+        quote = db._engine.dialect.identifier_preparer.quote
+        template = routed.template
+        columns = ([template.name_column] if template.name_column else []) + template.shown_columns
+        conditions, params = [], {}
+        if template.intent == "dietary":
+            if not routed.terms:
+                return None
+            # A flag column only counts when named after the diet, "-free" included (is_gluten_free
+            # for "gluten-free", not for "gluten"); text columns must mention the phrase
+            diet, free = routed.terms[0], routed.phrase.endswith("-free")
+            options = []
+            for col in template.columns:
+                col_terms = tokenize(col)
+                if (template.table_name, col) in self.flag_columns:
+                    if diet in col_terms and ("free" in col_terms) == free:
+                        options.append(f"{quote(col)} = 1")
+                else:
+                    options.append(f"LOWER({quote(col)}) LIKE :diet")
+                    params["diet"] = f"%{diet}%free%" if free else f"%{diet}%"
+            if not options:
+                return None
+            conditions.append(f"({' OR '.join(options)})")
+            names = routed.terms[1:]
+        else:
+            names = routed.terms if template.intent in ROW_INTENTS else []
+        for i, term in enumerate(names):
+            conditions.append(f"LOWER({quote(template.name_column)}) LIKE :term{i}")
+            params[f"term{i}"] = f"%{term}%"
+
+        sql = f"SELECT {', '.join(quote(col) for col in columns)} FROM {quote(template.table_name)}"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        sql += f" LIMIT {int(INTENT_ROUTER_MAX_ROWS)}"
+        return text(sql).bindparams(**params)
+
+    def answer(self, db, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Answer a question from its intent's template. Returns {"intent", "confidence",
+        "query", "answer"}, or None when the question is left to the LLM.
+        """
+        routed = self.route(question)
+        query = self.build_query(db, routed) if routed else None
+        rows = []
+        if query is not None:
+            with db._engine.connect() as conn:
+                rows = [dict(row._mapping) for row in conn.execute(query)]
+            record_rows(len(rows))
+        self.record(routed.intent if rows else None)
+        if not rows:
+            return None
+        rendered = str(query.compile(dialect=db._engine.dialect, compile_kwargs={"literal_binds": True}))
+        return {
+            "intent": routed.intent,
+            "confidence": routed.confidence,
+            "query": rendered,
+            "answer": render_answer(routed, rows),
+        }
+
+    def record(self, intent: Optional[str]) -> None:
+        with self._lock:
+            self.questions += 1
+            if intent:
+                self.routed[intent] = self.routed.get(intent, 0) + 1
+        record_cache("intent_router", intent is not None)
+        if intent:
+            increment(f"intent_{intent}_routed")
+
+    def stats(self) -> Dict[str, Any]:
+        """Questions seen, routed per intent and the share answered without the LLM."""
+        with self._lock:
+            routed = sum(self.routed.values())
+            return {
+                "questions": self.questions,
+                "routed": routed,
+                "coverage": round(routed / self.questions, 4) if self.questions else 0.0,
+                "by_intent": dict(self.routed),
+                "intents": {intent: sorted(tables) for intent, tables in self.candidates.items()},
+            }
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def render_answer(routed: RoutedQuestion, rows: List[Dict[str, Any]]) -> str:
+    """Answer text in the answer prompt's style: a short introduction and a bulleted list."""
+    template = routed.template
+    lines = [INTENT_LABELS[routed.intent].format(term=routed.phrase), ""]
+    for row in rows:
+        details = [f"{col.replace('_', ' ')}: {_format_value(row[col])}" for col in template.shown_columns
+                   if row.get(col) not in (None, "")]
+        if template.name_column:
+            lines.append(f"• **{row[template.name_column]}**" + (f": {'; '.join(details)}" if details else ""))
+        elif details:
+            lines.append(f"• {'; '.join(details)}")
+    return "\n".join(lines)
+
+
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    if event == "tenant_evicted":
+        source = payload["db"]._engine.url.render_as_string(hide_password=True)
+        with _routers_lock:
+            _routers.pop(source, None)
+        _build_locks.forget(source)
+
+
+add_event_handler(_forget_tenant)
+
+
+def get_intent_router(db) -> Optional[IntentRouter]:
+    """Return the intent router of a database, rebuilt when its schema changes; None when disabled."""
+    if not INTENT_ROUTER_ENABLED:
+        return None
+    source = db._engine.url.render_as_string(hide_password=True)
+    snapshot = get_schema_snapshot(db)
+    with _routers_lock:
+        router = _routers.get(source)
+    if router is not None and router.fingerprint == snapshot.fingerprint:
+        return router
+    # The build reads column mappings from the database, so it holds this database's lock only
+    with _build_locks(source):
+        with _routers_lock:
+            router = _routers.get(source)
+        if router is None or router.fingerprint != snapshot.fingerprint:
+            try:
+                previous, router = router, IntentRouter(snapshot, get_column_mappings(db))
+            except Exception as e:
+                logger.error(f"Error building intent router: {e}")
+                return None
+            if previous is not None:
+                # Coverage counts survive schema changes
+                router.questions, router.routed = previous.questions, previous.routed
+            with _routers_lock:
+                _routers[source] = router
+        return router
@@ -0,0 +1,315 @@
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from contextlib import contextmanager
+from sqlalchemy import bindparam, text
+from schema_snapshot import get_schema_snapshot
+from fallback_search import get_text_columns
+from instrumentation import record_rows
+from runtime import add_event_handler
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Path of the on-disk index; the index is disabled when this is not set
+KEYWORD_INDEX_PATH = os.getenv("keyword_index_path")
+# Rows read per keyset-paginated batch while indexing
+KEYWORD_INDEX_BATCH_SIZE = int(os.getenv("keyword_index_batch_size", "1000"))
+# Seconds between background catch-up runs that index newly inserted rows (0 disables)
+KEYWORD_INDEX_REFRESH_INTERVAL = float(os.getenv("keyword_index_refresh_interval", "300"))
+
+_index: Optional["KeywordIndex"] = None
+_index_lock = threading.Lock()
+
+
+class KeywordIndex:
+    """
+    Token -> (table, primary key) postings for the text columns of every table,
+    stored in a SQLite FTS5 file. Tables are indexed incrementally with keyset
+    pagination on their primary key, so a refresh only reads rows added since
+    the last run. Tables without a single-column primary key are not indexed.
+    A table only counts as covered once its last batch is in ("complete"); a
+    table_changed event marks it "changed", and the next refresh rebuilds it,
+    since edited and deleted rows are not seen by the keyset catch-up.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._refreshing = threading.Lock()
+        self._last_refresh: Dict[str, float] = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS postings USING fts5("
+                "content, source UNINDEXED, table_name UNINDEXED, column_name UNINDEXED, pk UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_state ("
+                "source TEXT, table_name TEXT, pk_column TEXT, columns TEXT, last_pk TEXT, updated_at REAL, "
+                "status TEXT DEFAULT 'building', PRIMARY KEY (source, table_name))"
+            )
+            if "status" not in {row[1] for row in conn.execute("PRAGMA table_info(index_state)")}:
+                # Index files from before the status column are resumed and then marked complete
+                conn.execute("ALTER TABLE index_state ADD COLUMN status TEXT DEFAULT 'building'")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def source_key(db) -> str:
+        return getattr(db, "_engine", db).url.render_as_string(hide_password=True)
+
+    def indexed_tables(self, db, complete_only: bool = True) -> Dict[str, str]:
+        """Return {table_name: pk_column} for the fully indexed tables of this database (or every table present)."""
+        query = "SELECT table_name, pk_column FROM index_state WHERE source = ?"
+        if complete_only:
+            query += " AND status = 'complete'"
+        with self._connect() as conn:
+            rows = conn.execute(query, (self.source_key(db),)).fetchall()
+        return dict(rows)
+
+    def mark_changed(self, db, table_name: str) -> None:
+        """Stop serving a table from the index until the next refresh has rebuilt it."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE index_state SET status = 'changed' WHERE source = ? AND table_name = ?",
+                (self.source_key(db), table_name)
+            )
+
+    @staticmethod
+    def _save_cursor(conn: sqlite3.Connection, source: str, table_name: str, pk_column: str,
+                     text_columns: List[str], last_pk: Any) -> None:
+        # The status is left alone, so a table_changed event during the run isn't lost
+        conn.execute(
+            "INSERT INTO index_state (source, table_name, pk_column, columns, last_pk, updated_at, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'building') ON CONFLICT (source, table_name) DO UPDATE SET "
+            "last_pk = excluded.last_pk, updated_at = excluded.updated_at",
+            (source, table_name, pk_column, json.dumps(text_columns),
+             json.dumps(last_pk, default=str) if last_pk is not None else None, time.time())
+        )
+
+    def _reset_table(self, conn: sqlite3.Connection, source: str, table_name: str) -> None:
+        conn.execute("DELETE FROM postings WHERE source = ? AND table_name = ?", (source, table_name))
+        conn.execute("DELETE FROM index_state WHERE source = ? AND table_name = ?", (source, table_name))
+
+    def index_table(self, db, table_name: str, rebuild: bool = False) -> int:
+        """Index rows added to a table since the last run. Returns the number of rows read."""
+        engine = db._engine
+        snapshot = get_schema_snapshot(db)
+        source = self.source_key(db)
+        quote = engine.dialect.identifier_preparer.quote
+
+        pk_columns = snapshot.get_pk_constraint(table_name).get("constrained_columns", [])
+        text_columns = get_text_columns(snapshot.get_columns(table_name))
+        if len(pk_columns) != 1 or not text_columns:
+            return 0
+        pk_column = pk_columns[0]
+
+        with self._connect() as conn:
+            state = conn.execute(
+                "SELECT pk_column, columns, last_pk, status FROM index_state WHERE source = ? AND table_name = ?",
+                (source, table_name)
+            ).fetchone()
+            # Start over when asked to, when rows changed, or when the indexed columns no longer match the schema
+            if state and (rebuild or state[3] == "changed" or state[0] != pk_column
+                          or json.loads(state[1]) != text_columns):
+                self._reset_table(conn, source, table_name)
+                state = None
+            last_pk = json.loads(state[2]) if state and state[2] is not None else None
+
+        selected = ", ".join(quote(col) for col in [pk_column] + text_columns)
+        base_query = f"SELECT {selected} FROM {quote(table_name)}"
+        order = f" ORDER BY {quote(pk_column)} LIMIT {int(KEYWORD_INDEX_BATCH_SIZE)}"
+
+        total = 0
+        while True:
+            with engine.connect() as db_conn:
+                if last_pk is None:
+                    rows = db_conn.execute(text(base_query + order)).fetchall()
+                else:
+                    rows = db_conn.execute(
+                        text(f"{base_query} WHERE {quote(pk_column)} > :last_pk{order}"), {"last_pk": last_pk}
+                    ).fetchall()
+            if not rows:
+                break
+
+            postings = []
+            for row in rows:
+                pk_value = json.dumps(row[0], default=str)
+                for col, value in zip(text_columns, row[1:]):
+                    if value:
+                        postings.append((str(value), source, table_name, col, pk_value))
+            last_pk = rows[-1][0]
+            total += len(rows)
+
+            # Postings and the keyset cursor are committed together, so an interrupted build resumes cleanly
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO postings (content, source, table_name, column_name, pk) VALUES (?, ?, ?, ?, ?)",
+                    postings
+                )
+                self._save_cursor(conn, source, table_name, pk_column, text_columns, last_pk)
+            if len(rows) < KEYWORD_INDEX_BATCH_SIZE:
+                break
+
+        # Only now that the last batch is in does the table count as covered (empty tables included)
+        with self._connect() as conn:
+            self._save_cursor(conn, source, table_name, pk_column, text_columns, last_pk)
+            conn.execute(
+                "UPDATE index_state SET status = 'complete' WHERE source = ? AND table_name = ? AND status = 'building'",
+                (source, table_name)
+            )
+        return total
+
+    def refresh(self, db, rebuild: bool = False) -> Dict[str, int]:
+        """Incrementally index every table of the database."""
+        with self._refreshing:
+            snapshot = get_schema_snapshot(db)
+            source = self.source_key(db)
+            counts = {}
+            for table_name in snapshot.get_table_names():
+                try:
+                    counts[table_name] = self.index_table(db, table_name, rebuild=rebuild)
+                except Exception as e:
+                    logger.error(f"Error indexing {table_name}: {e}")
+
+            # Drop tables that no longer exist
+            with self._connect() as conn:
+                for table_name in set(self.indexed_tables(db, complete_only=False)) - set(snapshot.get_table_names()):
+                    self._reset_table(conn, source, table_name)
+
+            self._last_refresh[source] = time.time()
+            return counts
+
+    def schedule_refresh(self, db) -> None:
+        """Start a background catch-up run if the refresh interval has passed and none is running."""
+        if KEYWORD_INDEX_REFRESH_INTERVAL <= 0 or self._refreshing.locked():
+            return
+        source = self.source_key(db)
+        if time.time() - self._last_refresh.get(source, 0) < KEYWORD_INDEX_REFRESH_INTERVAL:
+            return
+        self._last_refresh[source] = time.time()
+        threading.Thread(target=self.refresh, args=(db,), name="keyword-index-refresh", daemon=True).start()
+
+    @staticmethod
+    def _match_expression(search_terms: List[str]) -> str:
+        # Prefix match each term; quoting keeps FTS5 operators in user input inert
+        return " OR ".join('"{}"*'.format(term.replace('"', '""')) for term in search_terms)
+
+    def lookup(self, db, search_terms: List[str], table_names: Optional[List[str]] = None,
+               column_names: Optional[List[str]] = None, limit_per_table: int = 5) -> Dict[str, List[Any]]:
+        """Return {table_name: [primary keys]} of the best matching rows, ranked by BM25."""
+        if not search_terms:
+            return {}
+        source = self.source_key(db)
+        tables = table_names or list(self.indexed_tables(db))
+        match = self._match_expression(search_terms)
+
+        matches = {}
+        with self._connect() as conn:
+            for table_name in tables:
+                query = "SELECT pk FROM postings WHERE postings MATCH ? AND source = ? AND table_name = ?"
+                params: List[Any] = [match, source, table_name]
+                if column_names:
+                    query += f" AND column_name IN ({', '.join('?' for _ in column_names)})"
+                    params.extend(column_names)
+                query += " ORDER BY rank"
+
+                pks = []
+                for (pk,) in conn.execute(query, params):
+                    if pk not in pks:
+                        pks.append(pk)
+                    if len(pks) >= limit_per_table:
+                        break
+                if pks:
+                    matches[table_name] = [json.loads(pk) for pk in pks]
+        return matches
+
+    def fetch_rows(self, db, table_name: str, pk_column: str, pks: List[Any]) -> List[Dict[str, Any]]:
+        """Fetch full rows by primary key, preserving the ranking order."""
+        if not pks:
+            return []
+        quote = db._engine.dialect.identifier_preparer.quote
+        query = text(
+            f"SELECT * FROM {quote(table_name)} WHERE {quote(pk_column)} IN :pks"
+        ).bindparams(bindparam("pks", expanding=True))
+        with db._engine.connect() as conn:
+            rows = [{str(k): v for k, v in row._mapping.items()} for row in conn.execute(query, {"pks": pks})]
+        record_rows(len(rows))
+        position = {json.dumps(pk, default=str): i for i, pk in enumerate(pks)}
+        return sorted(rows, key=lambda row: position.get(json.dumps(row.get(pk_column), default=str), len(pks)))
+
+    def build_pk_query(self, db, table_name: str, select_columns: List[str], pk_column: str, pks: List[Any]) -> str:
+        """Render a self-contained SELECT of the given rows, with the primary keys inlined as literals."""
+        quote = db._engine.dialect.identifier_preparer.quote
+        query = text(
+            f"SELECT {', '.join(quote(col) for col in select_columns)} FROM {quote(table_name)} "
+            f"WHERE {quote(pk_column)} IN :pks"
+        ).bindparams(bindparam("pks", value=list(pks), expanding=True))
+        return str(query.compile(dialect=db._engine.dialect, compile_kwargs={"literal_binds": True}))
+
+    def search(self, db, search_terms: List[str], limit_per_table: int = 5,
+               max_rows: Optional[int] = None) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+        """
+        Search every fully indexed table. Returns the matching rows and the list of tables the
+        index covers, so callers only need to scan the remaining tables themselves.
+        """
+        indexed = self.indexed_tables(db)
+        matches = self.lookup(db, search_terms, list(indexed), limit_per_table=limit_per_table)
+
+        results = {}
+        total = 0
+        for table_name, pks in matches.items():
+            if max_rows is not None:
+                pks = pks[:max(0, max_rows - total)]
+            rows = self.fetch_rows(db, table_name, indexed[table_name], pks)
+            if rows:
+                results[table_name] = rows
+                total += len(rows)
+        return results, list(indexed)
+
+
+def _on_table_changed(event: str, payload: Dict[str, Any]) -> None:
+    if event == "table_changed" and _index is not None:
+        _index.mark_changed(payload["db"], payload["table"])
+
+
+add_event_handler(_on_table_changed)
+
+
+def get_keyword_index() -> Optional[KeywordIndex]:
+    """Return the process-wide keyword index, or None when keyword_index_path is not configured."""
+    global _index
+    if not KEYWORD_INDEX_PATH:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = KeywordIndex(KEYWORD_INDEX_PATH)
+        return _index
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_utils import get_database
+
+    parser = argparse.ArgumentParser(description="Build or refresh the fallback keyword index.")
+    parser.add_argument("--path", default=KEYWORD_INDEX_PATH, help="Index file (defaults to keyword_index_path)")
+    parser.add_argument("--rebuild", action="store_true", help="Re-index every table from scratch")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("set keyword_index_path or pass --path")
+
+    logging.basicConfig(level=logging.INFO)
+    counts = KeywordIndex(args.path).refresh(get_database(), rebuild=args.rebuild)
+    for table_name, count in counts.items():
+        print(f"{table_name}: {count} rows indexed")
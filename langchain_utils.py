@@ -1,20 +1,32 @@
 import os
 from dotenv import load_dotenv
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_openai import ChatOpenAI
-from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from db_utils import get_table_info, get_database
-from prompts import sql_prompt, answer_prompt
-import streamlit as st
+from langchain_core.runnables import RunnableLambda
+from db_utils import get_table_info, fetch_query, afetch_query
+from tenants import activate_tenant, get_tenant_database
+from schema_snapshot import get_schema_snapshot
+from fallback_search import FALLBACK_MAX_ROWS, FALLBACK_ROWS_PER_TERM, extract_search_terms, search_tables, asearch_tables
+from keyword_index import get_keyword_index
+from faq_index import FAQ_INDEX_ANSWER_CONFIDENCE, FAQ_INDEX_MIN_CONFIDENCE, get_faq_index
+from intent_router import get_intent_router
+from semantic_cache import get_semantic_cache
+from result_cache import extract_tables, get_result_cache
+from answer_cache import get_answer_cache, register_answer_computer
+from schema_pruning import SCHEMA_PRUNING_ENABLED, prune_schema
+from column_profile import entity_terms, get_column_profile, render_column_values
+from sql_guard import SQL_GUARD_ENABLED, SQL_GUARD_TIMEOUT_MS, SQLGuardError, add_timeout_hint, enforce_budget, prepare_query
+from prompt_builder import build_answer_prompt, build_sql_prompt as assemble_sql_prompt
+from conversation import FollowUp, get_conversation
+from instrumentation import finish_trace, record_cache, stage, start_trace
+from speculation import SPECULATIVE_ENABLED, SPECULATIVE_FALLBACK, SPECULATIVE_FALLBACK_DELAY, SPECULATIVE_SQL, acollect, aspeculate, collect, discard, speculate
+from llm_utils import get_llm
+from runtime import add_event_handler, cache_resource, report_error
+import asyncio
 import logging
 import re
-from typing import Dict, List, Any
-from sqlalchemy import inspect, text
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Any, Optional
 
-# Set logging to ERROR level to minimize output
-logging.basicConfig(level=logging.ERROR)
+# Defaults to ERROR to minimize output; set log_level=INFO to see cache and refresh activity
+logging.basicConfig(level=os.getenv("log_level", "ERROR").upper())
 logger = logging.getLogger(__name__)
 
 def clean_sql_query(sql: str) -> str:
@@ -23,15 +35,15 @@ def clean_sql_query(sql: str) -> str:
     sql = sql.strip()
     return sql
 
-def validate_database():
+def validate_database(tenant: Optional[str] = None):
     """Validate database connection silently"""
     try:
-        db = get_database()
+        db = get_tenant_database(tenant)
         table_info = get_table_info(db)
         return db, table_info
     except Exception as e:
         logger.error(f"Database validation error: {e}")
-        st.error("Unable to connect to the database. Please try again later.")
+        report_error("Unable to connect to the database. Please try again later.", e)
         return None, None
 
 def perform_fallback_query(db, question: str) -> Dict[str, Any]:
@@ -40,240 +52,772 @@ def perform_fallback_query(db, question: str) -> Dict[str, Any]:
     when primary query returns no results.
     """
     try:
-        engine = db._engine
-        inspector = inspect(engine)
+        # Only use meaningful search terms (filter out common words)
+        search_terms = extract_search_terms(question)
+        
+        if not search_terms:
+            return {}
+        
+        # Tables covered by the local keyword index are answered from it and fetched by primary key
         fallback_results = {}
+        remaining_tables = None
+        index = get_keyword_index()
+        if index is not None:
+            try:
+                index.schedule_refresh(db)
+                fallback_results, indexed_tables = index.search(
+                    db, search_terms, limit_per_table=FALLBACK_ROWS_PER_TERM, max_rows=FALLBACK_MAX_ROWS
+                )
+                remaining_tables = [name for name in get_schema_snapshot(db).get_table_names() if name not in indexed_tables]
+            except Exception as e:
+                logger.error(f"Keyword index search failed, scanning tables instead: {e}")
+                fallback_results, remaining_tables = {}, None
         
-        normalized_question = question.lower().replace('-', ' ').strip()
-        search_terms = normalized_question.split()
+        # Search the other tables with a single statement each
+        if remaining_tables is None or remaining_tables:
+            found_rows = sum(len(rows) for rows in fallback_results.values())
+            fallback_results.update(search_tables(
+                db, search_terms, max_rows=FALLBACK_MAX_ROWS - found_rows, table_names=remaining_tables
+            ))
         
-        # Only use meaningful search terms (filter out common words)
-        stop_words = {'what', 'where', 'when', 'how', 'who', 'list', 'show', 'tell', 'give', 'are', 'is', 'the', 'a', 'an', 'can', 'you', 'your', 'me', 'i', 'my', 'available'}
-        search_terms = [term for term in search_terms if term not in stop_words and len(term) > 2]
-        
-        # If we have valid search terms
-        if search_terms:
-            for table_name in inspector.get_table_names():
-                columns = inspector.get_columns(table_name)
-                text_columns = [col['name'] for col in columns if 'varchar' in str(col['type']).lower() or 'text' in str(col['type']).lower()]
-                
-                if text_columns:
-                    # For each text column, create a LIKE condition for each search term
-                    for column in text_columns:
-                        for term in search_terms:
-                            query = f"SELECT * FROM {table_name} WHERE LOWER({column}) LIKE :search_term LIMIT 5"
-                            try:
-                                with engine.connect() as conn:
-                                    result = conn.execute(text(query), {"search_term": f"%{term}%"})
-                                    
-                                    # More robust row-to-dict conversion
-                                    results = []
-                                    for row in result:
-                                        try:
-                                            # First try using _mapping attribute
-                                            if hasattr(row, '_mapping'):
-                                                row_dict = {str(k): v for k, v in row._mapping.items()}
-                                                results.append(row_dict)
-                                            else:
-                                                # Fallback to safer conversion method
-                                                row_dict = {}
-                                                for idx, col_name in enumerate(result.keys()):
-                                                    row_dict[str(col_name)] = row[idx]
-                                                results.append(row_dict)
-                                        except Exception as e:
-                                            logger.error(f"Error converting row to dict: {e}")
-                                            # Try one more conversion attempt
-                                            try:
-                                                row_dict = {str(k): str(v) for k, v in zip(result.keys(), row)}
-                                                results.append(row_dict)
-                                            except:
-                                                pass  # Skip this row if all conversion attempts fail
-                                    
-                                    if results:
-                                        if table_name not in fallback_results:
-                                            fallback_results[table_name] = []
-                                        fallback_results[table_name].extend(results)
-                            except Exception as e:
-                                logger.error(f"Error in fallback query for {table_name}.{column}: {e}")
+        return fallback_results
+    except Exception as e:
+        logger.error(f"Error in fallback search: {e}")
+        return {}
+
+async def aperform_fallback_query(db, question: str) -> Dict[str, Any]:
+    """Async variant of perform_fallback_query; tables are searched concurrently on the async engine."""
+    try:
+        search_terms = extract_search_terms(question)
+        
+        if not search_terms:
+            return {}
+        
+        fallback_results = {}
+        remaining_tables = None
+        index = get_keyword_index()
+        if index is not None:
+            try:
+                index.schedule_refresh(db)
+                fallback_results, indexed_tables = await asyncio.to_thread(
+                    index.search, db, search_terms, FALLBACK_ROWS_PER_TERM, FALLBACK_MAX_ROWS
+                )
+                remaining_tables = [name for name in get_schema_snapshot(db).get_table_names() if name not in indexed_tables]
+            except Exception as e:
+                logger.error(f"Keyword index search failed, scanning tables instead: {e}")
+                fallback_results, remaining_tables = {}, None
+        
+        if remaining_tables is None or remaining_tables:
+            found_rows = sum(len(rows) for rows in fallback_results.values())
+            fallback_results.update(await asearch_tables(
+                db, search_terms, max_rows=FALLBACK_MAX_ROWS - found_rows, table_names=remaining_tables
+            ))
         
         return fallback_results
     except Exception as e:
         logger.error(f"Error in fallback search: {e}")
         return {}
 
-@st.cache_resource
-def get_chain():
+# Words that mark a question as FAQ-like even when it only loosely matches a stored question
+FAQ_PATTERNS = ["best", "popular", "recommend", "special", "favorite", "signature", "house", "famous"]
+
+def lookup_faq(db, question: str) -> Optional[Dict[str, Any]]:
+    """
+    Special handling for FAQ-type questions, answered from the in-memory FAQ index.
+    Returns {"query", "answer"} when a stored question matches with high confidence,
+    {"query"} selecting the closest FAQ rows when the question looks like an FAQ,
+    or None when the question should go through SQL generation.
+    """
+    index = get_faq_index(db)
+    if index is None:
+        return None
+    index.schedule_refresh(db)
+    
+    matches = [match for match in index.search(question) if match.confidence >= FAQ_INDEX_MIN_CONFIDENCE]
+    best = matches[0] if matches else None
+    record_cache("faq_index", best is not None and best.confidence >= FAQ_INDEX_ANSWER_CONFIDENCE)
+    if best is None:
+        return None
+    if best.confidence >= FAQ_INDEX_ANSWER_CONFIDENCE:
+        return {"query": index.build_query(db, [best]), "answer": best.entry.answer}
+    
+    normalized_question = question.lower()
+    if not any(pattern in normalized_question for pattern in FAQ_PATTERNS):
+        return None
+    query = index.build_query(db, matches)
+    return {"query": query} if query else None
+
+def is_empty_result(result) -> bool:
+    return "No matching records" in str(result) or not result
+
+def empty_result_answer(question: str) -> str:
+    """Answer for questions whose query returned nothing, without calling the LLM."""
+    # Extract key terms from the question for better fallback responses
+    question_lower = question.lower()
+    
+    # Check for common question patterns
+    if any(term in question_lower for term in ["vegetarian", "vegan", "veg"]):
+        if any(term in question_lower for term in ["biryani", "biriyani"]):
+            return "We don't have vegetarian biryani available. Would you like to try our other vegetarian options instead?"
+    
+    # Generic not found handling with smarter suggestions
+    item_terms = re.findall(r'\b(\w+(?:-\w+)?)\b', question_lower)
+    item_terms = [term for term in item_terms if len(term) > 3 and term not in 
+                ["what", "where", "when", "which", "your", "have", "tell", "list", "show", "do", "you", "any"]]
+    
+    if item_terms:
+        main_term = item_terms[0]  # Use the first substantial term for suggestions
+        return f"I couldn't find any matching information for '{main_term}'. Could you try asking about something similar or more specific?"
+    else:
+        return "I couldn't find any matching information. Could you try rephrasing your question with more specific details?"
+
+# Lists in answers are cut off after this many bullet points
+MAX_BULLET_POINTS = 3
+ADDITIONAL_ITEMS_NOTE = "\n\nAdditional items are available. Would you like more information?"
+
+class AnswerTrimmer:
+    """
+    Streaming-aware cutoff for answer chunks. Strips surrounding whitespace like str.strip()
+    and reports when a list goes past MAX_BULLET_POINTS items, so the caller can stop
+    generating instead of discarding the rest afterwards.
+    """
+    
+    def __init__(self):
+        self.bullet_points = 0
+        self.started = False
+        self.pending_whitespace = ""
+    
+    def feed(self, chunk: str):
+        """Return the text to emit for a chunk and whether generation should stop."""
+        text = self.pending_whitespace + chunk
+        self.pending_whitespace = ""
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return "", False
+            self.started = True
+        
+        for i, char in enumerate(text):
+            if char == "•":
+                self.bullet_points += 1
+                if self.bullet_points > MAX_BULLET_POINTS:
+                    return text[:i].rstrip() + ADDITIONAL_ITEMS_NOTE, True
+        
+        # Hold back trailing whitespace until we know more text follows
+        stripped = text.rstrip()
+        self.pending_whitespace = text[len(stripped):]
+        return stripped, False
+
+@cache_resource
+def get_chain_stages(tenant: Optional[str] = None) -> Optional[Dict[str, RunnableLambda]]:
+    """
+    Build the three chain stages: generate_sql, run_sql and generate_answer, for a
+    tenant's database (None for the configured database).
+    Returns None when the database or the model can't be set up.
+    """
     try:
-        db, table_info = validate_database()
+        db, table_info = validate_database(tenant)
         if not db or not table_info:
             raise Exception("Database validation failed")
         
-        llm = ChatOpenAI(
-            model="gpt-4o",
-            temperature=0,
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+        llm = get_llm()
+        
+        # Load the FAQ tables and the intent router once at startup rather than on the first
+        # question, and load (or start building) the column value profile
+        get_faq_index(db)
+        get_intent_router(db)
+        get_column_profile(db)
         
-        execute_query = QuerySQLDataBaseTool(db=db)
+        def build_sql_prompt(question: str, follow_up: Optional[FollowUp] = None):
+            # Only send the tables relevant to this question
+            prompt_table_info, schema_stats = table_info, None
+            if follow_up is not None and follow_up.tables:
+                # Follow-ups reuse the tables of the conversation instead of selecting them again
+                prompt_table_info = get_table_info(db, table_names=follow_up.tables)
+                schema_stats = {"tables": follow_up.tables, "method": "conversation"}
+            elif SCHEMA_PRUNING_ENABLED:
+                with stage("schema_pruning") as attributes:
+                    try:
+                        pruning_question = f"{follow_up.previous_question} {question}" if follow_up else question
+                        prompt_table_info, schema_stats = prune_schema(db, pruning_question, table_info)
+                        attributes.update(schema_stats)
+                    except Exception as e:
+                        logger.error(f"Schema pruning error: {e}")
+            
+            # Actual values of the columns the question refers to, so literals aren't guessed
+            column_values = ""
+            try:
+                column_values = render_column_values(db, question, schema_stats["tables"] if schema_stats else None)
+            except Exception as e:
+                logger.error(f"Column value lookup error: {e}")
+            
+            with stage("prompt_build") as attributes:
+                prompt = assemble_sql_prompt(
+                    db, question,
+                    pruned_table_info=prompt_table_info if schema_stats else None,
+                    relevant_tables=schema_stats["tables"] if schema_stats else None,
+                    column_values=column_values,
+                    conversation=follow_up.context if follow_up else ""
+                )
+                attributes.update(cached_tokens=prompt.cached_tokens, uncached_tokens=prompt.uncached_tokens)
+            return prompt.text, schema_stats
+        
+        def lookup_cached_sql(question: str) -> Optional[str]:
+            # Reuse the SQL generated earlier for the same question or a close paraphrase
+            semantic_cache = get_semantic_cache(tenant)
+            if semantic_cache is None:
+                return None
+            with stage("semantic_cache_lookup"):
+                return semantic_cache.lookup(question, get_schema_snapshot(db).fingerprint, entity_terms(db))
+        
+        def llm_generate_sql(question: str, follow_up: Optional[FollowUp] = None) -> dict:
+            prompt_value, schema_stats = build_sql_prompt(question, follow_up)
+            with stage("llm_generate_sql"):
+                sql = llm.invoke(prompt_value).content.strip()
+            # SQL for a follow-up depends on the conversation, so it isn't cached under the question alone
+            sql_source = "follow_up" if follow_up else "llm"
+            return {"question": question, "query": clean_sql_query(sql), "sql_source": sql_source, "schema_stats": schema_stats}
+        
+        async def allm_generate_sql(question: str, follow_up: Optional[FollowUp] = None) -> dict:
+            prompt_value, schema_stats = await asyncio.to_thread(build_sql_prompt, question, follow_up)
+            with stage("llm_generate_sql"):
+                sql = (await llm.ainvoke(prompt_value)).content.strip()
+            sql_source = "follow_up" if follow_up else "llm"
+            return {"question": question, "query": clean_sql_query(sql), "sql_source": sql_source, "schema_stats": schema_stats}
+        
+        def find_follow_up(inputs: dict) -> Optional[FollowUp]:
+            conversation = inputs.get("conversation")
+            if conversation is None:
+                return None
+            with stage("conversation") as attributes:
+                follow_up = conversation.follow_up(inputs["question"], get_schema_snapshot(db))
+                attributes["follow_up"] = follow_up is not None
+            return follow_up
+        
+        def route_intent(question: str) -> Optional[dict]:
+            router = get_intent_router(db)
+            if router is None:
+                return None
+            with stage("intent_route") as attributes:
+                routed = router.answer(db, question)
+                attributes["intent"] = routed["intent"] if routed else None
+            return routed
+        
+        def lookup_answer(inputs: dict) -> Optional[dict]:
+            # Precomputed answers of frequent questions; the lookup also logs the question
+            answer_cache = get_answer_cache()
+            if answer_cache is None or inputs.get("precompute"):
+                return None
+            with stage("answer_cache_lookup"):
+                cached = answer_cache.lookup(db, inputs["question"])
+            answer_cache.schedule_precompute(db)
+            return cached
+        
+        def remember_turn(inputs: dict, output: dict) -> None:
+            # Failed statements aren't worth following up on; the question still is
+            conversation = inputs.get("conversation")
+            if conversation is None:
+                return
+            query = output.get("query")
+            if str(output.get("result", "")).startswith("Error"):
+                query = None
+            conversation.record_turn(inputs["question"], query, get_schema_snapshot(db).get_table_names())
+        
+        def search_fallback(question: str) -> Dict[str, Any]:
+            with stage("fallback_search"):
+                return perform_fallback_query(db, question)
+        
+        async def asearch_fallback(question: str) -> Dict[str, Any]:
+            with stage("fallback_search"):
+                return await aperform_fallback_query(db, question)
+        
+        # The fallback search starts alongside SQL generation and execution once the question
+        # has taken speculative_fallback_delay seconds, so on an empty result its matches are
+        # (nearly) ready; otherwise it is discarded, before it starts for fast questions
+        speculate_fallback = SPECULATIVE_ENABLED and SPECULATIVE_FALLBACK
         
         def generate_sql(inputs: dict) -> dict:
+            # The conversation is passed on so run_sql can record the turn
+            return {**generate_query(inputs), "conversation": inputs.get("conversation")}
+        
+        async def agenerate_sql(inputs: dict) -> dict:
+            return {**(await agenerate_query(inputs)), "conversation": inputs.get("conversation")}
+        
+        def generate_query(inputs: dict) -> dict:
+            fallback_task = None
             try:
                 question = inputs["question"]
                 
-                # Special handling for FAQ-type questions by using a more generic approach
-                normalized_question = question.lower()
+                # The FAQ index is in memory, a confident match skips everything else
+                with stage("faq_lookup"):
+                    faq = lookup_faq(db, question)
+                if faq and faq.get("answer"):
+                    return {"question": question, "sql_source": "faq", **faq}
+                
+                # Answers precomputed for frequent questions, then frequent intents (hours,
+                # location, prices, ...) answered from SQL templates
+                follow_up = find_follow_up(inputs)
+                cached = lookup_answer(inputs) if not faq and not follow_up else None
+                if cached:
+                    return {"question": question, "sql_source": "answer_cache", **cached}
+                routed = route_intent(question) if not faq and not follow_up else None
+                if routed:
+                    return {"question": question, "sql_source": "intent", **routed}
+                
+                fallback_task = (speculate(search_fallback, question, delay=SPECULATIVE_FALLBACK_DELAY)
+                                 if speculate_fallback else None)
+                if faq:
+                    return {"question": question, "sql_source": "faq", **faq, "fallback_task": fallback_task}
                 
-                # Look for common FAQ patterns without hardcoding table names or specific content
-                is_faq_pattern = any(pattern in normalized_question for pattern in 
-                                    ["best", "popular", "recommend", "special", "favorite", 
-                                     "signature", "house", "famous"])
+                if follow_up:
+                    return {**llm_generate_sql(question, follow_up), "fallback_task": fallback_task}
                 
-                if is_faq_pattern:
-                    # Try to detect which tables might have FAQ-style content
-                    db = get_database()
-                    engine = db._engine
-                    inspector = inspect(engine)
-                    
-                    for table_name in inspector.get_table_names():
-                        columns = inspector.get_columns(table_name)
-                        col_names = [col["name"].lower() for col in columns]
-                        
-                        # Look for tables that have FAQ-like column pairs (question/answer, etc.)
-                        has_question_col = any("question" in col.lower() for col in col_names)
-                        has_answer_col = any("answer" in col.lower() for col in col_names)
-                        
-                        if has_question_col and has_answer_col:
-                            # Get the actual column names (not the lowercase versions)
-                            question_col = next(col["name"] for col in columns if "question" in col["name"].lower())
-                            answer_col = next(col["name"] for col in columns if "answer" in col["name"].lower())
-                            
-                            # Create a direct query to the FAQ-like table
-                            keywords = re.findall(r'\b\w+\b', normalized_question)
-                            search_terms = [term for term in keywords if len(term) > 3 and term not in 
-                                           ["what", "where", "when", "which", "your", "best", "popular", "have", "tell"]]
-                            
-                            if search_terms:
-                                conditions = []
-                                for term in search_terms:
-                                    conditions.append(f"{question_col} LIKE '%{term}%'")
-                                
-                                direct_query = f"SELECT {answer_col} FROM {table_name} WHERE {' OR '.join(conditions)}"
-                                return {"question": question, "query": direct_query}
+                cached_sql = lookup_cached_sql(question)
+                if cached_sql:
+                    return {"question": question, "query": cached_sql, "fallback_task": fallback_task}
                 
                 # Default to LLM-generated query if no special case matched
-                prompt_value = sql_prompt.format(
-                    question=question,
-                    table_info=table_info
-                )
-                sql = llm.invoke(prompt_value).content.strip()
-                sql = clean_sql_query(sql)
-                return {"question": question, "query": sql}
+                return {**llm_generate_sql(question), "fallback_task": fallback_task}
             except Exception as e:
                 logger.error(f"SQL generation error: {e}")
                 # Fallback to standard query generation on exception
-                prompt_value = sql_prompt.format(
-                    question=question,
-                    table_info=table_info
-                )
-                sql = llm.invoke(prompt_value).content.strip()
-                sql = clean_sql_query(sql)
-                return {"question": question, "query": sql}
+                return {**llm_generate_sql(question), "fallback_task": fallback_task}
+        
+        async def agenerate_query(inputs: dict) -> dict:
+            fallback_task = sql_task = None
+            try:
+                question = inputs["question"]
+                
+                with stage("faq_lookup"):
+                    faq = await asyncio.to_thread(lookup_faq, db, question)
+                if faq and faq.get("answer"):
+                    return {"question": question, "sql_source": "faq", **faq}
+                
+                follow_up = find_follow_up(inputs)
+                cached = await asyncio.to_thread(lookup_answer, inputs) if not faq and not follow_up else None
+                if cached:
+                    return {"question": question, "sql_source": "answer_cache", **cached}
+                routed = await asyncio.to_thread(route_intent, question) if not faq and not follow_up else None
+                if routed:
+                    return {"question": question, "sql_source": "intent", **routed}
+                
+                fallback_task = (aspeculate(asearch_fallback(question), delay=SPECULATIVE_FALLBACK_DELAY)
+                                 if speculate_fallback else None)
+                if faq:
+                    return {"question": question, "sql_source": "faq", **faq, "fallback_task": fallback_task}
+                
+                if follow_up:
+                    return {**(await allm_generate_sql(question, follow_up)), "fallback_task": fallback_task}
+                
+                # SQL generation races the cache lookup and is cancelled when the cache has the query
+                if SPECULATIVE_ENABLED and SPECULATIVE_SQL:
+                    sql_task = aspeculate(allm_generate_sql(question))
+                cached_sql = await asyncio.to_thread(lookup_cached_sql, question)
+                if cached_sql:
+                    discard(sql_task)
+                    return {"question": question, "query": cached_sql, "fallback_task": fallback_task}
+                
+                output = await acollect(sql_task) if sql_task else await allm_generate_sql(question)
+                return {**output, "fallback_task": fallback_task}
+            except Exception as e:
+                logger.error(f"SQL generation error: {e}")
+                if sql_task is not None and not sql_task.done():
+                    discard(sql_task)
+                return {**(await allm_generate_sql(question)), "fallback_task": fallback_task}
+        
+        def get_cached_result(query: str) -> Optional[str]:
+            # Serve repeated statements from the result cache
+            result_cache = get_result_cache()
+            return result_cache.get(db, query) if result_cache is not None else None
+        
+        def remember_result(inputs: dict, query: str, result: str) -> None:
+            if str(result).startswith("Error"):
+                return
+            result_cache = get_result_cache()
+            if result_cache is not None:
+                result_cache.put(db, query, result)
             
+            # Only cache LLM-generated SQL once it has run without errors
+            semantic_cache = get_semantic_cache(tenant)
+            if semantic_cache is not None and inputs.get("sql_source") == "llm":
+                semantic_cache.store_sql(inputs["question"], query, get_schema_snapshot(db).fingerprint)
+        
+        dialect = db._engine.dialect.name
+        timeout_ms = SQL_GUARD_TIMEOUT_MS if SQL_GUARD_ENABLED else 0
+        
+        def execute_query(query: str) -> str:
+            # Rows are streamed and rendered within the result budget; errors follow QuerySQLDataBaseTool's convention
+            try:
+                return fetch_query(db, add_timeout_hint(query, dialect), timeout_ms=timeout_ms).render()
+            except Exception as e:
+                return f"Error: {e}"
+        
+        async def aexecute_query(query: str) -> str:
+            try:
+                return (await afetch_query(db, add_timeout_hint(query, dialect), timeout_ms=timeout_ms)).render()
+            except Exception as e:
+                return f"Error: {e}"
+        
+        def check_query(query: str) -> str:
+            # Cheap checks before the cache lookup: read-only single SELECT with a row cap
+            if not SQL_GUARD_ENABLED:
+                return query
+            with stage("sql_guard"):
+                return prepare_query(query, dialect)
+        
+        def check_query_cost(query: str) -> str:
+            # EXPLAIN-based budget, only for statements that will actually run
+            if not SQL_GUARD_ENABLED:
+                return query
+            with stage("sql_cost_check"):
+                return enforce_budget(db._engine, query)
+        
+        def rejected_output(inputs: dict, query: str, error: SQLGuardError) -> dict:
+            logger.info(f"Query rejected: {error}")
+            return {
+                "question": inputs["question"],
+                "query": query,
+                "result": f"Error: Query rejected. {error}"
+            }
+        
+        def faq_output(inputs: dict) -> dict:
+            # Answered from the FAQ index, the answer cache or an intent template, there is nothing to run
+            return {
+                "question": inputs["question"],
+                "query": inputs.get("query"),
+                "result": inputs["answer"],
+                "answer": inputs["answer"]
+            }
+        
+        def build_run_output(inputs: dict, query: str, result: str, fallback_results: Optional[dict]) -> dict:
+            # If fallback found something
+            if fallback_results:
+                return {
+                    "question": inputs["question"],
+                    "query": query,
+                    "result": result,
+                    "fallback_results": fallback_results
+                }
+            
+            return {
+                "question": inputs["question"],
+                "query": query,
+                "result": result if result else "No matching records found in the database."
+            }
+        
         def run_sql(inputs: dict) -> dict:
+            output = run_query(inputs)
+            remember_turn(inputs, output)
+            return output
+        
+        async def arun_sql(inputs: dict) -> dict:
+            output = await arun_query(inputs)
+            remember_turn(inputs, output)
+            return output
+        
+        def run_query(inputs: dict) -> dict:
+            if inputs.get("answer"):
+                return faq_output(inputs)
+            fallback_task = inputs.get("fallback_task")
             try:
                 query = inputs["query"]
-                result = execute_query.invoke(query)
                 
-                # Check if we got an empty result
+                try:
+                    query = check_query(query)
+                    result = get_cached_result(query)
+                    if result is None:
+                        # Results are cached under the checked statement, before any budget rewrite
+                        cache_key, query = query, check_query_cost(query)
+                        with stage("execute_sql"):
+                            result = execute_query(query)
+                        remember_result(inputs, cache_key, result)
+                except SQLGuardError as e:
+                    discard(fallback_task)
+                    return rejected_output(inputs, query, e)
+                
+                # Try fallback search if main query returned no results
+                fallback_results = None
                 if not result or "No matching records" in result:
-                    # Try fallback search if main query returned no results
-                    fallback_results = perform_fallback_query(db, inputs["question"])
-                    
-                    # If fallback found something
-                    if fallback_results:
-                        return {
-                            "question": inputs["question"],
-                            "query": query,
-                            "result": result,
-                            "fallback_results": fallback_results
-                        }
+                    if fallback_task is not None:
+                        with stage("fallback_wait"):
+                            fallback_results = collect(fallback_task)
+                    else:
+                        fallback_results = search_fallback(inputs["question"])
+                else:
+                    discard(fallback_task)
                 
+                return build_run_output(inputs, query, result, fallback_results)
+            except Exception as e:
+                discard(fallback_task)
+                logger.error(f"Query execution error: {e}")
                 return {
                     "question": inputs["question"],
                     "query": query,
-                    "result": result if result else "No matching records found in the database."
+                    "result": f"Error executing query: {str(e)}"
                 }
+        
+        async def arun_query(inputs: dict) -> dict:
+            if inputs.get("answer"):
+                return faq_output(inputs)
+            fallback_task = inputs.get("fallback_task")
+            try:
+                query = inputs["query"]
+                
+                try:
+                    query = check_query(query)
+                    result = await asyncio.to_thread(get_cached_result, query)
+                    if result is None:
+                        cache_key, query = query, await asyncio.to_thread(check_query_cost, query)
+                        with stage("execute_sql"):
+                            result = await aexecute_query(query)
+                        await asyncio.to_thread(remember_result, inputs, cache_key, result)
+                except SQLGuardError as e:
+                    discard(fallback_task)
+                    return rejected_output(inputs, query, e)
+                
+                fallback_results = None
+                if not result or "No matching records" in result:
+                    if fallback_task is not None:
+                        with stage("fallback_wait"):
+                            fallback_results = await acollect(fallback_task)
+                    else:
+                        fallback_results = await asearch_fallback(inputs["question"])
+                else:
+                    discard(fallback_task)
+                
+                return build_run_output(inputs, query, result, fallback_results)
             except Exception as e:
+                discard(fallback_task)
                 logger.error(f"Query execution error: {e}")
                 return {
                     "question": inputs["question"],
                     "query": query,
                     "result": f"Error executing query: {str(e)}"
                 }
-            
-        def generate_answer(inputs: dict) -> str:
+        
+        def generate_answer(inputs: dict) -> Iterator[str]:
             try:
+                if inputs.get("answer"):
+                    yield inputs["answer"]
+                    return
+                
                 # Check if results are empty
-                if "No matching records" in str(inputs["result"]) or not inputs.get("result"):
-                    # Extract key terms from the question for better fallback responses
-                    question_lower = inputs["question"].lower()
-                    
-                    # Check for common question patterns
-                    if any(term in question_lower for term in ["vegetarian", "vegan", "veg"]):
-                        if any(term in question_lower for term in ["biryani", "biriyani"]):
-                            return "We don't have vegetarian biryani available. Would you like to try our other vegetarian options instead?"
-                    
-                    # Generic not found handling with smarter suggestions
-                    item_terms = re.findall(r'\b(\w+(?:-\w+)?)\b', question_lower)
-                    item_terms = [term for term in item_terms if len(term) > 3 and term not in 
-                                ["what", "where", "when", "which", "your", "have", "tell", "list", "show", "do", "you", "any"]]
-                    
-                    if item_terms:
-                        main_term = item_terms[0]  # Use the first substantial term for suggestions
-                        return f"I couldn't find any matching information for '{main_term}'. Could you try asking about something similar or more specific?"
-                    else:
-                        return "I couldn't find any matching information. Could you try rephrasing your question with more specific details?"
-                        
-                # For successful results, keep response concise
-                prompt_value = answer_prompt.format(**inputs)
-                answer = llm.invoke(prompt_value).content.strip()
+                if is_empty_result(inputs.get("result")):
+                    yield empty_result_answer(inputs["question"])
+                    return
                 
-                # Trim excessive content (prevent long responses)
-                if len(answer.split()) > 100 and "•" in answer:
-                    # If it's a list response, limit to 3 bullet points max
-                    bullet_points = answer.split("•")
-                    intro = bullet_points[0]
-                    items = bullet_points[1:4]  # Take only first 3 items
-                    answer = intro + "•" + "•".join(items)
-                    if len(bullet_points) > 4:
-                        answer += "\n\nAdditional items are available. Would you like more information?"
-                        
-                return answer
+                # For successful results, keep response concise and stream it as it is generated
+                prompt_value = build_answer_prompt(inputs).text
+                trimmer = AnswerTrimmer()
+                chunks = llm.stream(prompt_value)
+                with stage("generate_answer"):
+                    try:
+                        for chunk in chunks:
+                            text, done = trimmer.feed(chunk.content)
+                            if text:
+                                yield text
+                            if done:
+                                break
+                    finally:
+                        # Closing the stream stops generation once the list limit is reached
+                        chunks.close()
             except Exception as e:
                 logger.error(f"Answer generation error: {e}")
-                return "I apologize, but I encountered an error while generating the answer."
+                yield "I apologize, but I encountered an error while generating the answer."
         
-        chain = (
-            RunnableLambda(generate_sql) | 
-            RunnableLambda(run_sql) | 
-            RunnableLambda(generate_answer)
-        )
+        async def agenerate_answer(inputs: dict) -> AsyncIterator[str]:
+            try:
+                if inputs.get("answer"):
+                    yield inputs["answer"]
+                    return
+                
+                if is_empty_result(inputs.get("result")):
+                    yield empty_result_answer(inputs["question"])
+                    return
+                
+                prompt_value = build_answer_prompt(inputs).text
+                trimmer = AnswerTrimmer()
+                chunks = llm.astream(prompt_value)
+                with stage("generate_answer"):
+                    try:
+                        async for chunk in chunks:
+                            text, done = trimmer.feed(chunk.content)
+                            if text:
+                                yield text
+                            if done:
+                                break
+                    finally:
+                        await chunks.aclose()
+            except Exception as e:
+                logger.error(f"Answer generation error: {e}")
+                yield "I apologize, but I encountered an error while generating the answer."
+        
+        def precompute_answer(question: str) -> Optional[dict]:
+            # Full chain for the answer cache, returning the answer with the tables it read
+            output = run_query(generate_query({"question": question, "precompute": True}))
+            discard(output.get("fallback_task"))
+            if str(output.get("result", "")).startswith("Error"):
+                return None
+            answer = "".join(generate_answer(output))
+            if answer.startswith("I apologize"):
+                return None
+            tables = extract_tables(output.get("query") or "", get_schema_snapshot(db).get_table_names())
+            return {"answer": answer, "query": output.get("query"), "tables": tables + list(output.get("fallback_results") or {})}
+        
+        register_answer_computer(db, precompute_answer)
         
-        return chain
+        # Each stage has a sync and an async implementation; chain.ainvoke uses the async ones.
+        # The answer stage is a generator, so chain.stream yields the answer as it is generated.
+        return {
+            "generate_sql": RunnableLambda(generate_sql, afunc=agenerate_sql),
+            "run_sql": RunnableLambda(run_sql, afunc=arun_sql),
+            "generate_answer": RunnableLambda(generate_answer, afunc=agenerate_answer),
+        }
         
     except Exception as e:
         logger.error(f"Chain initialization error: {e}")
-        st.error("Error setting up the system. Please try again later.")
+        report_error("Error setting up the system. Please try again later.", e)
+        return None
+
+@cache_resource
+def get_chain(tenant: Optional[str] = None):
+    stages = get_chain_stages(tenant)
+    if not stages:
         return None
+    return stages["generate_sql"] | stages["run_sql"] | stages["generate_answer"]
 
-def invoke_chain(question, messages):
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    # The chain stages hold the tenant's database, rebuild them on its next request
+    if event == "tenant_evicted":
+        get_chain.forget(payload["tenant"])
+        get_chain_stages.forget(payload["tenant"])
+
+add_event_handler(_forget_tenant)
+
+def _sql_output(output: dict) -> dict:
+    return {key: output[key] for key in ("question", "query", "result", "fallback_results") if key in output}
+
+def chain_inputs(question: str, messages: Optional[List[Any]] = None, tenant: Optional[str] = None,
+                 session_id: Optional[str] = None) -> dict:
+    """Chain input for a question, with the conversation it is asked in (see conversation.py)."""
+    return {"question": question, "conversation": get_conversation(question, messages, session_id, tenant)}
+
+def generate_sql_for_question(question: str, execute: bool = True, tenant: Optional[str] = None,
+                              session_id: Optional[str] = None) -> Optional[dict]:
+    """
+    Run the chain without the answer stage. Returns the question and generated query,
+    plus the raw result (and fallback matches) when execute is set; None when the
+    system could not be initialized.
+    """
+    activate_tenant(tenant)
+    stages = get_chain_stages(tenant)
+    if not stages:
+        return None
+    
+    trace = start_trace(question)
+    try:
+        output = stages["generate_sql"].invoke(chain_inputs(question, None, tenant, session_id))
+        if execute:
+            output = stages["run_sql"].invoke(output)
+        else:
+            discard(output.get("fallback_task"))
+    finally:
+        finish_trace(trace)
+    return _sql_output(output)
+
+async def agenerate_sql_for_question(question: str, execute: bool = True, tenant: Optional[str] = None,
+                                     session_id: Optional[str] = None) -> Optional[dict]:
+    """Async variant of generate_sql_for_question."""
+    await asyncio.to_thread(activate_tenant, tenant)
+    stages = await asyncio.to_thread(get_chain_stages, tenant)
+    if not stages:
+        return None
+    
+    trace = start_trace(question)
     try:
-        chain = get_chain()
+        output = await stages["generate_sql"].ainvoke(chain_inputs(question, None, tenant, session_id))
+        if execute:
+            output = await stages["run_sql"].ainvoke(output)
+        else:
+            discard(output.get("fallback_task"))
+    finally:
+        finish_trace(trace)
+    return _sql_output(output)
+
+def invoke_chain(question, messages, tenant: Optional[str] = None, session_id: Optional[str] = None):
+    try:
+        activate_tenant(tenant)
+        chain = get_chain(tenant)
         if not chain:
             return "System initialization failed. Please check the error messages above."
         
-        response = chain.invoke({"question": question})
+        trace = start_trace(question)
+        try:
+            response = chain.invoke(chain_inputs(question, messages, tenant, session_id))
+        finally:
+            finish_trace(trace)
         return response
     except Exception as e:
         logger.error(f"Chain invocation error: {e}")
-        return "I apologize, but I'm having trouble processing your question. Please try again."
\ No newline at end of file
+        return "I apologize, but I'm having trouble processing your question. Please try again."
+
+async def ainvoke_chain(question, messages, tenant: Optional[str] = None, session_id: Optional[str] = None):
+    """Async variant of invoke_chain; LLM calls and database access don't block the event loop."""
+    try:
+        await asyncio.to_thread(activate_tenant, tenant)
+        chain = await asyncio.to_thread(get_chain, tenant)
+        if not chain:
+            return "System initialization failed. Please check the error messages above."
+        
+        trace = start_trace(question)
+        try:
+            return await chain.ainvoke(chain_inputs(question, messages, tenant, session_id))
+        finally:
+            finish_trace(trace)
+    except Exception as e:
+        logger.error(f"Chain invocation error: {e}")
+        return "I apologize, but I'm having trouble processing your question. Please try again."
+
+def stream_chain(question, messages, tenant: Optional[str] = None, session_id: Optional[str] = None,
+                 on_trace: Optional[Callable[[Dict[str, Any]], None]] = None) -> Iterator[str]:
+    """
+    Like invoke_chain, but yields the answer in chunks as the LLM generates it.
+    on_trace receives this request's finished trace, e.g. for a debug panel.
+    """
+    try:
+        activate_tenant(tenant)
+        chain = get_chain(tenant)
+        if not chain:
+            yield "System initialization failed. Please check the error messages above."
+            return
+        
+        trace = start_trace(question)
+        try:
+            yield from chain.stream(chain_inputs(question, messages, tenant, session_id))
+        finally:
+            data = finish_trace(trace)
+            if on_trace is not None:
+                on_trace(data)
+    except Exception as e:
+        logger.error(f"Chain invocation error: {e}")
+        yield "I apologize, but I'm having trouble processing your question. Please try again."
+
+async def astream_chain(question, messages, tenant: Optional[str] = None,
+                        session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Async variant of stream_chain."""
+    try:
+        await asyncio.to_thread(activate_tenant, tenant)
+        chain = await asyncio.to_thread(get_chain, tenant)
+        if not chain:
+            yield "System initialization failed. Please check the error messages above."
+            return
+        
+        trace = start_trace(question)
+        try:
+            async for chunk in chain.astream(chain_inputs(question, messages, tenant, session_id)):
+                yield chunk
+        finally:
+            finish_trace(trace)
+    except Exception as e:
+        logger.error(f"Chain invocation error: {e}")
+        yield "I apologize, but I'm having trouble processing your question. Please try again."
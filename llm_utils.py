@@ -0,0 +1,40 @@
+from typing import Callable, Optional
+from instrumentation import llm_usage_handler
+import os
+import threading
+
+# Chat model used for table selection, SQL generation and answers
+LLM_MODEL = os.getenv("llm_model", "gpt-4o")
+
+_factory: Optional[Callable[[], object]] = None
+_factory_lock = threading.Lock()
+
+
+def default_llm_factory():
+    """The OpenAI chat model, reporting token usage to the request trace."""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=LLM_MODEL,
+        temperature=0,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        # Token counts for streamed answers are only reported when requested
+        stream_usage=True,
+        callbacks=[llm_usage_handler]
+    )
+
+
+def set_llm_factory(factory: Optional[Callable[[], object]]) -> None:
+    """
+    Replace the function that creates chat models, e.g. with a fake model for benchmarks.
+    Pass None to restore the default. Chains that were already built keep their model.
+    """
+    global _factory
+    with _factory_lock:
+        _factory = factory
+
+
+def get_llm():
+    """Create a chat model with the configured factory."""
+    with _factory_lock:
+        factory = _factory or default_llm_factory
+    return factory()
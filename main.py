@@ -1,20 +1,28 @@
 import streamlit as st
-from langchain_utils import invoke_chain
+from langchain_utils import stream_chain
 from dotenv import load_dotenv
 import os
+import uuid
 from db_utils import get_database, get_table_info
-from sqlalchemy import inspect
+from schema_snapshot import get_schema_snapshot
+from runtime import add_event_handler
 
 load_dotenv()
 
+def show_error(event: str, payload: dict):
+    """Show errors reported by the core modules in the chat UI."""
+    if event == "error":
+        st.error(payload["message"])
+
+add_event_handler(show_error)
+
 def get_table_descriptions(db) -> dict:
     """Get descriptions of all tables in the database."""
-    engine = db._engine
-    inspector = inspect(engine)
+    snapshot = get_schema_snapshot(db)
     table_info = {}
     
-    for table_name in inspector.get_table_names():
-        columns = inspector.get_columns(table_name)
+    for table_name in snapshot.get_table_names():
+        columns = snapshot.get_columns(table_name)
         column_info = [f"• {col['name']} ({col['type']})" for col in columns]
         table_info[table_name] = column_info
     
@@ -40,15 +48,28 @@ def display_sidebar_tables():
     except Exception as e:
         st.sidebar.error("Unable to load database schema")
 
+def display_trace(trace: dict):
+    """Show the stage timings and counters of a request as a waterfall."""
+    with st.expander(f"Request trace ({trace['duration'] * 1000:.0f} ms)"):
+        total = trace["duration"] or 1
+        for item in trace["stages"]:
+            offset = int(40 * item["start"] / total)
+            width = max(1, int(40 * item["duration"] / total))
+            st.text(f"{item['name']:<22} {' ' * offset}{'█' * width} {item['duration'] * 1000:.1f} ms")
+        st.json({"counters": trace["counters"], "caches": trace["caches"]})
+
 def main():
     st.title("Natural Language to SQL Chatbot")
     
     # Display tables in sidebar
     display_sidebar_tables()
+    show_trace = st.sidebar.checkbox("Show request trace")
     
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
 
     # Display chat messages from history
     for message in st.session_state.messages:
@@ -65,9 +86,16 @@ def main():
         # Display assistant response
         with st.chat_message("assistant"):
             try:
-                response = invoke_chain(prompt, st.session_state.messages)
-                st.markdown(response)
+                # Render the answer as it streams in
+                # The session id lets follow-up questions reuse the previous turn's context
+                # Only this session's trace is shown, never another user's request
+                traces = []
+                chunks = stream_chain(prompt, st.session_state.messages, session_id=st.session_state.session_id,
+                                      on_trace=traces.append)
+                response = st.write_stream(chunks)
                 st.session_state.messages.append({"role": "assistant", "content": response})
+                if show_trace and traces:
+                    display_trace(traces[0])
             except Exception as e:
                 error_message = "I apologize, but I'm having trouble processing your request. Please try again."
                 st.error(error_message)
@@ -0,0 +1,226 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+from db_utils import get_table_info
+from instrumentation import increment
+from token_counter import count_tokens
+from prompts import (
+    answer_instructions, answer_question_prompt, schema_header, sql_instructions,
+    sql_question_prompt, table_selection_instructions
+)
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Where the SQL prompt gets its schema: "prefix" always sends the full schema first, shared
+# with the table selector and cacheable by the provider; "pruned" sends only the tables
+# relevant to the question, after the fixed instructions; "auto" picks the cheaper one
+PROMPT_SCHEMA_LAYOUT = os.getenv("prompt_schema_layout", "auto").lower()
+# Token budgets per prompt section (0 disables a budget)
+PROMPT_SCHEMA_TOKENS = int(os.getenv("prompt_schema_tokens", "8000"))
+PROMPT_COLUMN_VALUES_TOKENS = int(os.getenv("prompt_column_values_tokens", "400"))
+PROMPT_QUESTION_TOKENS = int(os.getenv("prompt_question_tokens", "300"))
+PROMPT_CONVERSATION_TOKENS = int(os.getenv("prompt_conversation_tokens", "400"))
+PROMPT_RESULT_TOKENS = int(os.getenv("prompt_result_tokens", "2500"))
+# Provider prompt caching: shortest prefix that is cached, granularity beyond it, how long an
+# unused prefix stays cached, and the price discount of cached tokens (OpenAI defaults)
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("prompt_cache_min_tokens", "1024"))
+PROMPT_CACHE_BLOCK_TOKENS = int(os.getenv("prompt_cache_block_tokens", "128"))
+PROMPT_CACHE_TTL = float(os.getenv("prompt_cache_ttl", "300"))
+PROMPT_CACHE_DISCOUNT = float(os.getenv("prompt_cache_discount", "0.5"))
+
+# Boundaries at which over-budget sections are cut, so whole tables, rows or words are kept
+TABLE_SEPARATOR = "\n\nTable: "
+LINE_SEPARATOR = "\n"
+WORD_SEPARATOR = " "
+
+# Prefixes sent recently, by hash of the prompt kind and the sections up to a boundary
+_sent_prefixes: "OrderedDict[str, float]" = OrderedDict()
+_sent_prefixes_lock = threading.Lock()
+MAX_SENT_PREFIXES = 4096
+
+
+class Section(NamedTuple):
+    name: str
+    text: str
+    # Stable sections are the same across requests and are placed first
+    stable: bool
+    budget: int = 0
+    separator: str = LINE_SEPARATOR
+
+
+class BuiltPrompt(NamedTuple):
+    text: str
+    # Section texts in prompt order, after budgets were applied
+    parts: List[str]
+    section_tokens: Dict[str, int]
+    cached_tokens: int
+    uncached_tokens: int
+
+
+@lru_cache(maxsize=256)
+def section_tokens(text: str) -> int:
+    """Token count of a section; memoized since stable sections repeat on every request."""
+    return count_tokens(text)
+
+
+def fit_to_budget(text: str, budget: int, separator: str = LINE_SEPARATOR) -> str:
+    """Cut text at separator boundaries to at most budget tokens, noting how much was left out."""
+    if budget <= 0 or section_tokens(text) <= budget:
+        return text
+    pieces = text.split(separator)
+    kept, used = [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece + separator)
+        if used + tokens > budget:
+            break
+        kept.append(piece)
+        used += tokens
+    if not kept:
+        # A single piece over budget: cut it at the estimated character position
+        return text[:budget * 4] + " ...(truncated)"
+    omitted = len(pieces) - len(kept)
+    logger.info(f"Prompt section cut to {budget} tokens, {omitted} of {len(pieces)} parts left out")
+    return separator.join(kept) + f"{separator}...({omitted} more left out)\n"
+
+
+def cacheable_tokens(prefix_tokens: int) -> int:
+    """Tokens of a repeated prefix the provider serves from cache: none below the minimum, then whole blocks."""
+    if prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+        return 0
+    return prefix_tokens - (prefix_tokens - PROMPT_CACHE_MIN_TOKENS) % PROMPT_CACHE_BLOCK_TOKENS
+
+
+def report_prompt(kind: str, parts: List[str], part_tokens: Optional[List[int]] = None) -> Tuple[int, int]:
+    """
+    Estimate how many tokens of a prompt about to be sent are served from the provider's
+    prompt cache: the longest prefix, ending at a section boundary, sent within the cache
+    TTL. Records the prefixes and adds prompt_cached_tokens/prompt_uncached_tokens to the
+    request counters. Returns (cached, uncached).
+    """
+    if part_tokens is None:
+        part_tokens = [section_tokens(part) for part in parts]
+    now = time.time()
+    digest = hashlib.sha1(kind.encode("utf-8"))
+    prefix = warm = 0
+    with _sent_prefixes_lock:
+        for part, tokens in zip(parts, part_tokens):
+            digest.update(part.encode("utf-8"))
+            prefix += tokens
+            key = digest.hexdigest()
+            sent_at = _sent_prefixes.get(key)
+            if sent_at is not None and now - sent_at <= PROMPT_CACHE_TTL:
+                warm = prefix
+            _sent_prefixes[key] = now
+            _sent_prefixes.move_to_end(key)
+        while len(_sent_prefixes) > MAX_SENT_PREFIXES:
+            _sent_prefixes.popitem(last=False)
+
+    cached = cacheable_tokens(warm)
+    uncached = prefix - cached
+    increment("prompt_cached_tokens", cached)
+    increment("prompt_uncached_tokens", uncached)
+    return cached, uncached
+
+
+def build_prompt(kind: str, sections: List[Section]) -> BuiltPrompt:
+    """Apply section budgets, order stable sections before variable ones and join them."""
+    ordered = sorted((section for section in sections if section.text), key=lambda section: not section.stable)
+    parts, tokens = [], {}
+    for section in ordered:
+        text = fit_to_budget(section.text, section.budget, section.separator)
+        # Every section but the last ends with a blank line
+        parts.append(text if section is ordered[-1] else text.rstrip("\n") + "\n\n")
+        tokens[section.name] = section_tokens(parts[-1])
+    cached, uncached = report_prompt(kind, parts, list(tokens.values()))
+    return BuiltPrompt("".join(parts), parts, tokens, cached, uncached)
+
+
+def over_schema_budget(table_info: str) -> bool:
+    return PROMPT_SCHEMA_TOKENS > 0 and section_tokens(schema_header + table_info) > PROMPT_SCHEMA_TOKENS
+
+
+def fitted_table_info(db, table_names: Optional[List[str]] = None) -> str:
+    """Table info of all or some tables, without the sample values when it is over the schema budget."""
+    table_info = get_table_info(db, table_names)
+    if over_schema_budget(table_info):
+        table_info = get_table_info(db, table_names, sample_values=False)
+    return table_info
+
+
+def schema_block(table_info: str) -> str:
+    """Schema section; tables are only dropped when the block is still over budget without samples."""
+    return schema_header + fit_to_budget(table_info, PROMPT_SCHEMA_TOKENS, TABLE_SEPARATOR)
+
+
+def use_schema_prefix(full_tokens: int, pruned_tokens: int) -> bool:
+    """
+    Whether the full, cacheable schema is cheaper to send than the pruned one. Never when
+    the full schema is over budget, since cutting it would drop tables the question may need.
+    """
+    if PROMPT_SCHEMA_TOKENS > 0 and full_tokens > PROMPT_SCHEMA_TOKENS:
+        return False
+    if PROMPT_SCHEMA_LAYOUT == "prefix":
+        return True
+    if PROMPT_SCHEMA_LAYOUT == "pruned":
+        return False
+    return (full_tokens >= PROMPT_CACHE_MIN_TOKENS
+            and full_tokens * (1 - PROMPT_CACHE_DISCOUNT) <= pruned_tokens)
+
+
+def build_sql_prompt(db, question: str, pruned_table_info: Optional[str] = None,
+                     relevant_tables: Optional[List[str]] = None, column_values: str = "",
+                     conversation: str = "") -> BuiltPrompt:
+    """
+    SQL generation prompt. With the full schema it starts with the schema block shared with
+    the table selector, then the fixed instructions; a pruned schema follows the instructions.
+    The conversation context, column values and the question come last.
+    """
+    full_info = fitted_table_info(db)
+    full_schema = schema_block(full_info)
+    schema = Section("schema", full_schema, stable=True)
+    hint = ""
+    if pruned_table_info is not None:
+        if over_schema_budget(pruned_table_info) and relevant_tables:
+            pruned_table_info = get_table_info(db, relevant_tables, sample_values=False)
+        pruned_schema = schema_block(pruned_table_info)
+        # Sizes before any cut: a full schema over budget is never sent as the prefix
+        if not use_schema_prefix(section_tokens(schema_header + full_info), count_tokens(pruned_schema)):
+            schema = Section("schema", pruned_schema, stable=False)
+        elif relevant_tables:
+            # The selection still helps the model when the whole schema is sent
+            hint = f"Tables most relevant to this question: {', '.join(sorted(relevant_tables))}\n"
+
+    question = fit_to_budget(question, PROMPT_QUESTION_TOKENS, WORD_SEPARATOR)
+    return build_prompt("sql", [
+        schema,
+        Section("instructions", sql_instructions, stable=True),
+        Section("relevant_tables", hint, stable=False),
+        Section("conversation", conversation, stable=False, budget=PROMPT_CONVERSATION_TOKENS),
+        Section("column_values", column_values, stable=False, budget=PROMPT_COLUMN_VALUES_TOKENS),
+        Section("question", sql_question_prompt.format(question=question), stable=False),
+    ])
+
+
+def build_answer_prompt(inputs: Dict[str, Any]) -> BuiltPrompt:
+    """Answer prompt: fixed instructions first, then the question, query and (budgeted) result."""
+    question = fit_to_budget(str(inputs["question"]), PROMPT_QUESTION_TOKENS, WORD_SEPARATOR)
+    result = fit_to_budget(str(inputs.get("result", "")), PROMPT_RESULT_TOKENS, LINE_SEPARATOR)
+    return build_prompt("answer", [
+        Section("instructions", answer_instructions, stable=True),
+        Section("question", answer_question_prompt.format(question=question, query=inputs.get("query", ""), result=result),
+                stable=False),
+    ])
+
+
+def table_selection_message(db) -> str:
+    """
+    System message of the LLM table selector: the schema block, then its instructions. The
+    selector must see every table, so the block is never cut; within the budget it is the
+    same text as the SQL prompt's full schema and shares its cached prefix.
+    """
+    return (schema_header + fitted_table_info(db)).rstrip("\n") + "\n\n" + table_selection_instructions
@@ -1,11 +1,14 @@
 from langchain_core.prompts import PromptTemplate
 
-# SQL generation prompt with improved guidance and examples
-sql_prompt = PromptTemplate.from_template(
-    """You are an expert in converting natural language questions to SQL queries.
-    
-Database Schema:
-{table_info}
+# Prompts are split into sections that prompt_builder.py assembles with the content that
+# changes least first (the schema, then fixed instructions) and per-question content last,
+# so repeated requests share a prefix the LLM provider can serve from its prompt cache.
+
+# Leads the schema block, which is the same text in the SQL and table selection prompts
+schema_header = "Database Schema:\n"
+
+# SQL generation instructions with improved guidance and examples
+sql_instructions = """You are an expert in converting natural language questions to SQL queries.
 
 Guidelines for query generation:
 1. Analyze the question carefully to determine which table contains the relevant information
@@ -23,21 +26,19 @@ Example Query Patterns:
 3. For questions about location or "where" → Look for address or location related columns
 4. For questions about recommendations or "best" → Look for popular or recommended items
 5. For specific attributes (sweet, spicy, vegetarian) → Search in relevant attribute columns
+"""
 
-User Question: {question}
+# Per-question tail of the SQL prompt
+sql_question_prompt = PromptTemplate.from_template(
+    """User Question: {question}
 
 First, analyze which table(s) are needed, then identify appropriate columns and filtering conditions.
 Generate a SQL query with flexible text matching to maximize the chance of finding relevant results.
 
 SQL Query (return only the SQL, no other text): """)
 
-# Answer prompt with better fallback handling and response structure
-answer_prompt = PromptTemplate.from_template(
-    """Given the following information, provide a natural, contextual response:
-    
-Original Question: {question}
-SQL Query Used: {query}
-Raw Query Result: {result}
+# Answer instructions with better fallback handling and response structure
+answer_instructions = """Provide a natural, contextual response to the question below, using the SQL query and its result.
 
 Guidelines for response:
 1. Provide a friendly, conversational response that directly answers the question
@@ -61,12 +62,34 @@ Guidelines for response:
 
 5. Example format for a food item list:
    "Here are some [category] options you might enjoy:
-   
+
    • **[Item Name]**: [Brief 1-2 sentence description]
    • **[Item Name]**: [Brief 1-2 sentence description]"
+"""
+
+# Per-question tail of the answer prompt
+answer_question_prompt = PromptTemplate.from_template(
+    """Original Question: {question}
+SQL Query Used: {query}
+Raw Query Result: {result}
 
 Response: """)
 
+# System message of the LLM table selector, following the schema block
+table_selection_instructions = """Analyze the user's question and determine which of the database tables above are most relevant to answering it.
+
+For each table, provide:
+1. The table name
+2. A confidence score (0-1) indicating how relevant this table is to the question
+
+Consider:
+- The subject matter of the question (what entity or information is being asked about)
+- The type of attributes being queried
+- Similar questions might need different tables depending on specific details
+
+Return ALL tables that might contain relevant information, with appropriate confidence scores.
+"""
+
 # Table selection prompt - generalized for any domain
 table_selection_prompt = PromptTemplate.from_template(
     """Given a user's question, determine which database tables are most relevant.
@@ -81,4 +104,4 @@ Think about:
 2. Which tables contain attributes, descriptions, or data that would answer this question?
 3. Consider both direct and indirect matches - the relevant tables may not contain exact keywords
 
-Relevant Tables: """)
\ No newline at end of file
+Relevant Tables: """)
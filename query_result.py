@@ -0,0 +1,98 @@
+from typing import Any, List, Sequence
+import csv
+import datetime
+import decimal
+import io
+import os
+
+# Rows and rendered characters of a result passed on to the answer prompt
+RESULT_MAX_ROWS = int(os.getenv("result_max_rows", "50"))
+RESULT_MAX_BYTES = int(os.getenv("result_max_bytes", "8000"))
+# "csv" or "markdown"; both list the column headers once
+RESULT_FORMAT = os.getenv("result_format", "csv").lower()
+# Rows fetched from the server-side cursor per round trip
+RESULT_FETCH_CHUNK_ROWS = int(os.getenv("result_fetch_chunk_rows", "100"))
+# Rows beyond the budget are still counted (not kept) up to this many, to report the total
+RESULT_COUNT_LIMIT = int(os.getenv("result_count_limit", "10000"))
+# Longer text values are cut off
+RESULT_MAX_VALUE_CHARS = int(os.getenv("result_max_value_chars", "300"))
+
+
+def format_value(value: Any, max_chars: int = RESULT_MAX_VALUE_CHARS) -> str:
+    """Compact text form of a typed database value."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    if isinstance(value, decimal.Decimal):
+        return format(value.normalize(), "f") if value == value.to_integral() else str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    text = str(value).replace("\r", " ").replace("\n", " ")
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
+
+
+class QueryResult:
+    """
+    Typed rows of a query, kept only up to a row and rendered-size budget. Rows past the
+    budget are counted so the rendering can say how much was left out.
+    """
+
+    def __init__(self, columns: Sequence[str], max_rows: int = RESULT_MAX_ROWS,
+                 max_bytes: int = RESULT_MAX_BYTES, fmt: str = RESULT_FORMAT,
+                 count_limit: int = RESULT_COUNT_LIMIT):
+        self.columns = [str(column) for column in columns]
+        self.rows: List[tuple] = []
+        self.total_rows = 0
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.count_limit = count_limit
+        self.full = False
+        self._lines: List[str] = []
+        self._header = self._render_line(self.columns, header=True)
+        self._bytes = len(self._header)
+
+    def _render_line(self, values: Sequence[Any], header: bool = False) -> str:
+        cells = list(values) if header else [format_value(value) for value in values]
+        if self.fmt == "markdown":
+            line = "| " + " | ".join(cell.replace("|", "\\|") for cell in cells) + " |\n"
+            if header:
+                line += "|" + "---|" * len(cells) + "\n"
+            return line
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(cells)
+        return buffer.getvalue()
+
+    def add(self, row: Sequence[Any]) -> bool:
+        """Count a row and keep it if it fits the budget. Returns False once fetching can stop."""
+        self.total_rows += 1
+        if not self.full:
+            line = self._render_line(row)
+            if len(self.rows) < self.max_rows and self._bytes + len(line) <= self.max_bytes:
+                self.rows.append(tuple(row))
+                self._lines.append(line)
+                self._bytes += len(line)
+                return True
+            self.full = True
+        return self.total_rows < len(self.rows) + self.count_limit
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_rows > len(self.rows)
+
+    def render(self) -> str:
+        """The kept rows with headers, plus a note on how many rows were left out; "" for no rows."""
+        if not self.total_rows:
+            return ""
+        text = self._header + "".join(self._lines)
+        if self.truncated:
+            counted_all = self.total_rows < len(self.rows) + self.count_limit
+            total = f"{self.total_rows}" if counted_all else f"at least {self.total_rows}"
+            text += f"({len(self.rows)} of {total} rows shown)\n"
+        return text.rstrip("\n")
+
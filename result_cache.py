@@ -0,0 +1,208 @@
+from typing import Dict, List, Any, Optional
+from collections import OrderedDict
+from sqlalchemy import text
+from schema_snapshot import get_schema_snapshot
+from instrumentation import record_cache
+from runtime import add_event_handler, emit
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("result_cache_enabled", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("result_cache_max_entries", "500"))
+# Default lifetime of a cached result in seconds
+RESULT_CACHE_TTL = float(os.getenv("result_cache_ttl", "300"))
+# Per-table overrides, e.g. "menu_items=3600,orders=30"; an entry lives as long as its shortest table TTL
+RESULT_CACHE_TABLE_TTLS = os.getenv("result_cache_table_ttls", "")
+# Seconds between information_schema.tables.update_time polls (0 disables polling)
+RESULT_CACHE_POLL_INTERVAL = float(os.getenv("result_cache_poll_interval", "30"))
+
+
+def parse_table_ttls(value: str) -> Dict[str, float]:
+    """Parse "table=seconds,table=seconds" into a dict."""
+    ttls = {}
+    for item in value.split(","):
+        if "=" in item:
+            table_name, seconds = item.split("=", 1)
+            ttls[table_name.strip().lower()] = float(seconds)
+    return ttls
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical cache key for a SQL statement: collapsed whitespace outside string literals, no trailing semicolon."""
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+def extract_tables(sql: str, table_names: List[str]) -> List[str]:
+    """
+    Return the known tables a statement mentions. Matching every identifier against the
+    schema over-approximates (a column named like a table also counts), which only
+    means an entry may be invalidated more often than strictly necessary.
+    """
+    known = {name.lower(): name for name in table_names}
+    identifiers = {token.lower() for token in re.findall(r"[A-Za-z_][A-Za-z0-9_$]*", re.sub(r"'(?:[^']|'')*'", "''", sql))}
+    return sorted(known[token] for token in identifiers if token in known)
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of executed SQL results, keyed by database and normalized SQL.
+    Each entry remembers the tables it reads so it can be invalidated per table,
+    either on demand or when information_schema reports the table was updated.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl: float = RESULT_CACHE_TTL,
+                 table_ttls: Optional[Dict[str, float]] = None,
+                 poll_interval: float = RESULT_CACHE_POLL_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.table_ttls = table_ttls if table_ttls is not None else parse_table_ttls(RESULT_CACHE_TABLE_TTLS)
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._update_times: Dict[str, Dict[str, Any]] = {}
+        self._last_poll: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _source(db) -> str:
+        return getattr(db, "_engine", db).url.render_as_string(hide_password=True)
+
+    def _entry_ttl(self, tables: List[str]) -> float:
+        return min([self.table_ttls.get(table.lower(), self.ttl) for table in tables] or [self.ttl])
+
+    def get(self, db, sql: str) -> Optional[str]:
+        """Return the cached result for a statement, or None on a miss."""
+        self.poll_update_times(db)
+        key = (self._source(db), normalize_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() > entry["expires_at"]:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                record_cache("sql_result", False)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache("sql_result", True)
+            return entry["result"]
+
+    def put(self, db, sql: str, result: str) -> None:
+        """Store a result along with the tables its statement reads."""
+        tables = extract_tables(sql, get_schema_snapshot(db).get_table_names())
+        key = (self._source(db), normalize_sql(sql))
+        with self._lock:
+            self._entries[key] = {
+                "result": result,
+                "tables": tables,
+                "expires_at": time.time() + self._entry_ttl(tables),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_table(self, db, table_name: str) -> int:
+        """
+        Drop every cached result that reads a table. Returns the number of entries removed.
+        Other caches derived from the table's data follow the table_changed event.
+        """
+        source = self._source(db)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if key[0] == source and table_name.lower() in (t.lower() for t in entry["tables"])]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        emit("table_changed", db=db, table=table_name)
+        return len(stale)
+
+    def invalidate_all(self, db=None) -> None:
+        with self._lock:
+            if db is None:
+                count = len(self._entries)
+                self._entries.clear()
+            else:
+                source = self._source(db)
+                stale = [key for key in self._entries if key[0] == source]
+                for key in stale:
+                    del self._entries[key]
+                count = len(stale)
+            self.invalidations += count
+
+    def poll_update_times(self, db, force: bool = False) -> None:
+        """Invalidate tables whose information_schema.tables.update_time changed since the last poll."""
+        engine = getattr(db, "_engine", db)
+        if engine.dialect.name != "mysql" or (self.poll_interval <= 0 and not force):
+            return
+        source = self._source(db)
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_poll.get(source, 0) < self.poll_interval:
+                return
+            self._last_poll[source] = now
+
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(text(
+                    "SELECT table_name, update_time FROM information_schema.tables "
+                    "WHERE table_schema = DATABASE()"
+                )).fetchall()
+        except Exception as e:
+            logger.error(f"Error polling table update times: {e}")
+            return
+
+        current = {table_name: update_time for table_name, update_time in rows}
+        previous = self._update_times.get(source)
+        self._update_times[source] = current
+        if previous is None:
+            return
+        for table_name, update_time in current.items():
+            if previous.get(table_name) != update_time:
+                self.invalidate_table(db, table_name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    if event == "tenant_evicted" and _cache is not None:
+        _cache.invalidate_all(payload["db"])
+
+
+add_event_handler(_forget_tenant)
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Return the process-wide result cache, or None when it is disabled."""
+    global _cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
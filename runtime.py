@@ -0,0 +1,120 @@
+from typing import Any, Callable, Dict, List
+import functools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[str, Dict[str, Any]], None]
+
+_handlers: List[EventHandler] = []
+_handlers_lock = threading.Lock()
+
+
+class KeyLocks:
+    """
+    One lock per key (e.g. a database URL), so building a shared object for one database
+    never blocks the others. Locks are reentrant, so a build may look up its own key again.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Any, threading.RLock] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, key: Any) -> threading.RLock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.RLock())
+
+    def forget(self, key: Any) -> None:
+        with self._lock:
+            self._locks.pop(key, None)
+
+
+def cache_resource(func: Callable) -> Callable:
+    """
+    Process-wide cache for expensive shared objects (chains, clients), a UI-agnostic
+    replacement for st.cache_resource. Results are keyed by the call arguments; None is
+    not cached so a failed initialization is retried on the next call. Use func.clear()
+    to drop the cached values, or func.forget(*args) to drop the value for some arguments.
+    """
+    cache: Dict[tuple, Any] = {}
+    # Builds hold a per-key lock, so a slow build for one key never blocks hits for others
+    build_locks: Dict[tuple, threading.RLock] = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            if key in cache:
+                return cache[key]
+            build_lock = build_locks.setdefault(key, threading.RLock())
+        with build_lock:
+            with lock:
+                if key in cache:
+                    return cache[key]
+            result = func(*args, **kwargs)
+            if result is not None:
+                with lock:
+                    cache[key] = result
+            return result
+
+    def clear() -> None:
+        with lock:
+            cache.clear()
+            build_locks.clear()
+
+    def forget(*args, **kwargs) -> None:
+        key = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            cache.pop(key, None)
+            build_locks.pop(key, None)
+
+    wrapper.clear = clear
+    wrapper.forget = forget
+    return wrapper
+
+
+def _handler_key(handler: EventHandler) -> Any:
+    # Module-level functions are identified by name, so a script that is re-executed
+    # (Streamlit reruns main.py) replaces its handler instead of adding another copy
+    name = getattr(handler, "__qualname__", "")
+    if not name or "<" in name or hasattr(handler, "__self__"):
+        return handler
+    return getattr(handler, "__module__", None), name
+
+
+def add_event_handler(handler: EventHandler) -> None:
+    """
+    Subscribe to events such as "error". Registering the same handler again, or a
+    function of the same module and name, replaces the earlier registration.
+    """
+    key = _handler_key(handler)
+    with _handlers_lock:
+        for i, registered in enumerate(_handlers):
+            if _handler_key(registered) == key:
+                _handlers[i] = handler
+                return
+        _handlers.append(handler)
+
+
+def remove_event_handler(handler: EventHandler) -> None:
+    key = _handler_key(handler)
+    with _handlers_lock:
+        _handlers[:] = [registered for registered in _handlers if _handler_key(registered) != key]
+
+
+def emit(event: str, **payload: Any) -> None:
+    """Notify every handler; a failing handler never breaks the caller."""
+    with _handlers_lock:
+        handlers = list(_handlers)
+    for handler in handlers:
+        try:
+            handler(event, payload)
+        except Exception as e:
+            logger.error(f"Error in {event} event handler: {e}")
+
+
+def report_error(message: str, error: Exception = None) -> None:
+    """Surface a user-facing error message to whichever client is attached (UI, service logs)."""
+    emit("error", message=message, error=error)
@@ -0,0 +1,118 @@
+from typing import Dict, List, Any, Optional, Tuple
+from db_utils import get_table_info, infer_table_purpose
+from schema_snapshot import get_schema_snapshot
+from fallback_search import STOP_WORDS
+from table_selection import COLUMN_NAME_WEIGHT, TABLE_NAME_WEIGHT, normalize_question, select_relevant_tables, tokenize
+from token_counter import count_tokens
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PRUNING_ENABLED = os.getenv("schema_pruning_enabled", "true").lower() in ("1", "true", "yes")
+# Number of best-scoring tables kept before adding their foreign key neighbours
+SCHEMA_PRUNING_TOP_K = int(os.getenv("schema_pruning_top_k", "5"))
+# Minimum lexical score for the local scorer to be trusted without the LLM table selector
+SCHEMA_PRUNING_MIN_SCORE = float(os.getenv("schema_pruning_min_score", "2"))
+
+# Weights of the other places a question term can match, next to table and column names
+SAMPLE_VALUE_WEIGHT = 1.0
+PURPOSE_WEIGHT = 0.5
+
+_full_schema_tokens: Dict[str, int] = {}
+
+def score_tables(db, question: str) -> Dict[str, float]:
+    """Score every table by how many question terms appear in its name, columns, purpose and sample values."""
+    snapshot = get_schema_snapshot(db)
+    question_terms = {term for term in tokenize(normalize_question(question)) if term not in STOP_WORDS and len(term) > 2}
+
+    scores = {}
+    for table_name in snapshot.get_table_names():
+        columns = snapshot.get_columns(table_name)
+        sample_rows = snapshot.get_sample_rows(table_name)
+
+        table_terms = set(tokenize(table_name))
+        column_terms = {term for col in columns for term in tokenize(col["name"])}
+        purpose_terms = set(tokenize(infer_table_purpose(table_name, columns, sample_rows)))
+        value_terms = {term for row in sample_rows for value in row.values()
+                       if isinstance(value, str) for term in tokenize(value)}
+
+        score = 0.0
+        for term in question_terms:
+            if term in table_terms:
+                score += TABLE_NAME_WEIGHT
+            if term in column_terms:
+                score += COLUMN_NAME_WEIGHT
+            if term in value_terms:
+                score += SAMPLE_VALUE_WEIGHT
+            if term in purpose_terms:
+                score += PURPOSE_WEIGHT
+        scores[table_name] = score
+
+    return scores
+
+def add_foreign_key_neighbours(db, table_names: List[str]) -> List[str]:
+    """Add the tables referenced by, or referencing, the selected tables so joins stay possible."""
+    snapshot = get_schema_snapshot(db)
+    selected = list(table_names)
+    for table_name in snapshot.get_table_names():
+        for fk in snapshot.get_foreign_keys(table_name):
+            referred = fk["referred_table"]
+            if table_name in table_names and referred not in selected and referred in snapshot.tables:
+                selected.append(referred)
+            elif referred in table_names and table_name not in selected:
+                selected.append(table_name)
+    return selected
+
+def select_tables(db, question: str, top_k: int = SCHEMA_PRUNING_TOP_K) -> Tuple[List[str], str]:
+    """
+    Pick the tables relevant to a question. The local lexical scorer decides when its best
+    score is high enough; otherwise the LLM table selector is used.
+    Returns the selected tables and the method that chose them.
+    """
+    scores = score_tables(db, question)
+    ranked = sorted((name for name in scores if scores[name] > 0), key=lambda name: scores[name], reverse=True)
+
+    if ranked and scores[ranked[0]] >= SCHEMA_PRUNING_MIN_SCORE:
+        return add_foreign_key_neighbours(db, ranked[:top_k]), "lexical"
+
+    known_tables = set(get_schema_snapshot(db).get_table_names())
+    table_names = [name for name in select_relevant_tables(question, db) if name in known_tables][:top_k]
+    return add_foreign_key_neighbours(db, table_names), "llm"
+
+def prune_schema(db, question: str, full_table_info: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Render a schema block with only the tables relevant to the question.
+    Returns the block and statistics including how many prompt tokens were saved.
+    """
+    snapshot = get_schema_snapshot(db)
+    if full_table_info is None:
+        full_table_info = get_table_info(db)
+
+    # Token count of the full schema only changes with the schema itself
+    full_tokens = _full_schema_tokens.get(snapshot.fingerprint)
+    if full_tokens is None:
+        full_tokens = count_tokens(full_table_info)
+        _full_schema_tokens.clear()
+        _full_schema_tokens[snapshot.fingerprint] = full_tokens
+
+    table_names, method = select_tables(db, question)
+    if not table_names:
+        table_names, pruned_info, pruned_tokens = snapshot.get_table_names(), full_table_info, full_tokens
+    else:
+        pruned_info = get_table_info(db, table_names=table_names)
+        pruned_tokens = count_tokens(pruned_info)
+
+    stats = {
+        "tables": table_names,
+        "method": method,
+        "tables_total": len(snapshot.get_table_names()),
+        "schema_tokens_full": full_tokens,
+        "schema_tokens_pruned": pruned_tokens,
+        "schema_tokens_saved": full_tokens - pruned_tokens,
+    }
+    logger.info(
+        f"Schema pruned to {len(table_names)}/{stats['tables_total']} tables by {method}, "
+        f"saved {stats['schema_tokens_saved']} of {full_tokens} tokens"
+    )
+    return pruned_info, stats
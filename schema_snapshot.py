@@ -0,0 +1,362 @@
+from typing import Dict, List, Any, Optional
+from sqlalchemy import inspect, text
+from instrumentation import record_cache, record_rows, stage
+from runtime import KeyLocks
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long a snapshot is trusted before it is rebuilt unconditionally
+SCHEMA_CACHE_TTL = float(os.getenv("schema_cache_ttl", "3600"))
+# How often the cheap fingerprint query is re-run to detect schema changes
+SCHEMA_FINGERPRINT_INTERVAL = float(os.getenv("schema_fingerprint_interval", "60"))
+# Number of sample rows kept per table
+SCHEMA_SAMPLE_ROWS = int(os.getenv("schema_sample_rows", "5"))
+# Prebuilt snapshot loaded on cold start instead of reflecting the database (see build_schema_artifact)
+SCHEMA_ARTIFACT_PATH = os.getenv("schema_artifact_path")
+# Bumped whenever the artifact layout changes; older artifacts are ignored
+SCHEMA_ARTIFACT_VERSION = 3
+
+_snapshots: Dict[str, "SchemaSnapshot"] = {}
+_snapshot_lock = threading.Lock()
+# Reflection and fingerprint checks run under the database's own lock, not _snapshot_lock
+_build_locks = KeyLocks()
+
+
+class SchemaSnapshot:
+    """
+    In-memory copy of the column, primary key, foreign key and sample-row
+    metadata of every table. Exposes the same lookups as a SQLAlchemy
+    Inspector so callers can use it as a drop-in replacement.
+    """
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], fingerprint: str, table_info: Optional[str] = None):
+        self.tables = tables
+        self.fingerprint = fingerprint
+        # Rendered schema block for all tables, filled in by db_utils.get_table_info
+        self.table_info = table_info
+        # The same block without sample values, for schemas over the prompt budget
+        self.compact_table_info: Optional[str] = None
+        self.built_at = time.time()
+        self.checked_at = self.built_at
+
+    def get_table_names(self) -> List[str]:
+        return list(self.tables.keys())
+
+    def get_columns(self, table_name: str) -> List[Dict[str, Any]]:
+        return self.tables[table_name]["columns"]
+
+    def get_pk_constraint(self, table_name: str) -> Dict[str, Any]:
+        return self.tables[table_name]["primary_key"]
+
+    def get_foreign_keys(self, table_name: str) -> List[Dict[str, Any]]:
+        return self.tables[table_name]["foreign_keys"]
+
+    def get_sample_rows(self, table_name: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        rows = self.tables[table_name]["sample_rows"]
+        return rows[:limit] if limit is not None else rows
+
+    def is_expired(self) -> bool:
+        return time.time() - self.built_at > SCHEMA_CACHE_TTL
+
+    def needs_fingerprint_check(self) -> bool:
+        return time.time() - self.checked_at > SCHEMA_FINGERPRINT_INTERVAL
+
+
+def _engine_key(engine) -> str:
+    return engine.url.render_as_string(hide_password=True)
+
+
+def get_schema_fingerprint(engine) -> str:
+    """
+    Compute a cheap fingerprint that changes whenever tables or columns change.
+    Uses a single aggregate query where the dialect allows it.
+    """
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "mysql":
+            row = conn.execute(text(
+                "SELECT COUNT(*), "
+                "COALESCE(SUM(CRC32(CONCAT_WS('|', table_name, column_name, column_type, "
+                "is_nullable, column_key, ordinal_position))), 0) "
+                "FROM information_schema.columns WHERE table_schema = DATABASE()"
+            )).fetchone()
+            fk_row = conn.execute(text(
+                "SELECT COUNT(*), "
+                "COALESCE(SUM(CRC32(CONCAT_WS('|', table_name, column_name, constraint_name, "
+                "referenced_table_name, referenced_column_name))), 0) "
+                "FROM information_schema.key_column_usage WHERE table_schema = DATABASE()"
+            )).fetchone()
+            return f"mysql:{row[0]}:{row[1]}:{fk_row[0]}:{fk_row[1]}"
+        if dialect == "sqlite":
+            version = conn.execute(text("PRAGMA schema_version")).scalar()
+            return f"sqlite:{version}"
+
+    # Generic fallback: hash of the table names
+    names = sorted(inspect(engine).get_table_names())
+    return f"{dialect}:" + hashlib.sha1("|".join(names).encode()).hexdigest()
+
+
+def _load_mysql_metadata(engine) -> Dict[str, Dict[str, Any]]:
+    """Load columns, primary keys and foreign keys with three information_schema queries."""
+    tables: Dict[str, Dict[str, Any]] = {}
+    with engine.connect() as conn:
+        result = conn.execute(text(
+            "SELECT table_name FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_type = 'BASE TABLE' "
+            "ORDER BY table_name"
+        ))
+        for (table_name,) in result:
+            tables[table_name] = {
+                "columns": [],
+                "primary_key": {"constrained_columns": [], "name": None},
+                "foreign_keys": [],
+            }
+
+        result = conn.execute(text(
+            "SELECT table_name, column_name, column_type, is_nullable, column_default, column_comment "
+            "FROM information_schema.columns WHERE table_schema = DATABASE() "
+            "ORDER BY table_name, ordinal_position"
+        ))
+        for table_name, column_name, column_type, is_nullable, default, comment in result:
+            if table_name not in tables:
+                continue
+            tables[table_name]["columns"].append({
+                "name": column_name,
+                "type": str(column_type).upper(),
+                "nullable": is_nullable == "YES",
+                "default": default,
+                "comment": comment or None,
+            })
+
+        result = conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.key_column_usage "
+            "WHERE table_schema = DATABASE() AND constraint_name = 'PRIMARY' "
+            "ORDER BY table_name, ordinal_position"
+        ))
+        for table_name, column_name in result:
+            if table_name in tables:
+                pk = tables[table_name]["primary_key"]
+                pk["name"] = "PRIMARY"
+                pk["constrained_columns"].append(column_name)
+
+        result = conn.execute(text(
+            "SELECT table_name, constraint_name, column_name, referenced_table_schema, "
+            "referenced_table_name, referenced_column_name "
+            "FROM information_schema.key_column_usage "
+            "WHERE table_schema = DATABASE() AND referenced_table_name IS NOT NULL "
+            "ORDER BY table_name, constraint_name, ordinal_position"
+        ))
+        foreign_keys: Dict[tuple, Dict[str, Any]] = {}
+        for table_name, constraint_name, column_name, ref_schema, ref_table, ref_column in result:
+            if table_name not in tables:
+                continue
+            key = (table_name, constraint_name)
+            if key not in foreign_keys:
+                foreign_keys[key] = {
+                    "name": constraint_name,
+                    "constrained_columns": [],
+                    "referred_schema": None,
+                    "referred_table": ref_table,
+                    "referred_columns": [],
+                }
+                tables[table_name]["foreign_keys"].append(foreign_keys[key])
+            foreign_keys[key]["constrained_columns"].append(column_name)
+            foreign_keys[key]["referred_columns"].append(ref_column)
+
+    return tables
+
+
+def _load_inspector_metadata(engine) -> Dict[str, Dict[str, Any]]:
+    """Load metadata through SQLAlchemy's multi-table reflection API."""
+    inspector = inspect(engine)
+    table_names = inspector.get_table_names()
+    columns = inspector.get_multi_columns()
+    pks = inspector.get_multi_pk_constraint()
+    fks = inspector.get_multi_foreign_keys()
+
+    tables = {}
+    for table_name in table_names:
+        key = (None, table_name)
+        tables[table_name] = {
+            "columns": columns.get(key, []),
+            "primary_key": pks.get(key) or {"constrained_columns": [], "name": None},
+            "foreign_keys": fks.get(key, []),
+        }
+    return tables
+
+
+def _load_sample_rows(engine, tables: Dict[str, Dict[str, Any]], limit: int) -> None:
+    """Fetch a few sample rows per table over a single connection."""
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.connect() as conn:
+        for table_name, table in tables.items():
+            table["sample_rows"] = []
+            if limit <= 0:
+                continue
+            # Ordered by primary key so the same rows (and rendered schema) come back on every reload
+            pk_columns = table["primary_key"].get("constrained_columns") or []
+            order_by = f" ORDER BY {', '.join(quote(col) for col in pk_columns)}" if pk_columns else ""
+            try:
+                result = conn.execute(text(f"SELECT * FROM {quote(table_name)}{order_by} LIMIT {int(limit)}"))
+                table["sample_rows"] = [dict(row._mapping) for row in result]
+                record_rows(len(table["sample_rows"]))
+            except Exception as e:
+                logger.error(f"Error getting sample data for {table_name}: {e}")
+
+
+def load_schema_snapshot(engine, sample_rows: int = SCHEMA_SAMPLE_ROWS) -> SchemaSnapshot:
+    """Build a new snapshot of the whole schema using bulk metadata queries."""
+    with stage("schema_reflection") as attributes:
+        fingerprint = get_schema_fingerprint(engine)
+        if engine.dialect.name == "mysql":
+            tables = _load_mysql_metadata(engine)
+        else:
+            tables = _load_inspector_metadata(engine)
+        _load_sample_rows(engine, tables, sample_rows)
+        attributes["tables"] = len(tables)
+    return SchemaSnapshot(tables, fingerprint)
+
+
+def save_schema_artifact(snapshot: SchemaSnapshot, path: str, source: str) -> None:
+    """
+    Write a snapshot (and its rendered table info) to a versioned JSON file, atomically.
+    source is the database URL without password; the artifact is only loaded for it.
+    """
+    tables = {
+        table_name: {
+            **table,
+            # Reflected column types are SQLAlchemy objects; every consumer only uses their string form
+            "columns": [{**col, "type": str(col["type"])} for col in table["columns"]],
+        }
+        for table_name, table in snapshot.tables.items()
+    }
+    artifact = {
+        "version": SCHEMA_ARTIFACT_VERSION,
+        "source": source,
+        "fingerprint": snapshot.fingerprint,
+        "built_at": snapshot.built_at,
+        "tables": tables,
+        "table_info": snapshot.table_info,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, default=str)
+    os.replace(tmp_path, path)
+
+
+def load_schema_artifact(path: str, engine) -> Optional[SchemaSnapshot]:
+    """
+    Load a snapshot saved by save_schema_artifact. Returns None when the file is missing,
+    from another artifact version, was built for another database (fingerprints alone can
+    match across databases with the same schema), or for a schema with a different fingerprint.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            artifact = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading schema artifact {path}: {e}")
+        return None
+
+    if artifact.get("version") != SCHEMA_ARTIFACT_VERSION:
+        logger.info(f"Ignoring schema artifact {path} with version {artifact.get('version')}")
+        return None
+    if artifact.get("source") != _engine_key(engine):
+        return None
+    if artifact["fingerprint"] != get_schema_fingerprint(engine):
+        logger.info(f"Ignoring stale schema artifact {path}")
+        return None
+    return SchemaSnapshot(artifact["tables"], artifact["fingerprint"], artifact.get("table_info"))
+
+
+def get_schema_snapshot(db, force_refresh: bool = False) -> SchemaSnapshot:
+    """
+    Return the process-wide schema snapshot for a SQLDatabase or Engine.
+    The snapshot is rebuilt when its TTL expires or the schema fingerprint changes.
+    """
+    engine = getattr(db, "_engine", db)
+    key = _engine_key(engine)
+
+    with _snapshot_lock:
+        snapshot = _snapshots.get(key)
+    if (snapshot is not None and not force_refresh
+            and not snapshot.is_expired() and not snapshot.needs_fingerprint_check()):
+        record_cache("schema_snapshot", True)
+        return snapshot
+
+    with _build_locks(key):
+        if not force_refresh:
+            # Another thread may have checked or rebuilt the snapshot while this one waited
+            with _snapshot_lock:
+                snapshot = _snapshots.get(key)
+        if snapshot is not None and not force_refresh:
+            if snapshot.is_expired():
+                snapshot = None
+            elif snapshot.needs_fingerprint_check():
+                try:
+                    if get_schema_fingerprint(engine) == snapshot.fingerprint:
+                        snapshot.checked_at = time.time()
+                    else:
+                        logger.info("Schema fingerprint changed, rebuilding snapshot")
+                        snapshot = None
+                except Exception as e:
+                    # Keep serving the old snapshot if the check itself fails
+                    logger.error(f"Error checking schema fingerprint: {e}")
+                    snapshot.checked_at = time.time()
+
+        record_cache("schema_snapshot", snapshot is not None and not force_refresh)
+        if snapshot is None and key not in _snapshots and SCHEMA_ARTIFACT_PATH and not force_refresh:
+            # Cold start: the prebuilt artifact is only used if it matches the live schema
+            with stage("schema_artifact_load"):
+                snapshot = load_schema_artifact(SCHEMA_ARTIFACT_PATH, engine)
+
+        if snapshot is None or force_refresh:
+            snapshot = load_schema_snapshot(engine)
+        with _snapshot_lock:
+            _snapshots[key] = snapshot
+        return snapshot
+
+
+def invalidate_schema_snapshot(db=None) -> None:
+    """Drop the cached snapshot for one database, or all of them."""
+    with _snapshot_lock:
+        if db is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(_engine_key(getattr(db, "_engine", db)), None)
+
+
+def build_schema_artifact(path: str, uri: Optional[str] = None) -> SchemaSnapshot:
+    """Reflect the database, render its table info and save both as an artifact."""
+    from db_utils import get_database, get_table_info
+
+    db = get_database(uri)
+    snapshot = get_schema_snapshot(db, force_refresh=True)
+    get_table_info(db)
+    save_schema_artifact(snapshot, path, _engine_key(db._engine))
+    return snapshot
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build the schema artifact workers load on cold start.")
+    parser.add_argument("path", nargs="?", default=SCHEMA_ARTIFACT_PATH, help="Output file (default: schema_artifact_path)")
+    parser.add_argument("--uri", help="Database URL (default: the configured database)")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("no output path given and schema_artifact_path is not set")
+
+    # Go through the imported module so db_utils and this script share one snapshot cache
+    import schema_snapshot
+    snapshot = schema_snapshot.build_schema_artifact(args.path, args.uri)
+    print(f"Wrote {len(snapshot.tables)} tables with fingerprint {snapshot.fingerprint} to {args.path}")
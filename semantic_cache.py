@@ -0,0 +1,298 @@
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from collections import OrderedDict
+from table_selection import normalize_question, tokenize
+from fallback_search import STOP_WORDS
+from instrumentation import record_cache
+from runtime import add_event_handler
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("semantic_cache_enabled", "true").lower() in ("1", "true", "yes")
+# Minimum cosine similarity for a paraphrase to reuse a cached query; the paraphrase must
+# also name the same entities, since similar questions about another item score high
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("semantic_cache_threshold", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("semantic_cache_max_entries", "1000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("semantic_cache_ttl", "86400"))
+# "hashing" (local, offline) or "openai"
+SEMANTIC_CACHE_EMBEDDER = os.getenv("semantic_cache_embedder", "hashing")
+# "memory" or "chroma"
+SEMANTIC_CACHE_BACKEND = os.getenv("semantic_cache_backend", "memory")
+# Directory for a persistent chroma collection; in-process only when unset
+SEMANTIC_CACHE_PATH = os.getenv("semantic_cache_path")
+
+# Questions that differ only in these words ask for opposite things
+NEGATION_WORDS = {"no", "non", "not", "without", "except", "excluding", "never"}
+
+Embedder = Callable[[str], List[float]]
+
+
+class HashingEmbedder:
+    """
+    Offline embedder that hashes word unigrams and bigrams into a fixed-size,
+    L2-normalised vector. Bigrams keep phrases like "non vegetarian" apart from
+    "vegetarian". Good enough for near-duplicate questions; plug in a model-based
+    embedder to also match paraphrases with no words in common.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def __call__(self, question: str) -> List[float]:
+        words = re.findall(r"\w+", question.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = [0.0] * self.dimensions
+        for feature in features:
+            digest = hashlib.md5(feature.encode()).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+
+def get_embedder(name: str = SEMANTIC_CACHE_EMBEDDER) -> Embedder:
+    """Return the configured question embedder."""
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY")).embed_query
+    return HashingEmbedder()
+
+
+class InMemoryVectorStore:
+    """Brute-force cosine similarity over normalised vectors."""
+
+    def __init__(self):
+        self._vectors: Dict[str, List[float]] = {}
+
+    def add(self, entry_id: str, vector: List[float], metadata: Dict[str, Any]) -> None:
+        self._vectors[entry_id] = vector
+
+    def nearest(self, vector: List[float]) -> Optional[Tuple[str, float]]:
+        best = None
+        for entry_id, candidate in self._vectors.items():
+            score = sum(a * b for a, b in zip(vector, candidate))
+            if best is None or score > best[1]:
+                best = (entry_id, score)
+        return best
+
+    def delete(self, entry_ids: List[str]) -> None:
+        for entry_id in entry_ids:
+            self._vectors.pop(entry_id, None)
+
+    def clear(self) -> None:
+        self._vectors.clear()
+
+    def load(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return []
+
+
+class ChromaVectorStore:
+    """chromadb collection using cosine distance; persistent when a path is given."""
+
+    def __init__(self, path: Optional[str] = None, collection_name: str = "sql_semantic_cache"):
+        import chromadb
+        self._client = chromadb.PersistentClient(path=path) if path else chromadb.EphemeralClient()
+        self._name = collection_name
+        self._collection = self._client.get_or_create_collection(collection_name, metadata={"hnsw:space": "cosine"})
+
+    def add(self, entry_id: str, vector: List[float], metadata: Dict[str, Any]) -> None:
+        self._collection.upsert(ids=[entry_id], embeddings=[vector], metadatas=[metadata])
+
+    def nearest(self, vector: List[float]) -> Optional[Tuple[str, float]]:
+        if self._collection.count() == 0:
+            return None
+        result = self._collection.query(query_embeddings=[vector], n_results=1)
+        if not result["ids"] or not result["ids"][0]:
+            return None
+        return result["ids"][0][0], 1.0 - result["distances"][0][0]
+
+    def delete(self, entry_ids: List[str]) -> None:
+        if entry_ids:
+            self._collection.delete(ids=entry_ids)
+
+    def clear(self) -> None:
+        self._client.delete_collection(self._name)
+        self._collection = self._client.get_or_create_collection(self._name, metadata={"hnsw:space": "cosine"})
+
+    def load(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return the entries persisted by a previous process."""
+        result = self._collection.get(include=["metadatas"])
+        return list(zip(result["ids"], result["metadatas"]))
+
+
+def get_vector_store(backend: str = SEMANTIC_CACHE_BACKEND, collection_name: str = "sql_semantic_cache"):
+    if backend == "chroma":
+        return ChromaVectorStore(SEMANTIC_CACHE_PATH, collection_name)
+    return InMemoryVectorStore()
+
+
+class SemanticCache:
+    """
+    Question -> SQL cache. Questions are matched exactly on their normalized form,
+    then by embedding similarity. Entries are evicted by LRU and TTL, and the whole
+    cache is dropped when the schema fingerprint changes.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None, store=None,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl: float = SEMANTIC_CACHE_TTL):
+        self.embedder = embedder or get_embedder()
+        self.store = store or get_vector_store()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fingerprint: Optional[str] = None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._keys: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        for entry_id, metadata in sorted(self.store.load(), key=lambda item: item[1].get("created_at", 0)):
+            self._entries[entry_id] = dict(metadata)
+            self._keys[metadata["key"]] = entry_id
+            self.fingerprint = metadata.get("fingerprint")
+
+    @staticmethod
+    def _negations(text: str) -> set:
+        return NEGATION_WORDS.intersection(re.findall(r"\w+", text.lower()))
+
+    @staticmethod
+    def _entity_terms(text: str, vocabulary: set) -> set:
+        """Numbers and terms of known column values: a paraphrase may reword the rest, not these."""
+        return {term for term in tokenize(text.replace("-", " "))
+                if term.isdigit() or (term in vocabulary and term not in STOP_WORDS)}
+
+    def _remove(self, entry_ids: List[str]) -> None:
+        for entry_id in entry_ids:
+            entry = self._entries.pop(entry_id, None)
+            if entry is not None:
+                self._keys.pop(entry["key"], None)
+        self.store.delete(entry_ids)
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        if self.fingerprint is not None and fingerprint != self.fingerprint:
+            logger.info("Schema fingerprint changed, clearing semantic cache")
+            self._entries.clear()
+            self._keys.clear()
+            self.store.clear()
+        self.fingerprint = fingerprint
+
+    def lookup(self, question: str, fingerprint: str, vocabulary: Optional[set] = None) -> Optional[str]:
+        """
+        Return cached SQL for this question or a close paraphrase of it. vocabulary holds
+        the terms of the database's column values (column_profile.entity_terms).
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry_id = self._keys.get(key)
+        # The embedder may call a remote API, so it runs without holding the lock
+        vector = self.embedder(question) if entry_id is None else None
+
+        with self._lock:
+            semantic = False
+            if vector is not None:
+                nearest = self.store.nearest(vector)
+                if nearest and nearest[1] >= self.threshold and nearest[0] in self._entries:
+                    candidate = self._entries[nearest[0]]
+                    vocabulary = vocabulary or set()
+                    if (self._negations(candidate["question"]) == self._negations(question)
+                            and self._entity_terms(candidate["question"], vocabulary)
+                            == self._entity_terms(question, vocabulary)):
+                        entry_id, semantic = nearest[0], True
+
+            entry = self._entries.get(entry_id) if entry_id else None
+            if entry is not None and time.time() - entry["created_at"] > self.ttl:
+                self._remove([entry_id])
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                record_cache("semantic_sql", False)
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            record_cache("semantic_sql", True)
+            if semantic:
+                self.semantic_hits += 1
+            return entry["sql"]
+
+    def store_sql(self, question: str, sql: str, fingerprint: str) -> None:
+        """Remember the SQL generated for a question."""
+        key = normalize_question(question)
+        vector = self.embedder(question)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            if key in self._keys:
+                self._remove([self._keys[key]])
+
+            entry_id = uuid.uuid4().hex
+            metadata = {"key": key, "question": question, "sql": sql,
+                        "fingerprint": fingerprint, "created_at": time.time()}
+            self.store.add(entry_id, vector, metadata)
+            self._entries[entry_id] = metadata
+            self._keys[key] = entry_id
+
+            # Evict least recently used entries beyond the size limit
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._remove(list(self._entries.keys())[:overflow])
+                self.evictions += overflow
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self.store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# One cache per tenant (None is the single configured database), each in its own collection
+_caches: Dict[Optional[str], SemanticCache] = {}
+_cache_lock = threading.Lock()
+
+
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    # Persistent (chroma) entries stay on disk for when the tenant comes back
+    if event == "tenant_evicted":
+        with _cache_lock:
+            _caches.pop(payload["tenant"], None)
+
+
+add_event_handler(_forget_tenant)
+
+
+def get_semantic_cache(tenant: Optional[str] = None) -> Optional[SemanticCache]:
+    """Return the semantic cache of a tenant, or None when it is disabled."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        cache = _caches.get(tenant)
+        if cache is None:
+            collection_name = f"sql_semantic_cache_{tenant}" if tenant else "sql_semantic_cache"
+            cache = _caches[tenant] = SemanticCache(store=get_vector_store(collection_name=collection_name))
+        return cache
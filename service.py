@@ -0,0 +1,154 @@
+from typing import Dict, List, Any, Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+from db_utils import get_table_info
+from schema_snapshot import get_schema_snapshot
+from langchain_utils import ainvoke_chain, astream_chain, agenerate_sql_for_question, get_chain_stages
+from instrumentation import render_prometheus
+from intent_router import get_intent_router
+from runtime import add_event_handler
+from tenants import UnknownTenantError, get_tenant_database, get_tenant_uri
+import asyncio
+import logging
+import os
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SERVICE_HOST = os.getenv("service_host", "0.0.0.0")
+SERVICE_PORT = int(os.getenv("service_port", "8000"))
+
+TENANT_DESCRIPTION = "Tenant whose database is queried; the configured database when omitted."
+SESSION_DESCRIPTION = "Chat session of the question; follow-up questions are answered in its context."
+
+
+class AskRequest(BaseModel):
+    question: str = Field(min_length=1)
+    stream: bool = Field(default=False, description="Stream the answer as plain text while it is generated.")
+    tenant: Optional[str] = Field(default=None, description=TENANT_DESCRIPTION)
+    session_id: Optional[str] = Field(default=None, max_length=128, description=SESSION_DESCRIPTION)
+
+
+class SqlRequest(BaseModel):
+    question: str = Field(min_length=1)
+    execute: bool = Field(default=True, description="Also run the query and return its raw result.")
+    tenant: Optional[str] = Field(default=None, description=TENANT_DESCRIPTION)
+    session_id: Optional[str] = Field(default=None, max_length=128, description=SESSION_DESCRIPTION)
+
+
+def check_tenant(tenant: Optional[str]) -> None:
+    try:
+        get_tenant_uri(tenant)
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant: {tenant}")
+
+
+def _log_event(event: str, payload: Dict[str, Any]) -> None:
+    if event == "error":
+        logger.warning(payload["message"])
+
+
+add_event_handler(_log_event)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the chain (schema snapshot, model client) before the first request arrives
+    await asyncio.to_thread(get_chain_stages)
+    yield
+
+
+app = FastAPI(title="NL to SQL", description="Answer natural language questions about the database.",
+              lifespan=lifespan)
+
+
+@app.get("/health")
+async def health() -> Dict[str, str]:
+    return {"status": "ok"}
+
+
+@app.post("/ask")
+async def ask(request: AskRequest):
+    """Answer a question in natural language."""
+    check_tenant(request.tenant)
+    if request.stream:
+        return StreamingResponse(astream_chain(request.question, [], request.tenant, request.session_id),
+                                 media_type="text/plain; charset=utf-8")
+    return {"question": request.question, "answer": await ainvoke_chain(request.question, [], request.tenant, request.session_id)}
+
+
+@app.post("/sql")
+async def sql(request: SqlRequest):
+    """Return the SQL generated for a question and, unless execute is false, its raw result."""
+    check_tenant(request.tenant)
+    output = await agenerate_sql_for_question(request.question, execute=request.execute, tenant=request.tenant,
+                                             session_id=request.session_id)
+    if output is None:
+        raise HTTPException(status_code=503, detail="System initialization failed")
+    return output
+
+
+@app.get("/schema")
+async def schema(format: str = "json", tables: Optional[str] = None, tenant: Optional[str] = None):
+    """Describe the database schema as JSON, or as the text block used in the SQL prompt (format=text)."""
+    check_tenant(tenant)
+    table_names: Optional[List[str]] = tables.split(",") if tables else None
+
+    def describe():
+        db = get_tenant_database(tenant)
+        if format == "text":
+            return PlainTextResponse(get_table_info(db, table_names))
+        snapshot = get_schema_snapshot(db)
+        return {
+            "fingerprint": snapshot.fingerprint,
+            "tables": {
+                name: {
+                    "columns": [{"name": col["name"], "type": str(col["type"]), "nullable": col.get("nullable", True)}
+                                for col in snapshot.get_columns(name)],
+                    "primary_key": snapshot.get_pk_constraint(name).get("constrained_columns", []),
+                    "foreign_keys": [{"columns": fk["constrained_columns"], "referred_table": fk["referred_table"],
+                                      "referred_columns": fk["referred_columns"]}
+                                     for fk in snapshot.get_foreign_keys(name)],
+                }
+                for name in snapshot.get_table_names()
+                if table_names is None or name in table_names
+            },
+        }
+
+    try:
+        return await asyncio.to_thread(describe)
+    except Exception as e:
+        logger.error(f"Schema endpoint error: {e}")
+        raise HTTPException(status_code=503, detail="Unable to read the database schema")
+
+
+@app.get("/intents")
+async def intents(tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Intent router coverage of this worker: questions seen, routed per intent and the tables used."""
+    check_tenant(tenant)
+
+    def describe():
+        router = get_intent_router(get_tenant_database(tenant))
+        return router.stats() if router else {"enabled": False}
+
+    try:
+        return await asyncio.to_thread(describe)
+    except Exception as e:
+        logger.error(f"Intents endpoint error: {e}")
+        raise HTTPException(status_code=503, detail="Unable to build the intent router")
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """Prometheus text-format metrics of this worker."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("service:app", host=SERVICE_HOST, port=SERVICE_PORT,
+                workers=int(os.getenv("service_workers", "1")))
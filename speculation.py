@@ -0,0 +1,124 @@
+from typing import Any, Callable, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from instrumentation import increment
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_ENABLED = os.getenv("speculative_enabled", "true").lower() in ("1", "true", "yes")
+# Prefetch the fallback keyword search while the primary query is generated and run
+SPECULATIVE_FALLBACK = os.getenv("speculative_fallback", "true").lower() in ("1", "true", "yes")
+# Seconds a question must go without a result before the fallback search starts: faster
+# questions never pay for it, slow ones still overlap it with the primary query
+SPECULATIVE_FALLBACK_DELAY = float(os.getenv("speculative_fallback_delay", "2"))
+# Async path only: start SQL generation while the semantic cache is checked, cancelled on a hit
+SPECULATIVE_SQL = os.getenv("speculative_sql", "true").lower() in ("1", "true", "yes")
+SPECULATIVE_WORKERS = int(os.getenv("speculative_workers", "8"))
+
+Speculative = Union[Future, "asyncio.Task"]
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+    return _executor
+
+
+class DelayedFuture(Future):
+    """A speculative call that starts after a delay, or as soon as its result is needed."""
+
+    def __init__(self, call: Callable[[], Any], delay: float):
+        super().__init__()
+        self._call = call
+        self._claimed = threading.Lock()
+        self._timer = threading.Timer(delay, lambda: _get_executor().submit(self.start))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def start(self) -> None:
+        """Run the call in this thread, unless it already started or was cancelled."""
+        if not self._claimed.acquire(blocking=False) or not self.set_running_or_notify_cancel():
+            return
+        try:
+            self.set_result(self._call())
+        except BaseException as e:
+            self.set_exception(e)
+
+    def cancel(self) -> bool:
+        self._timer.cancel()
+        return super().cancel()
+
+
+def speculate(func: Callable[..., Any], *args: Any, delay: float = 0) -> Future:
+    """
+    Start func in the background within the current request trace, after delay seconds
+    if given (discarding it before then costs nothing). Collect or discard the future.
+    """
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    if delay > 0:
+        return DelayedFuture(call, delay)
+    return _get_executor().submit(call)
+
+
+async def _after(coro, delay: float, start: asyncio.Event) -> Any:
+    try:
+        await asyncio.wait_for(start.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+    return await coro
+
+
+def aspeculate(coro, delay: float = 0) -> "asyncio.Task":
+    """Async variant of speculate: run a coroutine as a task on the running loop."""
+    if delay <= 0:
+        return asyncio.create_task(coro)
+    start = asyncio.Event()
+    task = asyncio.create_task(_after(coro, delay, start))
+    task.start = start.set
+    # A task cancelled before the delay never awaits coro; close it so it isn't reported as leaked
+    task.add_done_callback(lambda done: coro.close() if done.cancelled() else None)
+    return task
+
+
+def collect(task: Speculative) -> Any:
+    """Wait for a speculative result that turned out to be needed, starting it now if it hasn't yet."""
+    increment("speculation_used")
+    if isinstance(task, DelayedFuture):
+        task.start()
+    return task.result()
+
+
+async def acollect(task: "asyncio.Task") -> Any:
+    increment("speculation_used")
+    if hasattr(task, "start"):
+        task.start()
+    return await task
+
+
+def discard(task: Optional[Speculative]) -> None:
+    """
+    Drop a speculative result that isn't needed. Pending work is cancelled; a thread
+    that already started runs to completion and its result is ignored.
+    """
+    if task is None:
+        return
+    increment("speculation_discarded")
+    task.cancel()
+    # Errors of work nobody waits for would otherwise go unnoticed
+    task.add_done_callback(_log_failure)
+
+
+def _log_failure(task: Speculative) -> None:
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error(f"Discarded speculative task failed: {error}")
@@ -0,0 +1,237 @@
+from typing import Dict, Any, Optional, Tuple
+from sqlalchemy import text
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SQL_GUARD_ENABLED = os.getenv("sql_guard_enabled", "true").lower() in ("1", "true", "yes")
+# LIMIT added to queries without one, and the ceiling for larger limits
+SQL_GUARD_MAX_ROWS = int(os.getenv("sql_guard_max_rows", "200"))
+# Estimated rows a statement may examine, according to EXPLAIN (0 disables the check)
+SQL_GUARD_SCAN_BUDGET = int(os.getenv("sql_guard_scan_budget", "1000000"))
+# "rewrite" lowers the LIMIT of over-budget row queries to sql_guard_budget_rows, "reject" refuses them
+SQL_GUARD_BUDGET_ACTION = os.getenv("sql_guard_budget_action", "rewrite").lower()
+SQL_GUARD_BUDGET_ROWS = int(os.getenv("sql_guard_budget_rows", "20"))
+# Per-statement execution timeout in milliseconds (0 disables it)
+SQL_GUARD_TIMEOUT_MS = int(os.getenv("sql_guard_timeout_ms", "10000"))
+# How long SQLite table row counts used for estimates are reused
+SQL_GUARD_ROW_COUNT_TTL = float(os.getenv("sql_guard_row_count_ttl", "300"))
+
+# SQLAlchemy dialect name -> sqlglot dialect
+SQLGLOT_DIALECTS = {"mysql": "mysql", "sqlite": "sqlite", "postgresql": "postgres", "mssql": "tsql"}
+
+_row_counts: Dict[Tuple[str, str], Tuple[int, float]] = {}
+_row_counts_lock = threading.Lock()
+
+
+class SQLGuardError(Exception):
+    """A generated statement was refused before reaching the database."""
+
+
+def _forbidden_types():
+    from sqlglot import exp
+    return (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter,
+            exp.TruncateTable, exp.Command, exp.Into, exp.Lock, exp.Pragma, exp.Use, exp.Transaction)
+
+
+def _limit_value(expression) -> Optional[int]:
+    limit = expression.args.get("limit")
+    if limit is None:
+        return None
+    try:
+        return int(limit.expression.name)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def prepare_query(sql: str, dialect: str, max_rows: int = SQL_GUARD_MAX_ROWS) -> str:
+    """
+    Check that a statement is a single read-only query and cap how many rows it returns.
+    Returns the statement unchanged when it already complies, otherwise the rewritten SQL.
+    Raises SQLGuardError for anything that is not a plain SELECT.
+    """
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+
+    read = SQLGLOT_DIALECTS.get(dialect)
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=read) if statement is not None]
+    except ParseError as e:
+        raise SQLGuardError(f"Could not parse the query: {str(e).splitlines()[0]}")
+
+    if len(statements) != 1:
+        raise SQLGuardError("Only a single statement can be run")
+    expression = statements[0]
+    if not isinstance(expression, exp.Query):
+        raise SQLGuardError(f"Only SELECT queries are allowed, not {expression.key.upper()}")
+    forbidden = next(expression.find_all(*_forbidden_types()), None)
+    if forbidden is not None:
+        raise SQLGuardError(f"Only read-only queries are allowed ({forbidden.key.upper()} found)")
+
+    limit = _limit_value(expression)
+    if limit is not None and limit <= max_rows:
+        return sql
+    return expression.limit(max_rows).sql(dialect=read)
+
+
+def _sqlite_row_count(conn, engine, table_name: str) -> int:
+    key = (engine.url.render_as_string(hide_password=True), table_name)
+    with _row_counts_lock:
+        cached = _row_counts.get(key)
+    if cached is not None and time.time() - cached[1] < SQL_GUARD_ROW_COUNT_TTL:
+        return cached[0]
+    quote = engine.dialect.identifier_preparer.quote
+    count = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table_name)}")).scalar() or 0
+    with _row_counts_lock:
+        _row_counts[key] = (count, time.time())
+    return count
+
+
+def _scan_targets(sql: str, dialect: str) -> Dict[str, Optional[str]]:
+    """
+    Names a query plan may scan, lowercased: tables and their aliases map to the table,
+    CTE names and derived-table aliases to None (the tables inside them are scanned separately).
+    """
+    import sqlglot
+    from sqlglot import exp
+
+    expression = sqlglot.parse_one(sql, read=SQLGLOT_DIALECTS.get(dialect))
+    ctes = {cte.alias_or_name.lower() for cte in expression.find_all(exp.CTE)}
+    targets: Dict[str, Optional[str]] = {sub.alias.lower(): None for sub in expression.find_all(exp.Subquery) if sub.alias}
+    for table in expression.find_all(exp.Table):
+        name = None if table.name.lower() in ctes else table.name
+        targets[table.name.lower()] = name
+        targets[table.alias_or_name.lower()] = name
+    targets.update(dict.fromkeys(ctes))
+    return targets
+
+
+def estimate_rows(engine, sql: str) -> Optional[int]:
+    """
+    Rows the database expects to examine for a statement, from EXPLAIN. Nested-loop joins
+    multiply, separate query blocks add up. Returns None for dialects without an estimate.
+    Raises SQLGuardError when a SQLite plan scans something that can't be tied to a table.
+    """
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "mysql":
+            blocks: Dict[Any, int] = {}
+            for row in conn.execute(text(f"EXPLAIN {sql}")).mappings():
+                rows = int(row.get("rows") or 1)
+                filtered = float(row.get("filtered") or 100) / 100
+                blocks[row.get("id")] = int(blocks.get(row.get("id"), 1) * max(1, rows * filtered))
+            return sum(blocks.values())
+        if dialect == "sqlite":
+            # SQLite has no row estimates: a full SCAN costs the table's row count, index SEARCHes are assumed cheap.
+            # Plans name tables by their alias, so scans are mapped back through the parsed query.
+            targets = _scan_targets(sql, dialect)
+            total = 0
+            for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")):
+                detail = row[-1]
+                match = re.match(r"SCAN (?:TABLE )?(\S+)", detail)
+                if (not match or detail.startswith(("SCAN CONSTANT ROW", "SCAN SUBQUERY", "SCAN ("))
+                        or re.search(r"\bUSING (?:COVERING )?INDEX\b", detail)):
+                    continue
+                name = match.group(1).lower()
+                if name not in targets:
+                    raise SQLGuardError(f"Could not tell which table the plan step '{detail}' scans")
+                if targets[name] is not None:
+                    total += _sqlite_row_count(conn, engine, targets[name])
+            return total
+        if dialect == "postgresql":
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            node = plan[0]["Plan"]
+            # A LIMIT caps the rows returned, not the rows read below it
+            while node.get("Node Type") == "Limit" and node.get("Plans"):
+                node = node["Plans"][0]
+            return int(node["Plan Rows"])
+    return None
+
+
+def _stops_at_limit(sql: str, dialect: str) -> bool:
+    """Whether a LIMIT ends the read early: a plain SELECT without WHERE, ORDER BY or aggregation."""
+    import sqlglot
+    from sqlglot import exp
+    expression = sqlglot.parse_one(sql, read=SQLGLOT_DIALECTS.get(dialect))
+    return isinstance(expression, exp.Select) and not (
+        expression.find(exp.Where) or expression.args.get("order") or expression.args.get("group")
+        or any(select.find(exp.AggFunc) for select in expression.selects)
+    )
+
+
+def enforce_budget(engine, sql: str, budget: int = SQL_GUARD_SCAN_BUDGET,
+                   action: str = SQL_GUARD_BUDGET_ACTION) -> str:
+    """
+    Estimate the cost of a prepared statement and refuse it, or tighten its LIMIT, when
+    it would examine more than `budget` rows. A smaller LIMIT only shortens the read when
+    rows are returned in scan order as they are read, so a filtered, ordered or aggregated
+    query is rewritten only if EXPLAIN puts the rewritten statement within budget.
+    """
+    if budget <= 0:
+        return sql
+    try:
+        estimated = estimate_rows(engine, sql)
+    except SQLGuardError as e:
+        # An unresolved scan could read any number of rows, so it counts as over budget
+        logger.info(f"{e}; treating the query as over budget")
+        estimated = None
+    except Exception as e:
+        # An EXPLAIN failure usually means the query itself is invalid; let execution report it
+        logger.error(f"Error estimating query cost: {e}")
+        return sql
+    else:
+        if estimated is None or estimated <= budget:
+            return sql
+
+    dialect = engine.dialect.name
+    amount = f"about {estimated}" if estimated is not None else "an unknown number of"
+    if action == "rewrite":
+        rewritten = prepare_query(sql, dialect, max_rows=SQL_GUARD_BUDGET_ROWS)
+        if _stops_at_limit(sql, dialect) or _within_budget(engine, rewritten, budget):
+            logger.info(f"Query would examine {amount} rows, limiting it to {SQL_GUARD_BUDGET_ROWS} rows")
+            return rewritten
+    raise SQLGuardError(
+        f"The query would examine {amount} rows, more than the allowed {budget}. Try a more specific question."
+    )
+
+
+def _within_budget(engine, sql: str, budget: int) -> bool:
+    try:
+        estimated = estimate_rows(engine, sql)
+    except Exception as e:
+        logger.error(f"Error estimating the cost of the rewritten query: {e}")
+        return False
+    return estimated is not None and estimated <= budget
+
+
+def add_timeout_hint(sql: str, dialect: str, timeout_ms: int = SQL_GUARD_TIMEOUT_MS) -> str:
+    """
+    Ask the server to abort the statement after timeout_ms (MySQL optimizer hint). The hint
+    goes on the outermost SELECT, which follows any WITH clause and leads a UNION.
+    """
+    if timeout_ms <= 0 or dialect != "mysql" or "MAX_EXECUTION_TIME" in sql.upper():
+        return sql
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+
+    try:
+        expression = sqlglot.parse_one(sql, read="mysql")
+    except ParseError as e:
+        logger.error(f"Could not add a timeout hint: {e}")
+        return sql
+    select = expression
+    while isinstance(select, (exp.SetOperation, exp.Subquery)):
+        select = select.this
+    if not isinstance(select, exp.Select):
+        return sql
+    hint = exp.Anonymous(this="MAX_EXECUTION_TIME", expressions=[exp.Literal.number(int(timeout_ms))])
+    select.set("hint", exp.Hint(expressions=[*(select.args["hint"].expressions if select.args.get("hint") else []), hint]))
+    return expression.sql(dialect="mysql")
@@ -1,16 +1,29 @@
-import streamlit as st
-from langchain.chains.openai_tools import create_extraction_chain_pydantic
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from typing import List, Dict, Any
-from db_utils import get_database, get_table_info
+from typing import List, Dict, Any, Optional
+from db_utils import get_database
+from schema_snapshot import get_schema_snapshot
+from fallback_search import STOP_WORDS
+from table_selection_cache import get_table_selection_cache
+from prompt_builder import report_prompt, table_selection_message
+from llm_utils import get_llm
+from runtime import add_event_handler, cache_resource, report_error
 from operator import itemgetter
 from dotenv import load_dotenv
+import logging
 import os
 import re
 
 # Load environment variables at module level
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Weights of question terms found in a table name or one of its column names
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 2.0
+# The pre-classifier decides without the LLM when the best table scores at least this much
+# and at least TABLE_SELECTION_DECISIVE_RATIO times the runner-up
+TABLE_SELECTION_DECISIVE_SCORE = float(os.getenv("table_selection_decisive_score", "3"))
+TABLE_SELECTION_DECISIVE_RATIO = float(os.getenv("table_selection_decisive_ratio", "2"))
 
 class Table(BaseModel):
     """Table in SQL database."""
@@ -46,65 +59,103 @@ def normalize_question(question: str) -> str:
     
     return question.strip()
 
-@st.cache_resource
-def get_table_selection_chain():
-    """Create the table selection chain with improved system message."""
-    try:
-        llm = ChatOpenAI(
-            model="gpt-4o",
-            temperature=0,
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-        db = get_database()
-        table_info = get_table_info(db)
-        
-        system_message = f"""Analyze the user's question and determine which database tables are most relevant to answering it.
-The database schema is:
-
-{table_info}
-
-For each table, provide:
-1. The table name
-2. A confidence score (0-1) indicating how relevant this table is to the question
+def tokenize(value: str) -> List[str]:
+    """Split text or identifiers into lowercase, roughly singularised terms."""
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", str(value).lower().replace("_", " ")):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
 
-Consider:
-- The subject matter of the question (what entity or information is being asked about)
-- The type of attributes being queried
-- Similar questions might need different tables depending on specific details
+def preclassify_tables(snapshot, normalized_question: str) -> Optional[List[str]]:
+    """
+    Pick the table from table and column name matches alone when one table clearly wins.
+    Returns None when the match is not decisive and the LLM should decide.
+    """
+    question_terms = {term for term in tokenize(normalized_question) if term not in STOP_WORDS and len(term) > 2}
+    scores = {}
+    for table_name in snapshot.get_table_names():
+        table_terms = set(tokenize(table_name))
+        column_terms = {term for col in snapshot.get_columns(table_name) for term in tokenize(col["name"])}
+        scores[table_name] = sum(
+            (TABLE_NAME_WEIGHT if term in table_terms else 0) + (COLUMN_NAME_WEIGHT if term in column_terms else 0)
+            for term in question_terms
+        )
+    
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if not ranked or scores[ranked[0]] < TABLE_SELECTION_DECISIVE_SCORE:
+        return None
+    runner_up = scores[ranked[1]] if len(ranked) > 1 else 0
+    if scores[ranked[0]] < TABLE_SELECTION_DECISIVE_RATIO * runner_up:
+        return None
+    return [ranked[0]]
 
-Return ALL tables that might contain relevant information, with appropriate confidence scores.
-"""
+@cache_resource
+def get_table_selection_chain(db=None):
+    """Create the table selection chain with improved system message, for one database (defaults to the configured one)."""
+    try:
+        # Imported here: the extraction chain pulls in most of langchain and is only needed on a pruning miss
+        from langchain.chains.openai_tools import create_extraction_chain_pydantic
+        
+        llm = get_llm()
+        db = db or get_database()
+        # Starts with the same schema block as the SQL prompt
+        system_message = table_selection_message(db)
         
         return create_extraction_chain_pydantic(Table, llm, system_message=system_message)
     except Exception as e:
-        st.error(f"Error creating table selection chain: {str(e)}")
+        report_error(f"Error creating table selection chain: {str(e)}", e)
         raise
 
-def select_relevant_tables(question: str) -> List[str]:
-    """Select relevant tables for a given question with improved preprocessing."""
+def select_relevant_tables(question: str, db=None) -> List[str]:
+    """
+    Select relevant tables for a given question with improved preprocessing. A decisive
+    name match or an earlier selection for the same normalized question skips the LLM.
+    """
     try:
-        chain = get_table_selection_chain()
+        db = db or get_database()
+        snapshot = get_schema_snapshot(db)
         normalized_question = normalize_question(question)
         
+        table_names = preclassify_tables(snapshot, normalized_question)
+        if table_names:
+            return table_names
+        
+        cache = get_table_selection_cache()
+        if cache is not None:
+            try:
+                table_names = cache.get(normalized_question, snapshot.fingerprint)
+            except Exception as e:
+                logger.error(f"Table selection cache lookup failed: {e}")
+            if table_names:
+                return table_names
+        
         # Execute chain with normalized question
-        tables_with_confidence = chain.run(normalized_question)
+        chain = get_table_selection_chain(db)
+        report_prompt("table_selection", [table_selection_message(db), normalized_question])
+        tables_with_confidence = chain.invoke({"input": normalized_question})
         
         # Get table names from results, sorted by confidence
         table_names = get_tables(tables_with_confidence)
         
         # If no tables meet the confidence threshold, return all tables as fallback
         if not table_names:
-            db = get_database()
-            engine = db._engine
-            inspector = inspect(engine)
-            table_names = inspector.get_table_names()
-            
+            return snapshot.get_table_names()
+        
+        if cache is not None:
+            try:
+                cache.put(normalized_question, snapshot.fingerprint, table_names)
+            except Exception as e:
+                logger.error(f"Table selection cache update failed: {e}")
         return table_names
     except Exception as e:
-        st.error(f"Error selecting relevant tables: {str(e)}")
-        # Return all tables as fallback in case of error
-        db = get_database()
-        engine = db._engine
-        from sqlalchemy import inspect
-        inspector = inspect(engine)
-        return inspector.get_table_names()
\ No newline at end of file
+        report_error(f"Error selecting relevant tables: {str(e)}", e)
+        # Return all tables as fallback in case of error, from the cached schema snapshot
+        return get_schema_snapshot(db or get_database()).get_table_names()
+
+def _forget_tenant(event: str, payload: Dict[str, Any]) -> None:
+    if event == "tenant_evicted":
+        get_table_selection_chain.forget(payload["db"])
+
+add_event_handler(_forget_tenant)
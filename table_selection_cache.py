@@ -0,0 +1,99 @@
+from typing import Iterator, List, Optional
+from contextlib import contextmanager
+from instrumentation import record_cache
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TABLE_SELECTION_CACHE_ENABLED = os.getenv("table_selection_cache_enabled", "true").lower() in ("1", "true", "yes")
+# SQLite file shared by every worker on the host
+TABLE_SELECTION_CACHE_PATH = os.getenv(
+    "table_selection_cache_path", os.path.join(tempfile.gettempdir(), "nl_to_sql_table_selection.sqlite")
+)
+TABLE_SELECTION_CACHE_TTL = float(os.getenv("table_selection_cache_ttl", "604800"))
+TABLE_SELECTION_CACHE_MAX_ENTRIES = int(os.getenv("table_selection_cache_max_entries", "10000"))
+
+_cache: Optional["TableSelectionCache"] = None
+_cache_lock = threading.Lock()
+
+
+class TableSelectionCache:
+    """
+    Persistent normalized question -> selected tables map, keyed by schema fingerprint
+    so a schema change never serves stale selections. Stored in SQLite so separate
+    worker processes share the LLM calls already made.
+    """
+
+    def __init__(self, path: str, ttl: float = TABLE_SELECTION_CACHE_TTL,
+                 max_entries: int = TABLE_SELECTION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._puts = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS selections ("
+                "question TEXT, fingerprint TEXT, tables TEXT, created_at REAL, "
+                "PRIMARY KEY (question, fingerprint))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS selections_created_at ON selections (created_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, question: str, fingerprint: str) -> Optional[List[str]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT tables FROM selections WHERE question = ? AND fingerprint = ? AND created_at > ?",
+                (question, fingerprint, time.time() - self.ttl)
+            ).fetchone()
+        record_cache("table_selection", row is not None)
+        return json.loads(row[0]) if row else None
+
+    def put(self, question: str, fingerprint: str, tables: List[str]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO selections (question, fingerprint, tables, created_at) VALUES (?, ?, ?, ?)",
+                (question, fingerprint, json.dumps(tables), time.time())
+            )
+            # Trim expired and excess entries now and then rather than on every write
+            self._puts += 1
+            if self._puts % 100 == 1:
+                conn.execute("DELETE FROM selections WHERE created_at <= ?", (time.time() - self.ttl,))
+                conn.execute(
+                    "DELETE FROM selections WHERE rowid NOT IN "
+                    "(SELECT rowid FROM selections ORDER BY created_at DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM selections")
+
+
+def get_table_selection_cache() -> Optional[TableSelectionCache]:
+    """Return the process-wide table selection cache, or None when it is disabled or unusable."""
+    global _cache
+    if not TABLE_SELECTION_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = TableSelectionCache(TABLE_SELECTION_CACHE_PATH)
+            except sqlite3.Error as e:
+                logger.error(f"Error opening table selection cache {TABLE_SELECTION_CACHE_PATH}: {e}")
+                return None
+        return _cache
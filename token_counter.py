@@ -0,0 +1,27 @@
+from functools import lru_cache
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Model whose tokenizer is used to count prompt tokens
+TOKENIZER_MODEL = os.getenv("tokenizer_model", "gpt-4o")
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Load the tiktoken encoding for a model, or None when it is unavailable (e.g. offline)."""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning(f"Tokenizer for {model} unavailable, estimating token counts: {e}")
+        return None
+
+def count_tokens(text: str, model: str = TOKENIZER_MODEL) -> int:
+    """Count the tokens of a prompt string, falling back to a 4-characters-per-token estimate."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))